@@ -1,12 +1,29 @@
 """
 Functions relating to the http://auroraslive.io API.
+
+A site's probability can also be estimated offline from the global three-day
+Kp forecast, which is registered as a backend for the 'aurora' kind of data
+and used if the API fails.
 """
 ###############################################################################
 # IMPORTS
 ###############################################################################
-# Importing requests to handle calling API urls.
-# It may be necessary to pip install requests
-import requests
+# Time and Lock keep one copy of the three-day forecast for all threads
+import time
+from threading import Lock
+
+# Shared HTTP client handles calling API urls and request errors
+from apis.http_client import get_json
+# Cache layer in front of the API
+from apis.response_cache import cached_api_call
+# Registry of the backends for each kind of data, with hedged requests
+from apis.registry import fetch, register
+# Decorator that labels the call's metrics with its provider
+from metrics import api_call
+
+# Offline aurora visibility model
+from ephemeris.geomagnetic import geomagnetic_latitude, aurora_probability, \
+    aurora_colour
 
 # Logging modules
 from logger import logging_setup
@@ -14,7 +31,12 @@ from logger import logging_setup
 ###############################################################################
 # VARIABLES
 ###############################################################################
-from config import AURORA_API_URL
+from config import AURORA_API_URL, CACHE_TTLS
+
+# The global three-day forecast, kept in memory so a whole batch of sites
+# makes one request for it.
+_THREEDAY = {'response': None, 'expires_at': 0.0}
+_THREEDAY_LOCK = Lock()
 
 
 ###############################################################################
@@ -26,7 +48,8 @@ logger = logging_setup(__name__)
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
-def aurora_api_call(lat: float, lng: float, data: str) -> dict | None:
+@api_call('aurora')
+def aurora_request(lat: float, lng: float, data: str) -> dict | None:
     """
     Calls http://auroraslive.io/#/api/v1 API (no key needed) to request an
     aurora forecast.
@@ -47,7 +70,7 @@ def aurora_api_call(lat: float, lng: float, data: str) -> dict | None:
         data: which data from the ace module should be returned 'threeday'
         and 'probability' will be used in this app.
     """
-    logger.info('Running aurora_api_call.')
+    logger.info('Running aurora_request.')
 
     params = {
         'type': 'ace',
@@ -56,29 +79,72 @@ def aurora_api_call(lat: float, lng: float, data: str) -> dict | None:
         'tz': -60,
         'data': data
     }
-    try:
-        # Trying to call the Aurora API using the params
-        response = requests.get(AURORA_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.Timeout:
-        # Raise and log an exception if the connection times out.
-        logger.exception('%s timed out', AURORA_API_URL)
-    except requests.exceptions.ConnectionError:
-        # Raise and log an exception for a connection error.
-        logger.exception('Failed to connect to %s', AURORA_API_URL)
-    except requests.exceptions.HTTPError:
-        # Raise and log an exception if the status code is for 4xx or 5xx errors
-        logger.exception('%s gave an unsuccessful status code', AURORA_API_URL)
-    except requests.exceptions.RequestException:
-        # Raise and log all other request exceptions.
-        logger.exception('An error occurred calling %s', AURORA_API_URL)
-    else:
-        logger.debug('Aurora API response is: %s', response)
-        # Checking request was successful by looking for status code 200 and
-        # returning the API response in a JSON format
-        if response.status_code == 200:
-            return response.json()
-    # If an error occurred, the app will print that the API call was
-    # unsuccessful and return None
-    print('An error occurred trying to call auroraslive.io')
-    return None
+    # Calling the Aurora API using the params on the shared HTTP client, unless
+    # the response is already cached
+    return cached_api_call(
+        'aurora', lat, lng, params,
+        lambda: get_json(AURORA_API_URL, params, 'auroraslive.io'))
+
+
+def aurora_local_probability(user_lat: float,
+                             user_lng: float,
+                             aurora_3day_api_response: dict) -> dict:
+    """
+    Estimates the probability of seeing the aurora tonight from the site's
+    geomagnetic latitude and the highest Kp value forecast for today, shaped
+    like the aurora_api_call 'probability' response.
+    """
+    tonight_kp = max(float(period['value'])
+                     for period in aurora_3day_api_response['values'][0])
+    probability = aurora_probability(
+        geomagnetic_latitude(user_lat, user_lng), tonight_kp)
+    return {'value': int(round(float(probability))),
+            'colour': str(aurora_colour(probability))}
+
+
+@register('aurora', 'geomagnetic')
+def aurora_geomagnetic_estimate(lat: float,
+                                lng: float,
+                                data: str) -> dict | None:
+    """
+    Estimates the 'probability' data offline with aurora_local_probability,
+    from the shared three-day forecast. Returns None for any other data, or
+    if the three-day forecast can't be had.
+    """
+    if data != 'probability':
+        return None
+    aurora_3day_api_response = aurora_threeday_call()
+    if aurora_3day_api_response is None:
+        return None
+    return aurora_local_probability(lat, lng, aurora_3day_api_response)
+
+
+def aurora_api_call(lat: float, lng: float, data: str) -> dict | None:
+    """
+    Gets the aurora data with aurora_request, or the other backends
+    registered for the 'aurora' kind of data if it fails.
+
+    Returns:
+        dict: The response, as aurora_request gives it.
+        None: If no backend answered.
+    """
+    return fetch('aurora', aurora_request, lat=lat, lng=lng, data=data)
+
+
+def aurora_threeday_call() -> dict | None:
+    """
+    Returns the three-day Kp forecast. The Kp index is global, so the forecast
+    is requested once and shared by every site until the aurora TTL from
+    config.ini runs out. Threads asking at the same time wait for the one
+    request rather than making their own.
+    """
+    with _THREEDAY_LOCK:
+        if _THREEDAY['response'] is None or \
+                time.time() >= _THREEDAY['expires_at']:
+            # The location doesn't change the Kp forecast, so 0, 0 is used
+            response = aurora_api_call(lat=0.0, lng=0.0, data='threeday')
+            if response is not None:
+                _THREEDAY['response'] = response
+                _THREEDAY['expires_at'] = time.time() + CACHE_TTLS['aurora']
+            return response
+        return _THREEDAY['response']
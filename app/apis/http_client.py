@@ -0,0 +1,241 @@
+"""
+Shared HTTP client used by all of the API modules.
+
+A single requests.Session keeps a keep-alive connection pool per host, so
+repeated calls to the same API reuse the TCP and TLS connection instead of
+opening a new one every time. Failed requests are retried, and providers
+that keep failing are skipped, with the tools in resilience.py.
+
+requests and the transport adapters are imported lazily, when the first
+request is made, so a run answered entirely from the response cache or the
+offline engines never loads them.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+
+# Lock so only one thread creates the shared session
+from threading import Lock
+
+# Function to import requests only when a request is made
+from utils.import_utils import lazy_import
+
+# Logging modules
+from logger import logging_setup
+
+# Retries, circuit breakers and the deadline of the current build
+from apis.resilience import breaker_for, backoff_delay, time_left, \
+    cancelled, RETRY_STATUSES
+
+# Functions to record each request's latency, size, errors and retries
+from metrics import current_provider, record_request, record_retry, \
+    record_skipped
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, \
+    READ_TIMEOUT, RETRY_ATTEMPTS
+
+# Importing requests to handle calling API urls, and the adapter that calls
+# the APIs, records them or replays recordings.
+# It may be necessary to pip install requests
+requests = lazy_import('requests')
+transport = lazy_import('apis.transport')
+
+# The shared session is created on first use by get_session
+_SESSION = None
+_SESSION_LOCK = Lock()
+
+# perf_counter time the first request was sent, for main.py's --timing
+_FIRST_REQUEST = None
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def get_session() -> 'requests.Session':
+    """
+    Returns the shared requests.Session, creating it on the first call.
+
+    The session's adapter keeps up to POOL_CONNECTIONS host pools, each with
+    up to POOL_MAXSIZE keep-alive connections, and asks for gzip encoded
+    responses. It records or replays the responses if TRANSPORT_MODE says
+    to.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            logger.info('Creating shared HTTP session.')
+            session = requests.Session()
+            adapter = transport.transport_adapter(
+                pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _SESSION = session
+    return _SESSION
+
+
+def first_request_time() -> float | None:
+    """
+    Returns the perf_counter time the first request was sent, or None if no
+    request has been made.
+    """
+    return _FIRST_REQUEST
+
+
+def mount_adapter(adapter) -> None:
+    """
+    Sends every request on the shared session through adapter instead of the
+    one chosen by TRANSPORT_MODE, e.g. to benchmark against synthetic
+    responses.
+    """
+    session = get_session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def send_request(url: str, params: dict, timeout: tuple,
+                 status_messages: dict | None) -> tuple:
+    """
+    Makes one GET request on the shared session, logging any error and
+    recording its latency, response size and class of error with
+    record_request.
+
+    Returns:
+        tuple: (body, error, retryable). body is the JSON response, or None
+        if the request failed. error is the class of error, or None.
+        retryable is True if the error might go away on a retry.
+    """
+    start = time.perf_counter()
+    try:
+        # Trying to call the API using the params
+        response = get_session().get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.Timeout:
+        # Raise and log an exception if the connection times out.
+        logger.exception('%s timed out', url)
+        error, retryable = 'Timeout', True
+    except requests.exceptions.ConnectionError:
+        # Raise and log an exception for a connection error.
+        logger.exception('Failed to connect to %s', url)
+        error, retryable = 'ConnectionError', True
+    except requests.exceptions.HTTPError:
+        # Raise and log an exception if the status code is for 4xx or 5xx errors
+        logger.exception('%s gave an unsuccessful status code', url)
+        if status_messages and response.status_code in status_messages:
+            print(status_messages[response.status_code])
+        error = f'HTTP {response.status_code}'
+        retryable = response.status_code in RETRY_STATUSES
+    except requests.exceptions.RequestException as e:
+        # Raise and log all other request exceptions.
+        logger.exception('An error occurred calling %s', url)
+        error, retryable = type(e).__name__, False
+    else:
+        # Checking request was successful by looking for status code 200 and
+        # returning the API response in a JSON format
+        if response.status_code != 200:
+            error, retryable = f'HTTP {response.status_code}', False
+        else:
+            try:
+                body = response.json()
+            except ValueError:
+                # requests' JSONDecodeError, e.g. an HTML error page
+                logger.exception('%s answered with a body that is not JSON',
+                                 url)
+                error, retryable = 'InvalidJSON', False
+            else:
+                # The bytes on the wire, which are compressed if the API gzips
+                size = int(response.headers.get('Content-Length',
+                                                len(response.content)))
+                record_request(time.perf_counter() - start, size)
+                # Only the size is logged, as the body can be kilobytes long
+                logger.debug('%s answered with %s bytes', url, size)
+                return body, None, False
+    record_request(time.perf_counter() - start, 0, error)
+    return None, error, retryable
+
+
+def get_json(url: str,
+             params: dict,
+             description: str,
+             status_messages: dict | None = None) -> dict | None:
+    """
+    Calls an API with a GET request on the shared session and returns the
+    JSON response.
+
+    A request that times out, can't connect or gets a RETRY_STATUSES status
+    is tried again after backoff_delay, up to RETRY_ATTEMPTS times in all.
+    No request is made while the provider's circuit is open, or once the
+    call has been cancelled, and none is started after the deadline of the
+    current build, which also caps the timeouts.
+
+    Any request error is logged in one place. If the call fails, the app
+    prints that the API call was unsuccessful and None is returned.
+
+    Parameters:
+        url (str): The full URL to call.
+        params (dict): Query string parameters for the request.
+        description (str): Name of the API used in the printed error message.
+        status_messages (dict): Optional messages to print for specific 4xx
+            or 5xx status codes, keyed by status code.
+
+    Returns:
+        dict: The API response in a JSON format.
+        None: If the call was unsuccessful.
+    """
+    global _FIRST_REQUEST  # pylint: disable=global-statement
+    if _FIRST_REQUEST is None:
+        _FIRST_REQUEST = time.perf_counter()
+    breaker = breaker_for(current_provider())
+    for attempt in range(RETRY_ATTEMPTS):
+        remaining = time_left()
+        skipped = None
+        if cancelled():
+            skipped = 'Cancelled'
+        elif remaining is not None and remaining <= 0:
+            skipped = 'DeadlineExceeded'
+        # allow() is asked last, as it takes the trial call of a half open
+        # circuit
+        elif not breaker.allow():
+            skipped = 'CircuitOpen'
+        if skipped:
+            logger.warning('Skipped calling %s: %s', url, skipped)
+            record_skipped(skipped)
+            break
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT) if remaining is None else \
+            (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+        body, error, retryable = send_request(url, params, timeout,
+                                              status_messages)
+        if not retryable:
+            # The API answered, even if it was with an error, but a body
+            # that isn't JSON is as useless as no answer
+            if error == 'InvalidJSON':
+                breaker.failure()
+            else:
+                breaker.success()
+            if error is None:
+                return body
+            break
+        breaker.failure()
+        delay = backoff_delay(attempt)
+        remaining = time_left()
+        if attempt + 1 == RETRY_ATTEMPTS or \
+                (remaining is not None and delay >= remaining):
+            break
+        logger.info('Retrying %s in %.2f s after %s', url, delay, error)
+        record_retry()
+        time.sleep(delay)
+    # If an error occurred, the app will print that the API call was
+    # unsuccessful and return None
+    print(f'An error occurred trying to call {description}')
+    return None
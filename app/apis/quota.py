@@ -0,0 +1,297 @@
+"""
+Rate limiting and cost accounting for the Visual Crossing API key quota.
+
+Visual Crossing meters its API keys in records: a request costs one record
+for each day of data, or one for each hour if it includes the hours. Every
+request is first given records on one of the API keys, taking the user's key
+and the extra keys in config.ini in turn, from a ledger of the records each
+key has used today. The ledger is kept in a SQLite file so later runs on the
+same day, and other processes running at the same time, e.g. the workers of
+grid.py, know what is left. A token bucket then spreads the records spent
+over time, so a batch doesn't use the whole quota in a burst.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import hashlib
+import os
+import sqlite3
+import time
+
+# Tools for the shared quota and the day the ledger is for
+from datetime import datetime, timezone
+from threading import Lock
+
+# The deadline a wait for the rate limit must finish by
+from apis.resilience import time_left
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import QUOTA_DAILY_RECORDS, QUOTA_LEDGER_PATH, \
+    QUOTA_RECORDS_PER_SECOND, QUOTA_BURST, VC_API_KEYS
+
+# Records a day of hourly data costs
+HOURS_PER_DAY = 24
+
+# The shared quota is created on first use by get_quota
+_QUOTA = None
+_QUOTA_LOCK = Lock()
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """
+    Lets records be spent at rate a second on average, with bursts of up
+    to capacity. A rate of 0 doesn't limit them.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def take(self, amount: float) -> bool:
+        """
+        Takes amount tokens, waiting for the bucket to refill if needed. An
+        amount bigger than the capacity waits for a full bucket.
+
+        Returns:
+            bool: True, or False without taking any if the wait would pass
+            the deadline of the current build.
+        """
+        if self.rate <= 0:
+            return True
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+            remaining = time_left()
+            if remaining is not None and wait > remaining:
+                return False
+            time.sleep(wait)
+
+
+class Ledger:
+    """
+    The records each API key has used each day, in UTC, in a SQLite file
+    that every process using the quota shares. Keys are stored as a hash,
+    never as the key itself. Days before today are dropped when the ledger
+    is opened.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.pid = None
+        self.conn = None
+        with self.lock:
+            self._connect().execute(
+                'CREATE TABLE IF NOT EXISTS ledger ('
+                'day TEXT, key TEXT, records INTEGER, '
+                'PRIMARY KEY (day, key))')
+            self.conn.execute('DELETE FROM ledger WHERE day < ?', (today(),))
+
+    def used(self, api_key: str) -> int:
+        """Returns the records api_key has used today."""
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT records FROM ledger WHERE day = ? AND key = ?',
+                (today(), key_id(api_key))).fetchone()
+        return row[0] if row else 0
+
+    def add(self, api_key: str, records: int, limit: int | None = None
+            ) -> bool:
+        """
+        Adds records, which may be negative for a refund, to api_key. The
+        count is read and updated in one transaction that holds the file's
+        write lock, so processes sharing the ledger never go over limit
+        together.
+
+        Parameters:
+            api_key (str): The key the records are for.
+            records (int): Records to add.
+            limit (int): Records api_key may use today, or None for no limit.
+
+        Returns:
+            bool: True, or False without adding any if the records would
+            take api_key over limit.
+        """
+        day, name = today(), key_id(api_key)
+        with self.lock:
+            conn = self._connect()
+            # IMMEDIATE takes the write lock before the count is read
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT records FROM ledger WHERE day = ? AND key = ?',
+                    (day, name)).fetchone()
+                used = row[0] if row else 0
+                added = limit is None or used + records <= limit
+                if added:
+                    conn.execute('INSERT OR REPLACE INTO ledger '
+                                 '(day, key, records) VALUES (?, ?, ?)',
+                                 (day, name, max(0, used + records)))
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        return added
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection of this process, opening a new one in a
+        forked worker, as a SQLite connection can't be shared with it.
+        """
+        if self.pid != os.getpid():
+            # Transactions are begun by hand in add
+            self.conn = sqlite3.connect(self.path, timeout=30,
+                                        check_same_thread=False,
+                                        isolation_level=None)
+            self.pid = os.getpid()
+        return self.conn
+
+
+class Quota:
+    """
+    Gives each request records on one of the API keys in turn, from the
+    ledger, and then from the token bucket.
+
+    Parameters:
+        ledger (Ledger): The records used today by each key.
+        bucket (TokenBucket): The rate limit on spending records.
+        daily_records (int): Records each key may use a day.
+        keys (tuple): Extra API keys used in turn with the user's key.
+    """
+    def __init__(self,
+                 ledger: Ledger,
+                 bucket: TokenBucket,
+                 daily_records: int = QUOTA_DAILY_RECORDS,
+                 keys: tuple = VC_API_KEYS):
+        self.ledger = ledger
+        self.bucket = bucket
+        self.daily_records = daily_records
+        self.keys = keys
+        self.turn = 0
+        self.lock = Lock()
+
+    def pool(self, api_key: str) -> tuple:
+        """Returns the user's api_key and the extra keys, without repeats."""
+        return tuple(dict.fromkeys(key for key in (api_key,) + self.keys
+                                   if key != 'xxx'))
+
+    def remaining(self, api_key: str) -> int:
+        """Returns the records left today on all the keys of the pool."""
+        return sum(max(0, self.daily_records - self.ledger.used(key))
+                   for key in self.pool(api_key))
+
+    def acquire(self, api_key: str, cost: int) -> tuple:
+        """
+        Takes cost records from the next key of the pool with enough left,
+        then waits for the rate limit.
+
+        Returns:
+            tuple: (key to make the request with, None), or (None, the
+            class of error) if no key has cost records left or the rate
+            limit would pass the deadline.
+        """
+        keys = self.pool(api_key)
+        with self.lock:
+            for offset in range(len(keys)):
+                key = keys[(self.turn + offset) % len(keys)]
+                if self.ledger.add(key, cost, self.daily_records):
+                    self.turn = (self.turn + offset + 1) % len(keys)
+                    break
+            else:
+                return None, 'QuotaExhausted'
+        if not self.bucket.take(cost):
+            self.ledger.add(key, -cost)
+            return None, 'RateLimited'
+        return key, None
+
+    def settle(self, api_key: str, taken: int, cost: int) -> None:
+        """
+        Corrects the taken records once the request's real cost is known, 0
+        if it failed and wasn't charged.
+        """
+        if cost != taken:
+            self.ledger.add(api_key, cost - taken)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def today() -> str:
+    """Returns today's date in UTC, when the quota is reset."""
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def key_id(api_key: str) -> str:
+    """Returns a short hash that names api_key in the ledger and logs."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def request_cost(query: dict, days: int) -> int:
+    """
+    Returns the records a request with query's include param costs for
+    days days of data.
+    """
+    if 'hours' in query['include'].split(','):
+        return days * HOURS_PER_DAY
+    return days
+
+
+def get_quota() -> Quota:
+    """Returns the shared Quota, creating it on the first call."""
+    global _QUOTA  # pylint: disable=global-statement
+    with _QUOTA_LOCK:
+        if _QUOTA is None:
+            _QUOTA = Quota(Ledger(QUOTA_LEDGER_PATH),
+                           TokenBucket(QUOTA_RECORDS_PER_SECOND, QUOTA_BURST))
+    return _QUOTA
+
+
+def set_quota(quota: Quota | None) -> None:
+    """
+    Replaces the shared quota, e.g. with one in a temporary file for a
+    test, or with None to load the ledger again on next use.
+    """
+    global _QUOTA  # pylint: disable=global-statement
+    with _QUOTA_LOCK:
+        _QUOTA = quota
+
+
+def log_quota(api_key: str) -> int:
+    """
+    Logs the records left today on each key of the pool.
+
+    Returns:
+        int: The records left on all of them.
+    """
+    quota = get_quota()
+    for key in quota.pool(api_key):
+        logger.info('Visual Crossing key %s has used %s of %s records today.',
+                    key_id(key), quota.ledger.used(key), quota.daily_records)
+    return quota.remaining(api_key)
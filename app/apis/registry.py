@@ -0,0 +1,246 @@
+"""
+Registry of the backends for each kind of data, with hedged requests.
+
+Each kind of data ('sun', 'lunar', 'cloud', 'lunar_cloud' and 'aurora') is
+fetched from its remote API by the *_api_call function of its module, and any
+number of other backends, e.g. an offline engine, can be registered for it.
+fetch runs the remote call first. For the HEDGE_KINDS, if it hasn't answered
+once the HEDGE_PERCENTILE percentile of its recent latencies has passed, a
+second request to the same API is raced against it. The first answer wins
+and the other is cancelled. Only the API is raced, so an offline estimate
+never replaces data the API was about to give. The other backends are only
+tried, in turn, once the remote calls have failed.
+
+A cancelled call makes no more requests, but a request already sent can't be
+aborted, so its response is only used to learn the API's latency.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+
+# Tools for the hedge threads, the latencies and the registered backends
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from dataclasses import dataclass
+from threading import Event, Lock
+from typing import Callable
+
+# Function to run a call where losing the race cancels it
+from apis.resilience import cancellable
+# Functions to record the hedged requests and the winning backends
+from metrics import record_hedge, record_winner
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import MAX_WORKERS, HEDGE_KINDS, HEDGE_PERCENTILE, \
+    HEDGE_INITIAL_DELAY, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES
+
+# Recent latencies kept for each kind
+LATENCY_WINDOW = 200
+
+# The backends registered for each kind, in the order they are tried
+_BACKENDS = {}
+_BACKENDS_LOCK = Lock()
+
+# The recent latencies of each kind's remote calls, created on first use
+_LATENCIES = {}
+_LATENCIES_LOCK = Lock()
+
+# Whether the current call is already running in a race, where any call it
+# makes only fails over, so the hedge threads never wait on each other
+_RACING = ContextVar('racing', default=False)
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+@dataclass(frozen=True)
+class Backend:
+    """
+    A backend for one kind of data. Its call takes the same keyword
+    arguments as the kind's *_api_call and returns a response of the same
+    shape, or None if it can't give one.
+    """
+    name: str
+    source: str
+    call: Callable
+
+
+class Latencies:
+    """The recent latencies of a kind's remote calls, in seconds."""
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = Lock()
+
+    def record(self, seconds: float) -> None:
+        """Records the latency of a call that answered."""
+        with self.lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        """
+        Returns the seconds to wait before hedging: the HEDGE_PERCENTILE
+        percentile of the latencies, or HEDGE_INITIAL_DELAY until there are
+        HEDGE_MIN_SAMPLES of them, and at least HEDGE_MIN_DELAY.
+        """
+        with self.lock:
+            ordered = sorted(self.samples)
+        if len(ordered) < HEDGE_MIN_SAMPLES:
+            return max(HEDGE_INITIAL_DELAY, HEDGE_MIN_DELAY)
+        index = min(len(ordered) - 1,
+                    int(len(ordered) * HEDGE_PERCENTILE / 100))
+        return max(ordered[index], HEDGE_MIN_DELAY)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def register(kind: str, name: str, source: str = 'offline'):
+    """
+    Decorator that registers a function as a backend for kind, after any
+    already registered. Registering a name again replaces that backend.
+    """
+    def decorator(function):
+        with _BACKENDS_LOCK:
+            others = [backend for backend in _BACKENDS.get(kind, ())
+                      if backend.name != name]
+            _BACKENDS[kind] = others + [Backend(name, source, function)]
+        return function
+    return decorator
+
+
+def backends(kind: str) -> tuple:
+    """Returns the backends registered for kind, in the order they're tried."""
+    with _BACKENDS_LOCK:
+        return tuple(_BACKENDS.get(kind, ()))
+
+
+def latencies(kind: str) -> Latencies:
+    """Returns the recent latencies of kind's remote calls."""
+    with _LATENCIES_LOCK:
+        if kind not in _LATENCIES:
+            _LATENCIES[kind] = Latencies()
+        return _LATENCIES[kind]
+
+
+def reset_latencies() -> None:
+    """Forgets the latencies of every kind."""
+    with _LATENCIES_LOCK:
+        _LATENCIES.clear()
+
+
+def timed(kind: str, call: Callable) -> Callable:
+    """Returns call wrapped to record its latency when it answers."""
+    def run(**kwargs):
+        start = time.perf_counter()
+        response = call(**kwargs)
+        if response is not None:
+            latencies(kind).record(time.perf_counter() - start)
+        return response
+    return run
+
+
+def in_race(call: Callable, **kwargs):
+    """Runs call as one of the entrants of a race."""
+    _RACING.set(True)
+    return call(**kwargs)
+
+
+def race(kind: str, entrants: list, kwargs: dict):
+    """
+    Starts the first entrant, then the next each time the hedge delay
+    passes without an answer, or at once when the latest one fails. Returns
+    the first answer that isn't None, cancelling the rest, or None if every
+    entrant failed, leaving the caller to record that nothing answered.
+
+    Parameters:
+        kind (str): The kind of data, for the latencies and metrics.
+        entrants (list): (name, call) pairs in the order they are started.
+        kwargs (dict): The keyword arguments of every call.
+    """
+    cancel = Event()
+    waiting = deque(entrants)
+    running = {}
+    try:
+        while waiting or running:
+            if waiting:
+                name, call = waiting.popleft()
+                running[hedge_executor.submit(
+                    cancellable(in_race, cancel), call, **kwargs)] = name
+            done = ()
+            while running and not done:
+                done, _ = wait(running, return_when=FIRST_COMPLETED,
+                               timeout=latencies(kind).hedge_delay()
+                               if waiting else None)
+                if not done and waiting:
+                    record_hedge(kind)
+                    break
+                for future in done:
+                    response = future.result()
+                    if response is not None:
+                        record_winner(kind, running.pop(future))
+                        return response
+                    running.pop(future)
+                # A failed entrant is replaced at once, if none are running
+                done = done and not running
+        return None
+    finally:
+        cancel.set()
+        for future in running:
+            future.cancel()
+
+
+def fail_over(kind: str, entrants: list, kwargs: dict):
+    """Calls each entrant in turn until one answers, returning its answer."""
+    for name, call in entrants:
+        response = call(**kwargs)
+        if response is not None:
+            record_winner(kind, name)
+            return response
+    record_winner(kind, 'none')
+    return None
+
+
+def fetch(kind: str, remote: Callable, **kwargs):
+    """
+    Gets kind of data from the remote API call, hedged by a second request
+    for the HEDGE_KINDS, or else from the backends registered for kind.
+
+    Parameters:
+        kind (str): The kind of data.
+        remote (Callable): The call to the remote API, given by its module.
+        **kwargs: The keyword arguments of the calls.
+
+    Returns:
+        The first answer, shaped like the remote call's, or None if nothing
+        answered.
+    """
+    remote_call = timed(kind, remote)
+    others = [(backend.name, backend.call) for backend in backends(kind)]
+    if kind not in HEDGE_KINDS or _RACING.get():
+        return fail_over(kind, [('remote', remote_call)] + others, kwargs)
+    # The hedge is the same request again, so the answer is always the API's
+    response = race(kind, [('remote', remote_call),
+                           ('remote_hedge', remote_call)], kwargs)
+    if response is not None:
+        return response
+    return fail_over(kind, others, kwargs)
+
+
+# The threads the entrants of every race run on. Entrants only fail over, so
+# they never wait for another thread here.
+hedge_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS * 2,
+                                    thread_name_prefix='hedge')
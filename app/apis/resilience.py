@@ -0,0 +1,191 @@
+"""
+Retries, circuit breakers and deadlines for the API calls.
+
+The shared HTTP client retries a failed GET after a jittered exponential
+backoff, as long as the error might go away on its own, e.g. a timeout or a
+503. Each provider has a circuit breaker that opens after too many failures
+in a row, so a dead API is skipped at once instead of timing out on every
+site, and lets one trial call through once it has cooled down.
+
+A deadline for a whole forecast build is kept in a context variable, so it
+reaches every API call without being passed down by hand. The builders' thread
+pools run their tasks with in_context so the deadline goes with them. A call
+can also be cancelled, e.g. when a hedged request has lost its race, which
+stops it making any more requests.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import random
+import time
+
+# Tools for the per-provider breakers and the deadline of the current build
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from threading import Lock
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import RETRY_BASE_DELAY, RETRY_MAX_DELAY, BREAKER_THRESHOLD, \
+    BREAKER_COOLDOWN
+
+# Status codes worth retrying: rate limited, or the server is in trouble
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# time.monotonic() time the current build must finish by, or None
+_DEADLINE = ContextVar('deadline', default=None)
+
+# threading.Event set when the current call is no longer wanted, or None
+_CANCEL = ContextVar('cancel', default=None)
+
+# The circuit breaker of each provider, created on first use
+_BREAKERS = {}
+_BREAKERS_LOCK = Lock()
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class CircuitBreaker:
+    """
+    Counts a provider's failures in a row. Once there are threshold of them
+    the circuit opens and calls are refused until cooldown seconds have
+    passed. Then one trial call is let through: if it works the circuit
+    closes, otherwise it opens again.
+    """
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD,
+                 cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        """Returns whether a call may be made now."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or \
+                    time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            # Half open: this call is the trial
+            self.trial = True
+            return True
+
+    def success(self) -> None:
+        """Records a call that worked, closing the circuit."""
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info('Circuit for %s closed.', self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self) -> None:
+        """Records a failed call, opening the circuit after threshold."""
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None
+                              and self.failures >= self.threshold):
+                logger.warning('Circuit for %s opened after %s failures.',
+                               self.name, self.failures)
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def breaker_for(provider: str) -> CircuitBreaker:
+    """Returns the provider's circuit breaker."""
+    with _BREAKERS_LOCK:
+        if provider not in _BREAKERS:
+            _BREAKERS[provider] = CircuitBreaker(provider)
+        return _BREAKERS[provider]
+
+
+def reset_breakers() -> None:
+    """Forgets every provider's failures, closing all the circuits."""
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Returns the seconds to wait before retrying after attempt (counting from
+    0): a random time of up to RETRY_BASE_DELAY doubled attempt times,
+    capped at RETRY_MAX_DELAY, so retries from many threads spread out.
+    """
+    return random.uniform(0.0, min(RETRY_MAX_DELAY,
+                                   RETRY_BASE_DELAY * 2 ** attempt))
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Context manager that gives the API calls made inside it seconds to
+    finish in, or no deadline if seconds is 0. An earlier deadline that is
+    already set is kept.
+    """
+    ends = time.monotonic() + seconds if seconds > 0 else None
+    current = _DEADLINE.get()
+    if current is not None and (ends is None or current < ends):
+        ends = current
+    token = _DEADLINE.set(ends)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def time_left() -> float | None:
+    """Returns the seconds left before the deadline, or None if there's none."""
+    ends = _DEADLINE.get()
+    return None if ends is None else ends - time.monotonic()
+
+
+def cancelled() -> bool:
+    """Returns whether the current call has been cancelled."""
+    event = _CANCEL.get()
+    return event is not None and event.is_set()
+
+
+def cancellable(function, event):
+    """
+    Returns function wrapped to run in a copy of the current context where
+    setting event cancels it.
+    """
+    def run(*args, **kwargs):
+        _CANCEL.set(event)
+        return function(*args, **kwargs)
+    return in_context(wraps(function)(run))
+
+
+def in_context(function):
+    """
+    Returns function wrapped to run in a copy of the current context, so a
+    task submitted to a thread pool keeps the deadline and the provider of
+    the code that submitted it.
+    """
+    context = copy_context()
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        # Each call gets its own copy, as a context can't be entered twice
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,385 @@
+"""
+Persistent on-disk cache for API responses, stored in SQLite.
+
+Responses are keyed by provider, quantised coordinates and request params,
+which include the date. Each provider has its own time to live (TTL), and the
+least recently used entries are evicted once the cache holds more than
+CACHE_MAX_ENTRIES.
+
+For the providers with a CACHE_STALE limit, a response is refreshed in the
+background when it is served within CACHE_REFRESH_AHEAD seconds of its TTL,
+and an expired one is still served, while it is refreshed, for up to the
+limit. The call that fetched each key is remembered, so refresh_expiring can
+prefetch the responses about to expire without anyone asking for them.
+Inside fresh_only, expired responses are never served, for callers that
+record when their answers were fetched.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# JSON is used to store responses and build keys from params
+import json
+import os
+import sqlite3
+import time
+
+# Lock so threads can share one SQLite connection, and the background
+# refreshes and the calls they remember
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# Turning off stale serving for the calls made inside fresh_only
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Typing for the fetch function passed to cached_api_call
+from typing import Callable
+
+# Logging modules
+from logger import logging_setup
+
+# Function to record the cache hits and misses of each provider, and tools
+# to label the background refreshes with it
+from metrics import record_cache, current_provider, api_call
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import CACHE_ENABLED, CACHE_PATH, CACHE_MAX_ENTRIES, \
+    CACHE_COORD_PRECISION, CACHE_TTLS, CACHE_STALE, CACHE_REFRESH_AHEAD
+
+# Params that are already part of the key (coordinates) or that should never
+# be stored (the API key).
+IGNORED_PARAMS = ('key', 'lat', 'lng', 'long')
+
+# The shared cache is created on first use by get_cache
+_CACHE = None
+_CACHE_LOCK = Lock()
+
+# The provider and call that fetched each key, newest last, and the keys
+# being refreshed in the background
+_REFRESHERS = OrderedDict()
+_REFRESHING = set()
+_REFRESH_LOCK = Lock()
+
+# Whether the current calls must not be answered with an expired response
+_FRESH_ONLY = ContextVar('fresh_only', default=False)
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ResponseCache:
+    """
+    A size-bounded, least recently used cache of JSON API responses in a
+    SQLite file.
+
+    Parameters:
+        path (str): Location of the SQLite file.
+        max_entries (int): Number of entries kept before evicting.
+        ttls (dict): Time to live in seconds, keyed by provider.
+        precision (int): Decimal places coordinates are rounded to.
+        stale (dict): Seconds past the TTL an entry is kept to be served
+            while it is refreshed, keyed by provider.
+    """
+    def __init__(self,
+                 path: str,
+                 max_entries: int,
+                 ttls: dict,
+                 precision: int = 2,
+                 stale: dict | None = None):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.precision = precision
+        self.stale = stale or {}
+        self.stats = {}
+        self._lock = Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # One connection is shared by every thread, guarded by self._lock
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            # WAL lets several processes read while one writes
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, provider TEXT, value TEXT, '
+                'expires_at REAL, last_access REAL)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_last_access '
+                'ON responses (last_access)')
+
+    def make_key(self,
+                 provider: str,
+                 lat: float,
+                 lng: float,
+                 params: dict) -> str:
+        """
+        Builds a cache key from the provider, the coordinates rounded to
+        self.precision and the remaining request params.
+        """
+        key_params = {name: str(value) for name, value in params.items()
+                      if name not in IGNORED_PARAMS}
+        return '|'.join([provider,
+                         f'{lat:.{self.precision}f}',
+                         f'{lng:.{self.precision}f}',
+                         json.dumps(key_params, sort_keys=True)])
+
+    def get(self, key: str, provider: str) -> dict | None:
+        """
+        Returns the cached response for key, or None if it is missing or has
+        expired.
+        """
+        entry = self.lookup(key, provider)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def lookup(self, key: str, provider: str) -> tuple | None:
+        """
+        Returns (response, expires_at) for key if it hasn't expired, or has
+        expired by no more than the provider's stale seconds. Otherwise
+        returns None, removing the entry if it is too old to serve.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?',
+                (key,)).fetchone()
+            if row is not None and \
+                    row[1] + self.stale.get(provider, 0) < now:
+                self._conn.execute('DELETE FROM responses WHERE key = ?',
+                                   (key,))
+                row = None
+            if row is not None:
+                self._conn.execute(
+                    'UPDATE responses SET last_access = ? WHERE key = ?',
+                    (now, key))
+            self._count(provider, 'misses' if row is None
+                        else 'hits' if row[1] >= now else 'stale')
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def expiring(self, providers: tuple, within: float) -> list:
+        """
+        Returns the keys of the providers' entries that expire within the
+        next within seconds, or have expired but can still be served.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, provider, expires_at FROM responses WHERE '
+                f'provider IN ({",".join("?" * len(providers))}) AND '
+                'expires_at < ?', (*providers, now + within)).fetchall()
+        return [key for key, provider, expires_at in rows
+                if expires_at + self.stale.get(provider, 0) >= now]
+
+    def set(self, key: str, provider: str, value: dict) -> None:
+        """
+        Stores a response using the provider's TTL, then evicts the least
+        recently used entries if the cache is over max_entries.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, provider, json.dumps(value),
+                 now + self.ttls.get(provider, 0), now))
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM responses WHERE key IN (SELECT key FROM '
+                    'responses ORDER BY last_access LIMIT ?)',
+                    (count - self.max_entries,))
+                self._count(provider, 'evictions', count - self.max_entries)
+
+    def log_stats(self) -> None:
+        """Logs the hit, miss and eviction counts for each provider."""
+        with self._lock:
+            stats = {provider: dict(counts)
+                     for provider, counts in self.stats.items()}
+        for provider, counts in sorted(stats.items()):
+            logger.info('Cache stats for %s: %s', provider, counts)
+
+    def _count(self, provider: str, stat: str, amount: int = 1) -> None:
+        """
+        Adds amount to one of the provider's stats. Called with self._lock
+        held, as the API threads and the background refreshes count at the
+        same time.
+        """
+        counts = self.stats.setdefault(
+            provider, {'hits': 0, 'misses': 0, 'evictions': 0})
+        counts[stat] = counts.get(stat, 0) + amount
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def get_cache() -> ResponseCache | None:
+    """
+    Returns the shared ResponseCache, creating it on the first call. Returns
+    None if caching is turned off in config.ini.
+    """
+    global _CACHE  # pylint: disable=global-statement
+    if not CACHE_ENABLED:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache(CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_TTLS,
+                                   CACHE_COORD_PRECISION, CACHE_STALE)
+    return _CACHE
+
+
+def set_cache(cache: ResponseCache | None) -> None:
+    """
+    Replaces the shared cache, e.g. with one in a temporary file for a
+    benchmark, or turns caching off for the rest of the run with None.
+    """
+    global _CACHE, CACHE_ENABLED  # pylint: disable=global-statement
+    with _CACHE_LOCK:
+        _CACHE = cache
+        CACHE_ENABLED = cache is not None
+
+
+def cached_api_call(provider: str,
+                    lat: float,
+                    lng: float,
+                    params: dict,
+                    fetch: Callable[[], dict | None]) -> dict | None:
+    """
+    Returns the cached response for the request if there is a fresh one,
+    otherwise calls fetch and caches a successful (not None) response. If
+    the provider has a CACHE_STALE limit, a response about to expire, or
+    expired by no more than the limit, is returned straight away and
+    refreshed in the background. Inside fresh_only, an expired response is
+    fetched again instead.
+
+    Parameters:
+        provider (str): Which TTL to use, e.g. 'sun' or 'cloud'.
+        lat (float): Latitude of the request.
+        lng (float): Longitude of the request.
+        params (dict): Request params, including the date if there is one.
+            The API key and coordinates are left out of the cache key.
+        fetch (Callable): Function that calls the API.
+
+    Returns:
+        dict: The API response in a JSON format.
+        None: If the call was unsuccessful.
+    """
+    cache = get_cache()
+    if cache is None:
+        return fetch()
+    key = cache.make_key(provider, lat, lng, params)
+    remember(key, provider, api_call(current_provider())(fetch))
+    entry = cache.lookup(key, provider)
+    if entry is not None and _FRESH_ONLY.get() and entry[1] < time.time():
+        entry = None
+    record_cache(entry is not None)
+    if entry is not None:
+        logger.debug('Cache hit for %s', key)
+        response, expires_at = entry
+        if cache.stale.get(provider, 0) > 0 and \
+                expires_at - time.time() <= CACHE_REFRESH_AHEAD:
+            refresh_later(cache, key)
+        return response
+    response = fetch()
+    if response is not None:
+        cache.set(key, provider, response)
+    return response
+
+
+@contextmanager
+def fresh_only():
+    """
+    Context manager in which cached_api_call never answers with an expired
+    response, so the caller can treat its answers as fetched now.
+    """
+    token = _FRESH_ONLY.set(True)
+    try:
+        yield
+    finally:
+        _FRESH_ONLY.reset(token)
+
+
+def remember(key: str, provider: str, fetch: Callable) -> None:
+    """
+    Remembers the call that fetches key, keeping as many as the cache
+    holds entries.
+    """
+    with _REFRESH_LOCK:
+        _REFRESHERS[key] = (provider, fetch)
+        _REFRESHERS.move_to_end(key)
+        if len(_REFRESHERS) > CACHE_MAX_ENTRIES:
+            _REFRESHERS.popitem(last=False)
+
+
+def refresh_later(cache: ResponseCache, key: str) -> bool:
+    """
+    Refreshes key in the background with the call remembered for it,
+    unless it is already being refreshed.
+
+    Returns:
+        bool: Whether a refresh was started.
+    """
+    with _REFRESH_LOCK:
+        if key in _REFRESHING or key not in _REFRESHERS:
+            return False
+        _REFRESHING.add(key)
+        provider, fetch = _REFRESHERS[key]
+    refresh_executor.submit(refresh, cache, key, provider, fetch)
+    return True
+
+
+def refresh(cache: ResponseCache,
+            key: str,
+            provider: str,
+            fetch: Callable[[], dict | None]) -> None:
+    """Fetches key again and caches the response if the call worked."""
+    logger.debug('Refreshing %s', key)
+    try:
+        response = fetch()
+        if response is not None:
+            cache.set(key, provider, response)
+    except (KeyError, TypeError, ValueError):
+        logger.exception('Refreshing %s failed', key)
+    finally:
+        with _REFRESH_LOCK:
+            _REFRESHING.discard(key)
+
+
+def refresh_expiring(providers: tuple, within: float) -> int:
+    """
+    Refreshes, in the background, the providers' cached responses that
+    expire within the next within seconds and whose calls are remembered.
+
+    Returns:
+        int: The number of refreshes started.
+    """
+    cache = get_cache()
+    if cache is None or not providers:
+        return 0
+    return sum(refresh_later(cache, key)
+               for key in cache.expiring(providers, within))
+
+
+def log_cache_stats() -> None:
+    """Logs the shared cache's stats if it has been used this run."""
+    if _CACHE is not None:
+        _CACHE.log_stats()
+
+
+# The threads the background refreshes run on. They start with an empty
+# context, so a refresh isn't cut short by the deadline of the build that
+# started it.
+refresh_executor = ThreadPoolExecutor(max_workers=4,
+                                      thread_name_prefix='refresh')
@@ -1,5 +1,9 @@
 """
 Functions relating to the https://sunrise-sunset.org API.
+
+The range of dates can also be answered offline by the solar ephemeris
+engine, which is registered as a backend for the 'sun' kind of data and used
+if the API fails.
 """
 ###############################################################################
 # IMPORTS
@@ -7,8 +11,23 @@ Functions relating to the https://sunrise-sunset.org API.
 # Date class represents a calendar date.
 from datetime import date
 
-# Importing requests to handle calling API urls.
-import requests
+# NumPy passes the dates to the solar ephemeris engine
+# It may be necessary to pip install numpy
+import numpy as np
+
+# Shared HTTP client handles calling API urls and request errors
+from apis.http_client import get_json
+# Cache layer in front of the API
+from apis.response_cache import cached_api_call
+# Registry of the backends for each kind of data, with hedged requests
+from apis.registry import fetch, register
+# Decorator that labels the call's metrics with its provider
+from metrics import api_call
+
+# Offline solar and twilight times
+from ephemeris.solar import solar_events, EVENT_NAMES
+# Function to give the offline times as the API's 12-hour clock times
+from utils.datetime_utils import format_epoch_time
 
 # Logging modules
 from logger import logging_setup
@@ -17,7 +36,11 @@ from logger import logging_setup
 ###############################################################################
 # VARIABLES
 ###############################################################################
-from config import SUN_API_URL
+from config import SUN_API_URL, TIMEZONE
+
+# The Sun API URLs found to ignore date_start and date_end, which aren't
+# asked for a range again by this process
+_RANGE_UNSUPPORTED = set()
 
 
 ###############################################################################
@@ -29,13 +52,15 @@ logger = logging_setup(__name__)
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
+@api_call('sun')
 def sun_api_call(lat: float, lng: float, day: date) -> dict | None:
     """
     Call https://sunrise-sunset.org/api API (no key needed) to receive the
     sunrise, sunset, and twilight times. The function takes in the user's
     latitude and longitude and the date to use as parameters in the URL
     request. The API defaults to UTC time. For the purposes of this exercise,
-    the timezone is set to Europe/London.
+    the timezone is set to TIMEZONE from config.ini, Europe/London by
+    default.
     """
     logger.info('Running sun_api_call.')
 
@@ -43,31 +68,103 @@ def sun_api_call(lat: float, lng: float, day: date) -> dict | None:
         'lat': lat,
         'lng': lng,
         'date': day,
-        'tzid': 'Europe/London'
+        'tzid': TIMEZONE
     }
-    try:
-        # Trying to call the Sun API using the params
-        response = requests.get(SUN_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.Timeout:
-        # Raise and log an exception if the connection times out.
-        logger.exception('%s timed out', SUN_API_URL)
-    except requests.exceptions.ConnectionError:
-        # Raise and log an exception for a connection error.
-        logger.exception('Failed to connect to %s', SUN_API_URL)
-    except requests.exceptions.HTTPError:
-        # Raise and log an exception if the status code is for 4xx or 5xx errors
-        logger.exception('%s gave an unsuccessful status code', SUN_API_URL)
-    except requests.exceptions.RequestException:
-        # Raise and log all other request exceptions.
-        logger.exception('An error occurred calling %s', SUN_API_URL)
-    else:
-        logger.debug('Sun API response is: %s', response)
-        # Checking request was successful by looking for status code 200 and
-        # returning the API response in a JSON format
-        if response.status_code == 200:
-            return response.json()
-    # If an error occurred, the app will print that the API call was
-    # unsuccessful and return None
-    print('An error occurred trying to call https://sunrise-sunset.org/')
-    return None
+    # Calling the Sun API using the params on the shared HTTP client, unless
+    # the response is already cached
+    return cached_api_call(
+        'sun', lat, lng, params,
+        lambda: get_json(SUN_API_URL, params, 'https://sunrise-sunset.org/'))
+
+
+@api_call('sun')
+def sun_range_request(lat: float,
+                      lng: float,
+                      start_date: date,
+                      end_date: date) -> list | None:
+    """
+    Call https://sunrise-sunset.org/api API (no key needed) once for a whole
+    range of dates, using its date_start and date_end parameters, instead of
+    once per date.
+
+    Returns:
+        list: The results for each date in the range, in order. Each result
+        has the same times as sun_api_call's plus the 'date' it is for.
+        None: If the call was unsuccessful or the API didn't give one result
+        per date, so the caller can fall back to sun_api_call. Once the API
+        has ignored the range, None is returned without calling it.
+    """
+    logger.info('Running sun_range_request.')
+
+    if SUN_API_URL in _RANGE_UNSUPPORTED:
+        return None
+
+    params = {
+        'lat': lat,
+        'lng': lng,
+        'date_start': start_date,
+        'date_end': end_date,
+        'tzid': TIMEZONE
+    }
+
+    def fetch_range():
+        response = get_json(SUN_API_URL, params, 'https://sunrise-sunset.org/')
+        if response is None:
+            return None
+        results = response.get('results')
+        # A single result, rather than a list, means the range was ignored,
+        # so it isn't asked for again. None is returned so the response is
+        # never cached.
+        if not isinstance(results, list):
+            _RANGE_UNSUPPORTED.add(SUN_API_URL)
+        if not isinstance(results, list) or \
+                len(results) != (end_date - start_date).days + 1:
+            logger.warning('Sun API range call gave unexpected results: %s',
+                           results)
+            return None
+        return response
+
+    # Calling the Sun API using the params on the shared HTTP client, unless
+    # the response is already cached
+    response = cached_api_call('sun', lat, lng, params, fetch_range)
+    return None if response is None else response['results']
+
+
+@register('sun', 'solar_engine')
+def solar_engine_range(lat: float,
+                       lng: float,
+                       start_date: date,
+                       end_date: date) -> list:
+    """
+    Computes the times of sun_range_request offline with the solar
+    ephemeris engine, as the API's 12-hour clock times in TIMEZONE. Events
+    that don't happen are given the same time as the API gives them.
+    """
+    logger.info('Running solar_engine_range.')
+
+    dates = np.arange(np.datetime64(start_date),
+                      np.datetime64(end_date) + 1)
+    sun_events = solar_events(dates, lat, lng)
+    return [{'date': str(day),
+             **{name: format_epoch_time(sun_events[name][index], TIMEZONE,
+                                        '%I:%M:%S %p')
+                for name in EVENT_NAMES}}
+            for index, day in enumerate(dates)]
+
+
+def sun_range_api_call(lat: float,
+                       lng: float,
+                       start_date: date,
+                       end_date: date) -> list | None:
+    """
+    Gets the sun times for a range of dates with sun_range_request, or the
+    other backends registered for the 'sun' kind of data if it fails.
+
+    Returns:
+        list: The results for each date in the range, in order, as
+        sun_range_request gives them.
+        None: If no backend answered, so the caller can fall back to
+        sun_api_call.
+    """
+    return fetch('sun', sun_range_request, lat=lat, lng=lng,
+                 start_date=start_date, end_date=end_date)
@@ -0,0 +1,163 @@
+"""
+Record and replay transport for the shared HTTP client.
+
+In 'record' mode every API response is saved to a fixture file in
+TRANSPORT_FIXTURES_PATH as well as being returned. In 'replay' mode the
+responses are read back from those files instead of calling the APIs, so the
+app runs offline and gives the same results every time. The stub server in
+stub_server.py serves the same files over HTTP.
+
+Fixtures are keyed by the request's path and sorted query string, without the
+API key or the host, so they can be recorded from the real APIs and replayed
+by the stub server at another address.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# Fixtures are JSON files named after a hash of the request
+import hashlib
+import json
+import os
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# Importing requests to build the transport adapters.
+# It may be necessary to pip install requests
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import TRANSPORT_MODE, TRANSPORT_FIXTURES_PATH
+
+# Query params left out of the fixture keys and files, as they are secret
+SECRET_PARAMS = ('key',)
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def request_key(url: str) -> str:
+    """
+    Returns the fixture key of a request URL: its path and its query params
+    sorted, without the host or the SECRET_PARAMS.
+    """
+    parts = urlsplit(url)
+    params = sorted((name, value) for name, value in parse_qsl(parts.query)
+                    if name not in SECRET_PARAMS)
+    return f'{parts.path}?{urlencode(params)}'
+
+
+def fixture_path(folder: str, key: str) -> str:
+    """Returns the path of the fixture file for a request key."""
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+    return os.path.join(folder, f'{digest}.json')
+
+
+def load_fixture(folder: str, url: str) -> dict | None:
+    """
+    Returns the recorded response for a request URL, or None if it wasn't
+    recorded.
+
+    Returns:
+        dict: The 'key', 'status', 'content_type' and 'body' of the response.
+    """
+    path = fixture_path(folder, request_key(url))
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as fixture_file:
+        return json.load(fixture_file)
+
+
+def save_fixture(folder: str, url: str,
+                 response: requests.Response) -> None:
+    """Saves a response as the fixture for its request URL."""
+    key = request_key(url)
+    os.makedirs(folder, exist_ok=True)
+    with open(fixture_path(folder, key), 'w', encoding='utf-8') as file:
+        json.dump({'key': key,
+                   'status': response.status_code,
+                   'content_type': response.headers.get('Content-Type',
+                                                        'application/json'),
+                   'body': response.text}, file, indent=2)
+
+
+def fixture_response(request: requests.PreparedRequest,
+                     fixture: dict) -> requests.Response:
+    """Builds the requests.Response for a recorded fixture."""
+    response = requests.Response()
+    response.status_code = fixture['status']
+    response.headers['Content-Type'] = fixture['content_type']
+    response._content = fixture['body'].encode('utf-8')  # pylint: disable=protected-access
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def transport_adapter(**kwargs) -> BaseAdapter:
+    """
+    Returns the adapter for TRANSPORT_MODE: a RecordingAdapter, a
+    ReplayAdapter or, in 'live' mode, a plain HTTPAdapter. The keyword
+    arguments are passed to the HTTPAdapter.
+
+    Raises:
+        ValueError: If TRANSPORT_MODE isn't 'live', 'record' or 'replay'.
+    """
+    if TRANSPORT_MODE == 'live':
+        return HTTPAdapter(**kwargs)
+    logger.info('Using the %s transport with fixtures in %s.',
+                TRANSPORT_MODE, TRANSPORT_FIXTURES_PATH)
+    if TRANSPORT_MODE == 'record':
+        return RecordingAdapter(TRANSPORT_FIXTURES_PATH, **kwargs)
+    if TRANSPORT_MODE == 'replay':
+        return ReplayAdapter(TRANSPORT_FIXTURES_PATH)
+    raise ValueError(f'Unknown transport mode: {TRANSPORT_MODE}')
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class RecordingAdapter(HTTPAdapter):
+    """An HTTPAdapter that saves every response it gets to a fixture."""
+    def __init__(self, folder: str, **kwargs):
+        self.folder = folder
+        super().__init__(**kwargs)
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        response = super().send(request, *args, **kwargs)
+        save_fixture(self.folder, request.url, response)
+        logger.debug('Recorded %s', request_key(request.url))
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    An adapter that answers every request from its recorded fixture. A
+    request that wasn't recorded raises a ConnectionError, the same as an
+    API that can't be reached.
+    """
+    def __init__(self, folder: str):
+        super().__init__()
+        self.folder = folder
+
+    def send(self, request, *_args, **_kwargs):  # pylint: disable=arguments-differ
+        fixture = load_fixture(self.folder, request.url)
+        if fixture is None:
+            raise requests.exceptions.ConnectionError(
+                f'No recording for {request_key(request.url)}',
+                request=request)
+        return fixture_response(request, fixture)
+
+    def close(self):
+        """Nothing to close, as no connections are opened."""
@@ -1,5 +1,13 @@
 """
 Functions relating to the https://www.visualcrossing.com API.
+
+Each request goes through the registry of backends for its kind of data
+('lunar', 'cloud' or 'lunar_cloud'). Visual Crossing counts every request
+against the daily quota of the API key, so its kinds aren't hedged unless
+they are added to the hedging kinds in config.ini.
+
+Every request is made within the quota of records the API keys have left
+today, see apis/quota.py, and the records it cost are recorded.
 """
 ###############################################################################
 # IMPORTS
@@ -7,9 +15,17 @@ Functions relating to the https://www.visualcrossing.com API.
 # Date class represents a calendar date.
 from datetime import date
 
-# Importing requests to handle calling API urls.
-# It may be necessary to pip install requests
-import requests
+# Shared HTTP client handles calling API urls and request errors
+from apis.http_client import get_json
+# Cache layer in front of the API
+from apis.response_cache import cached_api_call
+# Registry of the backends for each kind of data, with hedged requests
+from apis.registry import fetch
+# The API keys' daily quota of records, and what each request costs
+from apis.quota import get_quota, request_cost
+# Decorator that labels the call's metrics with its provider, and functions
+# to record the records spent and the requests the quota didn't allow
+from metrics import api_call, record_records, record_skipped
 
 # Logging modules
 from logger import logging_setup
@@ -20,6 +36,24 @@ from logger import logging_setup
 ###############################################################################
 from config import VC_API_URL
 
+# Message printed when Visual Crossing rejects the API key. 401 is an
+# unauthorised request.
+STATUS_MESSAGES = {
+    401: 'Your API key is invalid. You will not get a lunar or cloud '
+         'forecast.'
+}
+
+# The include and elements params for each kind of request. Requests for the
+# same location and dates can be merged with coalesce_queries.
+LUNAR_QUERY = {
+    'include': 'days',
+    'elements': 'datetime,moonphase,moonrise,moonset'
+}
+CLOUD_QUERY = {
+    'include': 'hours',
+    'elements': 'datetime,cloudcover'
+}
+
 
 ###############################################################################
 # SETUP LOGGING
@@ -30,11 +64,61 @@ logger = logging_setup(__name__)
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
-def lunar_api_call(lat: float,
-                   lng: float,
-                   start_date: date,
-                   end_date: date,
-                   api_key: str) -> dict | None:
+def day_count(start_date: date, end_date: date) -> int:
+    """Returns the number of days from start_date to end_date inclusive."""
+    return (date.fromisoformat(str(end_date))
+            - date.fromisoformat(str(start_date))).days + 1
+
+
+def forecast_cost(days: int) -> int:
+    """
+    Returns the records a forecast of days costs. Both the merged lunar and
+    cloud request and the cloud request include the hours.
+    """
+    return request_cost(coalesce_queries([LUNAR_QUERY, CLOUD_QUERY]), days)
+
+
+def metered_get(location_date: str,
+                params: dict,
+                days: int,
+                description: str) -> dict | None:
+    """
+    Calls Visual Crossing on the shared HTTP client once the request's
+    records have been taken from the quota, on the next API key with enough
+    left. The records are then corrected to the response's queryCost, or
+    given back if the call failed.
+
+    Parameters:
+        location_date (str): The location and dates part of the URL.
+        params (dict): The request params, with the user's API key.
+        days (int): The number of days requested.
+        description (str): What is being called, for the error messages.
+
+    Returns:
+        dict: The API response in a JSON format.
+        None: If the call was unsuccessful or the quota didn't allow it.
+    """
+    cost = request_cost(params, days)
+    quota = get_quota()
+    api_key, error = quota.acquire(params['key'], cost)
+    if error is not None:
+        logger.warning('Skipped calling %s: %s', description, error)
+        record_skipped(error)
+        return None
+    response = get_json(VC_API_URL + location_date, {**params, 'key': api_key},
+                        description, STATUS_MESSAGES)
+    spent = 0 if response is None else int(response.get('queryCost', cost))
+    quota.settle(api_key, cost, spent)
+    record_records(spent)
+    return response
+
+
+@api_call('visualcrossing')
+def lunar_request(lat: float,
+                  lng: float,
+                  start_date: date,
+                  end_date: date,
+                  api_key: str) -> dict | None:
     """
     Call API at https://www.visualcrossing.com to receive moon rise and set
     times and moon phase.
@@ -47,56 +131,32 @@ def lunar_api_call(lat: float,
         include: specifies that the information should be given per day.
         elements: lists the desired lunar facts.
     """
-    logger.info('Running lunar_api_call.')
+    logger.info('Running lunar_request.')
 
     location_date = str(lat) + ',' + str(lng) + '/' + str(start_date) + '/' \
         + str(end_date)
     params = {
         'unitGroup': 'metric',
         'key': api_key,
-        'include': 'days',
-        'elements': 'datetime,moonphase,moonrise,moonset'
+        **LUNAR_QUERY
     }
 
-    try:
-        # Try to call Visual Crossing with the params and location/dat string
-        response = requests.get(VC_API_URL + location_date,
-                                params=params, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.Timeout:
-        # Raise and log an exception if the connection times out.
-        logger.exception('%s timed out', VC_API_URL)
-    except requests.exceptions.ConnectionError:
-        # Raise and log an exception for a connection error.
-        logger.exception('Failed to connect to %s', VC_API_URL)
-    except requests.exceptions.HTTPError:
-        # Raise and log an exception if the status code is for 4xx or 5xx errors
-        logger.exception('%s gave an unsuccessful status code', VC_API_URL)
-        # 401 is unauthorised request
-        if response.status_code == 401:
-            print('Your API key is invalid. You will not get a lunar or cloud'
-                  'forecast.')
-    except requests.exceptions.RequestException:
-        # Raise and log all other request exceptions.
-        logger.exception('An error occurred calling %s', VC_API_URL)
-    else:
-        logger.debug('Lunar API response is: %s', response)
-        # Checking request was successful by looking for status code 200 and
-        # returning the API response in a JSON format
-        if response.status_code == 200:
-            return response.json()
-    # If an error occurred, the app will print that the API call was
-    # unsuccessful and return None
-    print('An error occurred trying to call https://weather.visualcrossing.com '
-          'for lunar info')
-    return None
+    # Calling Visual Crossing with the params and location/date string on the
+    # shared HTTP client, unless the response is already cached
+    return cached_api_call(
+        'lunar', lat, lng, {**params, 'dates': f'{start_date}/{end_date}'},
+        lambda: metered_get(location_date, params,
+                            day_count(start_date, end_date),
+                            'https://weather.visualcrossing.com for lunar '
+                            'info'))
 
 
-def cloud_api_call(lat: float,
-                   lng: float,
-                   start_date: date,
-                   end_date: date,
-                   api_key: str) -> dict | None:
+@api_call('visualcrossing')
+def cloud_request(lat: float,
+                  lng: float,
+                  start_date: date,
+                  end_date: date,
+                  api_key: str) -> dict | None:
     """
     Call API at https://www.visualcrossing.com to receive daily and hourly
     cloud cover information.
@@ -110,46 +170,134 @@ def cloud_api_call(lat: float,
         elements: requests cloud cover predictions and datetime of cloud cover
         predictions.
     """
-    logger.info('Running cloud_api_call.')
+    logger.info('Running cloud_request.')
+
+    location_date = str(lat) + ',' + str(lng) + '/' + str(start_date) + '/' + \
+        str(end_date)
+    params = {
+        'unitGroup': 'metric',
+        'key': api_key,
+        **CLOUD_QUERY
+    }
+
+    # Calling Visual Crossing with the params and location/date string on the
+    # shared HTTP client, unless the response is already cached
+    return cached_api_call(
+        'cloud', lat, lng, {**params, 'dates': f'{start_date}/{end_date}'},
+        lambda: metered_get(location_date, params,
+                            day_count(start_date, end_date),
+                            'https://weather.visualcrossing.com for cloud '
+                            'info'))
+
+
+def coalesce_queries(queries: list) -> dict:
+    """
+    Merges several queries for the same location and dates into one, using
+    the union of their 'include' and 'elements' values. Any other params
+    must match, otherwise a ValueError is raised.
+    """
+    merged = {}
+    for query in queries:
+        for name, value in query.items():
+            if name in ('include', 'elements'):
+                # Keeping the first-seen order of the comma separated values
+                values = merged.get(name, '').split(',') + value.split(',')
+                merged[name] = ','.join(dict.fromkeys(filter(None, values)))
+            elif merged.setdefault(name, value) != value:
+                raise ValueError(f'Queries differ in {name}')
+    return merged
+
+
+def split_response(response: dict, query: dict) -> dict:
+    """
+    Cuts a response to a merged query down to what a single query would have
+    returned: only its elements, and only the hours if it included them.
+    """
+    elements = query['elements'].split(',')
+    includes_hours = 'hours' in query['include'].split(',')
+    days = []
+    for day in response['days']:
+        split_day = {name: day[name] for name in elements if name in day}
+        if includes_hours:
+            split_day['hours'] = [
+                {name: hour[name] for name in elements if name in hour}
+                for hour in day.get('hours', [])]
+        days.append(split_day)
+    return {**response, 'days': days}
+
+
+@api_call('visualcrossing')
+def lunar_cloud_request(lat: float,
+                        lng: float,
+                        start_date: date,
+                        end_date: date,
+                        api_key: str) -> tuple | None:
+    """
+    Gets the lunar and cloud information with one call to Visual Crossing
+    instead of two, by merging LUNAR_QUERY and CLOUD_QUERY and splitting the
+    response.
+
+    Returns:
+        tuple: (lunar response, cloud response), each shaped like the
+        lunar_api_call and cloud_api_call responses.
+        None: If the call was unsuccessful.
+    """
+    logger.info('Running lunar_cloud_request.')
 
     location_date = str(lat) + ',' + str(lng) + '/' + str(start_date) + '/' + \
         str(end_date)
     params = {
         'unitGroup': 'metric',
         'key': api_key,
-        'include': 'hours',
-        'elements': 'datetime,cloudcover'
+        **coalesce_queries([LUNAR_QUERY, CLOUD_QUERY])
     }
 
-    try:
-        # Try to call Visual Crossing with the params and location/dat string
-        response = requests.get(VC_API_URL + location_date, params=params,
-                                timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.Timeout:
-        # Raise and log an exception if the connection times out.
-        logger.exception('%s timed out', VC_API_URL)
-    except requests.exceptions.ConnectionError:
-        # Raise and log an exception for a connection error.
-        logger.exception('Failed to connect to %s', VC_API_URL)
-    except requests.exceptions.HTTPError:
-        # Raise and log an exception if the status code is for 4xx or 5xx errors
-        logger.exception('%s gave an unsuccessful status code', VC_API_URL)
-        # 401 is unauthorised request
-        if response.status_code == 401:
-            print('Your API key is invalid. You will not get a lunar or cloud'
-                  'forecast.')
-    except requests.exceptions.RequestException:
-        # Raise and log all other request exceptions.
-        logger.exception('An error occurred calling %s', VC_API_URL)
-    else:
-        logger.debug('Cloud API response is: %s', response)
-        # Checking request was successful by looking for status code 200 and
-        # returning the API response in a JSON format
-        if response.status_code == 200:
-            return response.json()
-    # If an error occurred, the app will print that the API call was
-    # unsuccessful and return None
-    print('An error occurred trying to call https://weather.visualcrossing.com '
-          'for cloud info')
-    return None
+    # The merged response is cached with the cloud TTL, the shorter of the two
+    response = cached_api_call(
+        'cloud', lat, lng, {**params, 'dates': f'{start_date}/{end_date}'},
+        lambda: metered_get(location_date, params,
+                            day_count(start_date, end_date),
+                            'https://weather.visualcrossing.com for lunar '
+                            'and cloud info'))
+    if response is None:
+        return None
+    return (split_response(response, LUNAR_QUERY),
+            split_response(response, CLOUD_QUERY))
+
+
+def lunar_api_call(lat: float,
+                   lng: float,
+                   start_date: date,
+                   end_date: date,
+                   api_key: str) -> dict | None:
+    """Gets the lunar information with lunar_request, or another backend."""
+    return fetch('lunar', lunar_request, lat=lat, lng=lng,
+                 start_date=start_date, end_date=end_date, api_key=api_key)
+
+
+def cloud_api_call(lat: float,
+                   lng: float,
+                   start_date: date,
+                   end_date: date,
+                   api_key: str) -> dict | None:
+    """Gets the cloud information with cloud_request, or another backend."""
+    return fetch('cloud', cloud_request, lat=lat, lng=lng,
+                 start_date=start_date, end_date=end_date, api_key=api_key)
+
+
+def lunar_cloud_api_call(lat: float,
+                         lng: float,
+                         start_date: date,
+                         end_date: date,
+                         api_key: str) -> tuple:
+    """
+    Gets the lunar and cloud information with lunar_cloud_request, or
+    another backend.
+
+    Returns:
+        tuple: (lunar response, cloud response), or (None, None) if no
+        backend answered.
+    """
+    return fetch('lunar_cloud', lunar_cloud_request, lat=lat, lng=lng,
+                 start_date=start_date, end_date=end_date,
+                 api_key=api_key) or (None, None)
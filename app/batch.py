@@ -0,0 +1,385 @@
+"""
+BATCH STARGAZING FORECASTER
+Builds forecasts for a whole network of observing sites without prompting
+for input. Sites are streamed from a CSV or JSON Lines file with 'site_id',
+'lat', 'lng' and 'days' fields, and each site's forecast is streamed to one
+or more output formats as soon as it is built.
+
+The sites are planned to fit the Visual Crossing records left today: any
+that don't fit are built without a lunar and cloud forecast.
+
+Usage:
+    python3 batch.py sites.csv --output forecasts.jsonl
+    python3 batch.py sites.csv --output forecasts --format ndjson,csv
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import csv
+import json
+import os
+import time
+
+# Tools for the bounded pool of site workers and the quota plan
+from collections import Counter, OrderedDict
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import replace
+from functools import partial
+
+# Typing for the site and forecast generators
+from typing import Iterable, Iterator
+
+# Logging modules
+from logger import logging_setup
+
+# Functions to validate the site fields
+from utils.validation_utils import validate_lat, validate_lng, \
+    validate_length, validate_key
+# Function to create a list of dates
+from utils.datetime_utils import get_forecast_dates
+
+# Functions to build each component of the forecast and combine them
+from forecast_builder import sun_forecast_build, vc_forecast_build, \
+    aurora_forecast_build, site_forecast, analyse_nights, failed_parts
+
+# The typed forecast model
+from forecast_model import SiteForecast
+
+# Functions to write each site's forecast out
+from output_writer import open_writers, write_forecasts, WRITERS
+
+# Function to report how well the response cache did
+from apis.response_cache import log_cache_stats
+
+# The deadline each site's API calls must finish by
+from apis.resilience import deadline
+
+# The records a site costs and the records left on the API keys
+from apis.visualcrossing_api import forecast_cost
+from apis.quota import get_quota, log_quota
+
+# Function to log the API metrics and export them for Prometheus
+from metrics import report_run
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import MAX_WORKERS, DEADLINE, QUOTA_PLAN_WINDOW, VC_API_KEYS
+
+# The forecast providers, in the order site_forecast takes their results
+PROVIDERS = ('sun', 'visualcrossing', 'aurora')
+
+# Number of finished forecasts kept so repeated sites later in the file are
+# not rebuilt.
+RECENT_RESULTS_SIZE = 1024
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def read_sites(path: str, failures: Counter) -> Iterator[dict]:
+    """
+    Streams sites from a CSV file, or a JSON Lines file if the extension is
+    .jsonl, one row at a time.
+
+    Rows that fail validation are logged, counted under 'input' in failures
+    and skipped.
+
+    Parameters:
+        path (str): Location of the sites file.
+        failures (Counter): Failure counts, keyed by provider.
+
+    Yields:
+        dict: A site with a 'site_id', float 'lat' and 'lng', and int 'days'.
+    """
+    with open(path, encoding='utf-8', newline='') as sites_file:
+        if path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in sites_file if line.strip())
+        else:
+            rows = csv.DictReader(sites_file)
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                yield {'site_id': str(row['site_id']),
+                       'lat': validate_lat(str(row['lat'])),
+                       'lng': validate_lng(str(row['lng'])),
+                       'days': validate_length(str(row['days']))}
+            except (KeyError, ValueError) as e:
+                logger.warning('Skipping row %s of %s: %s',
+                               row_number, path, e)
+                failures['input'] += 1
+
+
+def plan_sites(sites: Iterable[dict],
+               records_left: int,
+               failures: Counter,
+               window: int = QUOTA_PLAN_WINDOW) -> Iterator[dict]:
+    """
+    Plans the sites' Visual Crossing requests to fit the records left
+    today. The sites are read window at a time and the cheapest are planned
+    first, so as many fit as possible, with sites at the same location and
+    forecast length costing once. A site that doesn't fit has 'vc' set to
+    False, is built without Visual Crossing and is counted under 'quota' in
+    failures.
+
+    Parameters:
+        sites (Iterable): Sites as read by read_sites.
+        records_left (int): The records left today on the API keys.
+        failures (Counter): Failure counts, keyed by provider.
+        window (int): Number of sites planned together.
+
+    Yields:
+        dict: Each site, with 'vc' set, cheapest first in each window.
+    """
+    sites = iter(sites)
+    planned = {}
+    while batch := list(islice(sites, window)):
+        for site in sorted(batch, key=lambda site: site['days']):
+            request = (site['lat'], site['lng'], site['days'])
+            if request not in planned:
+                cost = forecast_cost(site['days'])
+                planned[request] = cost <= records_left
+                records_left -= cost if planned[request] else 0
+            if not planned[request]:
+                logger.warning('No Visual Crossing records left for %s.',
+                               site['site_id'])
+                failures['quota'] += 1
+            yield {**site, 'vc': planned[request]}
+
+
+def build_provider(provider: str,
+                   vc_api_key: str,
+                   dates: list,
+                   lat: float,
+                   lng: float) -> tuple:
+    """
+    Runs one provider's builder for one location. A builder that fails, with
+    any exception, e.g. from the response cache or a request error the retries
+    didn't handle, is logged and its forecast left as None, so the other
+    forecasts and the rest of the batch are still written.
+
+    Parameters:
+        provider (str): 'sun', 'visualcrossing' or 'aurora'.
+
+    Returns:
+        tuple: (result, failed) where result is the builder's return value
+        and failed is the list of the parts that failed from failed_parts.
+    """
+    build, args = {
+        'sun': (sun_forecast_build, (dates, lat, lng)),
+        'visualcrossing': (vc_forecast_build, (vc_api_key, dates, lat, lng)),
+        'aurora': (aurora_forecast_build, (dates, lat, lng))}[provider]
+    try:
+        result = build(*args)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception('%s forecast failed for %s, %s', provider, lat, lng)
+        return None, [provider]
+    return result, failed_parts(provider, result, vc_api_key)
+
+
+def forecast_site(vc_api_key: str,
+                  lat: float,
+                  lng: float,
+                  days: int) -> SiteForecast:
+    """
+    Builds every forecast for one location with build_provider. The API
+    calls must finish within DEADLINE seconds.
+
+    Returns:
+        SiteForecast: The forecast, with the providers that failed listed in
+        its failed attribute.
+    """
+    dates = get_forecast_dates(days)
+    with deadline(DEADLINE):
+        built = {provider: build_provider(provider, vc_api_key, dates, lat,
+                                          lng)
+                 for provider in PROVIDERS}
+    forecast = site_forecast(dates, lat, lng,
+                             tuple(result for result, _ in built.values()))
+    forecast.failed = [name for _, failed in built.values()
+                       for name in failed]
+    return forecast
+
+
+class BatchRun:
+    """
+    Feeds sites to a pool of workers and yields a SiteForecast for each
+    site as its build finishes, keeping count of the failures per provider.
+
+    At most twice as many builds as there are workers are in flight at once,
+    so the whole batch is never held in memory. Sites with the same location
+    and forecast length share one build, and recently finished builds are
+    kept so a repeated site later in the file is not rebuilt.
+    """
+    def __init__(self, executor, vc_api_key: str, workers: int):
+        self.submit = partial(executor.submit, forecast_site)
+        self.vc_api_key = vc_api_key
+        self.max_in_flight = workers * 2
+        self.failures = Counter()
+        # Builds still running, keyed by (vc_api_key, lat, lng, days), with
+        # the build's future and the sites waiting on it.
+        self.in_flight = {}
+        # Finished builds kept for repeated sites
+        self.recent = OrderedDict()
+
+    def forecasts(self, sites: Iterable[dict]) -> Iterator[SiteForecast]:
+        """Yields the forecast of every site in sites."""
+        for site in sites:
+            yield from self.add(site)
+        yield from self.finish()
+
+    def add(self, site: dict) -> Iterator[SiteForecast]:
+        """
+        Yields the site's forecast straight away or queues a build for it,
+        yielding the forecasts of any builds waited on to make room.
+        """
+        request = (self.vc_api_key if site.get('vc', True) else 'xxx',
+                   site['lat'], site['lng'], site['days'])
+        if request in self.recent:
+            self.recent.move_to_end(request)
+            yield self.for_site(site, self.recent[request])
+        elif request in self.in_flight:
+            self.in_flight[request][1].append(site)
+        else:
+            # Waiting for a build to finish before adding more when the
+            # pool is full keeps memory use flat.
+            if len(self.in_flight) >= self.max_in_flight:
+                done, _ = wait([future for future, _ in
+                                self.in_flight.values()],
+                               return_when=FIRST_COMPLETED)
+                yield from self._collect(done)
+            self.in_flight[request] = (self.submit(*request), [site])
+
+    def finish(self) -> Iterator[SiteForecast]:
+        """Waits for and yields every build still in flight."""
+        yield from self._collect([future for future, _ in
+                                  self.in_flight.values()])
+
+    def for_site(self, site: dict, forecast: SiteForecast) -> SiteForecast:
+        """
+        Returns a shared build's forecast labelled with the site's id, and
+        counts its failures.
+        """
+        self.failures.update(forecast.failed)
+        # The days are shared with the other sites of the same build
+        return replace(forecast, site_id=site['site_id'])
+
+    def _collect(self, futures) -> Iterator[SiteForecast]:
+        """
+        Yields every site waiting on the finished futures, once the cloud
+        cover of all their nights has been analysed in one pass.
+        """
+        requests = {future: request
+                    for request, (future, _) in self.in_flight.items()}
+        finished = [(requests[future], future.result()) for future in futures]
+        analyse_nights([result for _, result in finished])
+        for request, result in finished:
+            _, sites = self.in_flight.pop(request)
+            self.recent[request] = result
+            if len(self.recent) > RECENT_RESULTS_SIZE:
+                self.recent.popitem(last=False)
+            for site in sites:
+                yield self.for_site(site, result)
+
+
+def run_batch(sites_path: str,
+              output_path: str,
+              vc_api_key: str = 'xxx',
+              workers: int = MAX_WORKERS,
+              formats: tuple = ('ndjson',)) -> dict:
+    """
+    Builds a forecast for every site in sites_path on a bounded pool of
+    workers and streams each one to every output format in a single pass.
+    With an API key, the sites are planned to fit the Visual Crossing
+    records left today.
+
+    Parameters:
+        sites_path (str): CSV or JSON Lines file of sites.
+        output_path (str): File to write the forecasts to. With more than one
+            format, its extension is replaced by each format's own.
+        vc_api_key (str): user's API key for Visual Crossing, or 'xxx'.
+        workers (int): Number of sites built at the same time.
+        formats (tuple): Names of the output formats from WRITERS.
+
+    Returns:
+        dict: Summary with the number of sites written, the time taken, the
+        throughput in sites per second, the failures per provider, the API
+        metrics of each provider from run_summary and the Visual Crossing
+        records left today.
+    """
+    logger.info('Running batch for %s.', sites_path)
+
+    writers = open_writers(list(formats), output_path)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='site') as executor:
+            run = BatchRun(executor, vc_api_key, workers)
+            sites = read_sites(sites_path, run.failures)
+            if vc_api_key != 'xxx':
+                sites = plan_sites(sites, get_quota().remaining(vc_api_key),
+                                   run.failures)
+            written = write_forecasts(run.forecasts(sites), writers)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {'sites': written,
+               'seconds': round(elapsed, 3),
+               'sites_per_second': round(written / elapsed, 2)
+               if elapsed else 0.0,
+               'failures': dict(run.failures)}
+    logger.info('Batch summary: %s', summary)
+    log_cache_stats()
+    summary['providers'] = report_run()['providers']
+    summary['records_left'] = log_quota(vc_api_key)
+    return summary
+
+
+def main() -> None:
+    """Parses the command line arguments and runs the batch."""
+    parser = argparse.ArgumentParser(
+        description='Build stargazing forecasts for a file of sites.')
+    parser.add_argument('sites',
+                        help='CSV or .jsonl file with site_id, lat, lng and '
+                             'days fields')
+    parser.add_argument('--output', default='Stargazing_Forecasts.jsonl',
+                        help='file to write the forecasts to')
+    parser.add_argument('--format', default='ndjson',
+                        help='comma separated output formats from: '
+                             + ', '.join(WRITERS))
+    # The first of the extra keys in config.ini is used if none is given
+    default_key = os.environ.get('VC_API_KEY',
+                                 VC_API_KEYS[0] if VC_API_KEYS else 'xxx')
+    parser.add_argument('--vc-key', default=default_key,
+                        help='Visual Crossing API key, "xxx" for none')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='number of sites built at the same time')
+    args = parser.parse_args()
+
+    summary = run_batch(args.sites, args.output, validate_key(args.vc_key),
+                        args.workers, tuple(args.format.split(',')))
+    print(f'[DONE] {summary["sites"]} sites written to "{args.output}" at '
+          f'{summary["sites_per_second"]} sites/s.')
+    for provider, count in summary['failures'].items():
+        print(f'{provider}: {count} failures')
+    # Which provider the time waiting on the APIs went to
+    for provider, stats in summary['providers'].items():
+        print(f'{provider}: {stats["requests"]:g} requests, '
+              f'{stats["seconds"]}s ({stats["share"]:.0%} of API time), '
+              f'{stats["errors"]:g} errors, {stats["cache_hits"]:g} cache '
+              f'hits, {stats["records"]:g} records')
+    print(f'Visual Crossing records left today: {summary["records_left"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+"""
+FORECAST PIPELINE BENCHMARK
+Times each stage of the forecast pipeline (sun_forecast_build,
+vc_forecast_build, aurora_forecast_build, analyse_nights and the text
+output of forecast_output) for a range of site counts and forecast lengths,
+and saves the results as JSON so they can be compared across commits.
+
+By default the APIs are answered by synthetic responses generated in
+process, with optional injected latency, so the benchmark runs offline and
+shows how much the concurrency and the response cache save. With
+--transport config the APIs are called as set in config.ini instead, e.g.
+replaying recorded responses or calling the stub server.
+
+Each scenario runs in a fresh process so its peak memory is its own.
+
+Usage:
+    python3 benchmark.py --sites 1,100,1000 --days 1,7 --latency-ms 50
+    python3 benchmark.py --output new.json --compare old.json
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Pools for the scenarios and the sites
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+# NumPy gives the latency percentiles.
+# It may be necessary to pip install numpy
+import numpy as np
+
+# Importing requests to build the synthetic transport adapter.
+# It may be necessary to pip install requests
+from requests.adapters import BaseAdapter
+
+# Peak memory use is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Logging modules
+from logger import logging_setup
+
+# Function to create a list of dates
+from utils.datetime_utils import get_forecast_dates
+
+# Functions to build each component of the forecast and combine them
+from forecast_builder import sun_forecast_build, vc_forecast_build, \
+    aurora_forecast_build, site_forecast, analyse_nights
+from ephemeris.solar import EVENT_NAMES
+
+# Writer for the text output of forecast_output
+from output_writer import TextWriter
+
+# Functions to send the API calls to the synthetic responses and to give
+# each scenario its own response cache and Visual Crossing quota
+from apis.http_client import mount_adapter
+from apis.transport import fixture_response
+from apis.response_cache import ResponseCache, set_cache
+from apis.quota import Quota, Ledger, TokenBucket, set_quota
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import MAX_WORKERS, CACHE_MAX_ENTRIES, CACHE_TTLS, \
+    CACHE_COORD_PRECISION
+
+# The stages timed for every site, in pipeline order
+STAGES = ('sun_forecast_build', 'vc_forecast_build', 'aurora_forecast_build',
+          'analyse_nights', 'forecast_output')
+
+# A Visual Crossing API key of the right length for the synthetic responses
+SYNTHETIC_VC_KEY = 'x' * 24 + 'k'
+
+# Times the synthetic sun API gives for EVENT_NAMES
+SYNTHETIC_SUN_TIMES = ('6:30:00 AM', '6:30:00 PM', '6:00:00 AM', '7:00:00 PM',
+                       '5:25:00 AM', '7:35:00 PM', '4:50:00 AM', '8:10:00 PM')
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class SyntheticAdapter(BaseAdapter):
+    """
+    An adapter that answers every API call with a made-up response of the
+    right shape after latency_ms, so the pipeline can run offline. The cloud
+    cover is drawn from a hash of the request, so it is the same every run.
+    """
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__()
+        self.latency_ms = latency_ms
+
+    def send(self, request, *_args, **_kwargs):  # pylint: disable=arguments-differ
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return fixture_response(request, {
+            'status': 200, 'content_type': 'application/json',
+            'body': json.dumps(synthetic_body(request.url))})
+
+    def close(self):
+        """Nothing to close, as no connections are opened."""
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def synthetic_body(url: str) -> dict:
+    """Returns a made-up response to a sun, Visual Crossing or aurora call."""
+    parts = urlsplit(url)
+    query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+    seed = int(hashlib.sha256(url.encode()).hexdigest()[:8], 16)
+    if parts.path.endswith('/json'):
+        times = dict(zip(EVENT_NAMES, SYNTHETIC_SUN_TIMES))
+        if 'date_start' not in query:
+            return {'results': times, 'status': 'OK'}
+        start = datetime.fromisoformat(query['date_start'])
+        days = (datetime.fromisoformat(query['date_end']) - start).days + 1
+        return {'results': [{**times, 'date': str((start + timedelta(i))
+                                                  .date())}
+                            for i in range(days)], 'status': 'OK'}
+    if '/timeline/' in parts.path:
+        start, end = (datetime.fromisoformat(value) for value in
+                      parts.path.rstrip('/').split('/')[-2:])
+        return {'days': [{
+            'datetime': str((start + timedelta(i)).date()),
+            'moonphase': (seed % 100) / 100, 'moonrise': '18:20:00',
+            'moonset': '07:40:00', 'cloudcover': float(seed % 101),
+            'hours': [{'datetime': f'{hour:02d}:00:00',
+                       'cloudcover': float((seed >> hour) % 101)}
+                      for hour in range(24)]}
+            for i in range((end - start).days + 1)]}
+    if query.get('data') == 'probability':
+        return {'value': seed % 30, 'colour': 'green'}
+    midnight = datetime.now().astimezone().replace(hour=0, minute=0,
+                                                   second=0, microsecond=0)
+    return {'values': [[{
+        'start': (midnight + timedelta(days=day, hours=3 * period))
+        .isoformat(),
+        'end': (midnight + timedelta(days=day, hours=3 * period + 3))
+        .isoformat(),
+        'colour': 'green', 'value': str((seed >> period) % 5)}
+        for period in range(8)] for day in range(3)]}
+
+
+def timed(timings: dict, stage: str, function, *args):
+    """Calls function with args and adds its duration to timings[stage]."""
+    start = time.perf_counter()
+    result = function(*args)
+    timings[stage].append(time.perf_counter() - start)
+    return result
+
+
+def run_site(timings: dict, vc_api_key: str, dates: list,
+             location: tuple, writer: TextWriter) -> None:
+    """Runs every stage of the pipeline for one site, timing each."""
+    lat, lng = location
+    built = (timed(timings, 'sun_forecast_build', sun_forecast_build,
+                   dates, lat, lng),
+             timed(timings, 'vc_forecast_build', vc_forecast_build,
+                   vc_api_key, dates, lat, lng),
+             timed(timings, 'aurora_forecast_build', aurora_forecast_build,
+                   dates, lat, lng))
+    forecast = site_forecast(dates, lat, lng, built)
+    timed(timings, 'analyse_nights', analyse_nights, [forecast])
+    timed(timings, 'forecast_output', writer.write_forecast, forecast)
+
+
+def site_locations(count: int, unique: float) -> list:
+    """
+    Returns count (lat, lng) locations spread over the northern hemisphere,
+    drawn from round(count * unique) distinct ones so that a unique of less
+    than 1 repeats sites, as a real network would, for the cache to catch.
+    """
+    rng = np.random.default_rng(0)
+    pool = np.column_stack([rng.uniform(30.0, 65.0, max(1, round(count *
+                                                                 unique))),
+                            rng.uniform(-10.0, 30.0, max(1, round(count *
+                                                                  unique)))])
+    return [tuple(pool[index]) for index in
+            np.arange(count) % len(pool)]
+
+
+def run_scenario(scenario: dict) -> dict:
+    """
+    Runs one scenario and returns its results. Meant to run in its own
+    process.
+
+    Parameters:
+        scenario (dict): 'sites', 'days', 'workers', 'latency_ms', 'cache',
+            'unique', 'transport', 'vc_api_key' and 'trace'.
+
+    Returns:
+        dict: The scenario with the time taken, the sites per second, the
+        p50 and p95 milliseconds of each stage, the peak RSS in KiB and the
+        allocation counts.
+    """
+    folder = tempfile.mkdtemp(prefix='benchmark')
+    if scenario['transport'] == 'synthetic':
+        mount_adapter(SyntheticAdapter(scenario['latency_ms']))
+        # The synthetic calls spend records from a ledger of their own, with
+        # no rate limit, so they don't use up or wait on the real quota
+        set_quota(Quota(Ledger(os.path.join(folder, 'ledger.sqlite3')),
+                        TokenBucket(0, 1)))
+    set_cache(ResponseCache(os.path.join(folder, 'responses.sqlite3'),
+                            CACHE_MAX_ENTRIES, CACHE_TTLS,
+                            CACHE_COORD_PRECISION)
+              if scenario['cache'] else None)
+    if scenario['trace']:
+        tracemalloc.start()
+    timings = {stage: [] for stage in STAGES}
+    dates = get_forecast_dates(scenario['days'])
+    blocks, collections = sys.getallocatedblocks(), \
+        [stats['collections'] for stats in gc.get_stats()]
+
+    start = time.perf_counter()
+    with TextWriter(os.devnull) as writer, \
+            ThreadPoolExecutor(max_workers=scenario['workers']) as executor:
+        for future in [executor.submit(run_site, timings,
+                                       scenario['vc_api_key'], dates,
+                                       location, writer)
+                       for location in site_locations(scenario['sites'],
+                                                      scenario['unique'])]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    return {**{name: value for name, value in scenario.items()
+               if name != 'vc_api_key'},
+            'seconds': round(elapsed, 3),
+            'sites_per_second': round(scenario['sites'] / elapsed, 2),
+            'stages': {stage: stage_stats(times)
+                       for stage, times in timings.items()},
+            'peak_rss_kib': None if resource is None else
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'allocations': allocation_stats(blocks, collections)}
+
+
+def stage_stats(times: list) -> dict:
+    """Returns the count and the p50 and p95 milliseconds of a stage."""
+    milliseconds = np.array(times) * 1000
+    return {'count': len(times),
+            'p50_ms': round(float(np.percentile(milliseconds, 50)), 3),
+            'p95_ms': round(float(np.percentile(milliseconds, 95)), 3)}
+
+
+def allocation_stats(blocks: int, collections: list) -> dict:
+    """
+    Returns the memory blocks still allocated since the scenario started,
+    the garbage collections of each generation, which grow with the number
+    of objects allocated, and the peak traced memory if tracemalloc is on.
+    """
+    stats = {'net_blocks': sys.getallocatedblocks() - blocks,
+             'gc_collections': [stats['collections'] - before for
+                                stats, before in zip(gc.get_stats(),
+                                                     collections)]}
+    if tracemalloc.is_tracing():
+        stats['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return stats
+
+
+def git_commit() -> str | None:
+    """Returns the current git commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def scenario_key(result: dict) -> tuple:
+    """Returns what identifies a scenario across benchmark runs."""
+    return tuple(result[name] for name in ('sites', 'days', 'workers',
+                                           'latency_ms', 'cache', 'unique',
+                                           'transport'))
+
+
+def compare_results(old: dict, new: dict) -> list:
+    """
+    Returns a line per scenario in both runs with the ratio of the new to
+    the old throughput and p50 of each stage, where below 1 is faster.
+    """
+    old_scenarios = {scenario_key(result): result
+                     for result in old['scenarios']}
+    lines = []
+    for result in new['scenarios']:
+        before = old_scenarios.get(scenario_key(result))
+        if before is None:
+            continue
+        ratios = ', '.join(
+            f'{stage} x{stats["p50_ms"] / before["stages"][stage]["p50_ms"]:.2f}'
+            for stage, stats in result['stages'].items()
+            if before['stages'][stage]['p50_ms'])
+        lines.append(f'{result["sites"]} sites, {result["days"]} days: '
+                     f'throughput x'
+                     f'{result["sites_per_second"] / before["sites_per_second"]:.2f}'
+                     f'; p50 {ratios}')
+    return lines
+
+
+def run_benchmark(scenarios: list, output_path: str) -> dict:
+    """
+    Runs each scenario in a fresh process and saves the results to
+    output_path as JSON with the commit, Python version and time of the run.
+    """
+    results = {'commit': git_commit(),
+               'python': platform.python_version(),
+               'timestamp': datetime.now().isoformat(timespec='seconds'),
+               'scenarios': []}
+    for scenario in scenarios:
+        logger.info('Running benchmark scenario %s', scenario)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_scenario, scenario).result()
+        print(f'{result["sites"]:>6} sites {result["days"]:>2} days: '
+              f'{result["sites_per_second"]:>9} sites/s, '
+              f'peak RSS {result["peak_rss_kib"]} KiB')
+        results['scenarios'].append(result)
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=2)
+    return results
+
+
+def main() -> None:
+    """Parses the command line arguments and runs the benchmark."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the forecast pipeline.')
+    parser.add_argument('--sites', default='1,100,1000,10000',
+                        help='comma separated site counts')
+    parser.add_argument('--days', default='1,7,15',
+                        help='comma separated forecast lengths, 1 to 15')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='number of sites built at the same time')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='latency added to each synthetic API call')
+    parser.add_argument('--unique', type=float, default=1.0,
+                        help='fraction of the sites that are distinct')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='turn off the response cache')
+    parser.add_argument('--transport', choices=('synthetic', 'config'),
+                        default='synthetic',
+                        help='synthetic responses, or the APIs as set in '
+                             'config.ini')
+    parser.add_argument('--vc-key', default=os.environ.get('VC_API_KEY',
+                                                           SYNTHETIC_VC_KEY),
+                        help='Visual Crossing API key for --transport config')
+    parser.add_argument('--trace', action='store_true',
+                        help='trace the peak Python memory, which is slower')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='file to save the results to')
+    parser.add_argument('--compare',
+                        help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    days = [int(value) for value in args.days.split(',')]
+    if not all(1 <= value <= 15 for value in days):
+        parser.error('--days must be from 1 to 15')
+    scenarios = [{'sites': int(sites), 'days': length,
+                  'workers': args.workers, 'latency_ms': args.latency_ms,
+                  'cache': not args.no_cache, 'unique': args.unique,
+                  'transport': args.transport, 'trace': args.trace,
+                  'vc_api_key': args.vc_key}
+                 for sites in args.sites.split(',') for length in days]
+    results = run_benchmark(scenarios, args.output)
+    print(f'[DONE] Results saved to "{args.output}".')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as old_file:
+            for line in compare_results(json.load(old_file), results):
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
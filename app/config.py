@@ -8,18 +8,209 @@ config.ini file.
 import configparser
 import os
 
+# The parsed config.ini is cached so it is only read once per process
+from functools import lru_cache
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+@lru_cache(maxsize=None)
+def load_config() -> configparser.ConfigParser:
+    """
+    Returns the settings in config.ini, which is read and parsed on the first
+    call only. Every module shares this one ConfigParser.
+    """
+    parser = configparser.ConfigParser()
+    parser.read('config.ini')
+    return parser
+
 
 ###############################################################################
 # CONFIGURE VARIABLES
 ###############################################################################
 # Reading Config info from config.ini
-config = configparser.ConfigParser()
-config.read('config.ini')
+config = load_config()
 
 # Folder name
 FOLDER_NAME = os.getcwd().split('\\')[-1]
 
-# API urls
-SUN_API_URL = config['API']['SUN_API_URL']
-VC_API_URL = config['API']['VC_API_URL']
-AURORA_API_URL = config['API']['AURORA_API_URL']
+# API urls. The fallbacks are the public endpoints so the app still runs when
+# config.ini does not override them.
+SUN_API_URL = config.get('API', 'SUN_API_URL',
+                         fallback='https://api.sunrise-sunset.org/json')
+VC_API_URL = config.get(
+    'API', 'VC_API_URL',
+    fallback='https://weather.visualcrossing.com/VisualCrossingWebServices/'
+             'rest/services/timeline/')
+AURORA_API_URL = config.get('API', 'AURORA_API_URL',
+                            fallback='https://api.auroras.live/v1/')
+
+# Concurrency. MAX_WORKERS bounds the number of API calls in flight at once.
+MAX_WORKERS = int(config.get('concurrency', 'max_workers', fallback='8'))
+
+# Shared HTTP client. POOL_CONNECTIONS is the number of hosts to keep a pool
+# for and POOL_MAXSIZE the number of keep-alive connections kept per host.
+POOL_CONNECTIONS = int(config.get('http', 'pool_connections', fallback='3'))
+POOL_MAXSIZE = int(config.get('http', 'pool_maxsize', fallback='10'))
+CONNECT_TIMEOUT = float(config.get('http', 'connect_timeout', fallback='3.05'))
+READ_TIMEOUT = float(config.get('http', 'read_timeout', fallback='10'))
+
+# Resilience. A failed GET is tried up to RETRY_ATTEMPTS times in all, waiting
+# a random time of up to RETRY_BASE_DELAY seconds, doubled after each attempt
+# and capped at RETRY_MAX_DELAY. After BREAKER_THRESHOLD failures in a row a
+# provider's calls fail at once for BREAKER_COOLDOWN seconds. Each forecast
+# must be built within DEADLINE seconds, or 0 for no deadline.
+RETRY_ATTEMPTS = int(config.get('resilience', 'retry_attempts', fallback='3'))
+RETRY_BASE_DELAY = float(config.get('resilience', 'retry_base_delay',
+                                    fallback='0.5'))
+RETRY_MAX_DELAY = float(config.get('resilience', 'retry_max_delay',
+                                   fallback='4'))
+BREAKER_THRESHOLD = int(config.get('resilience', 'breaker_threshold',
+                                   fallback='5'))
+BREAKER_COOLDOWN = float(config.get('resilience', 'breaker_cooldown',
+                                    fallback='30'))
+DEADLINE = float(config.get('resilience', 'deadline', fallback='60'))
+
+# Hedging. The calls for each of HEDGE_KINDS race a second request, to another
+# backend or the same API, once the first has taken longer than the
+# HEDGE_PERCENTILE percentile of its recent latencies. Until HEDGE_MIN_SAMPLES
+# latencies are known HEDGE_INITIAL_DELAY seconds is used, and the delay is
+# never below HEDGE_MIN_DELAY seconds. Other kinds only fail over.
+HEDGE_KINDS = tuple(kind.strip() for kind in config.get(
+    'hedging', 'kinds', fallback='sun,aurora').split(',') if kind.strip())
+HEDGE_PERCENTILE = float(config.get('hedging', 'percentile', fallback='95'))
+HEDGE_INITIAL_DELAY = float(config.get('hedging', 'initial_delay',
+                                       fallback='2'))
+HEDGE_MIN_DELAY = float(config.get('hedging', 'min_delay', fallback='0.1'))
+HEDGE_MIN_SAMPLES = int(config.get('hedging', 'min_samples', fallback='20'))
+
+# Visual Crossing quota. Each API key may use DAILY_RECORDS records a day,
+# counted in the ledger at LEDGER_PATH. A request costs a record per day, or
+# per hour if it includes the hours. Records are spent at RECORDS_PER_SECOND
+# on average with bursts of up to BURST, or as fast as asked for if 0.
+# API_KEYS are used in turn with the user's key. A batch is planned
+# PLAN_WINDOW sites at a time so the sites fit the records left.
+QUOTA_DAILY_RECORDS = int(config.get('quota', 'daily_records',
+                                     fallback='1000'))
+QUOTA_LEDGER_PATH = config.get(
+    'quota', 'ledger_path',
+    fallback=os.path.join('cache', 'ledger.sqlite3'))
+QUOTA_RECORDS_PER_SECOND = float(config.get('quota', 'records_per_second',
+                                            fallback='20'))
+QUOTA_BURST = float(config.get('quota', 'burst', fallback='400'))
+VC_API_KEYS = tuple(key.strip() for key in config.get(
+    'quota', 'api_keys', fallback='').split(',') if key.strip())
+QUOTA_PLAN_WINDOW = int(config.get('quota', 'plan_window', fallback='256'))
+
+# Transport. MODE is 'live' to call the APIs, 'record' to also save every
+# response to FIXTURES_PATH, or 'replay' to answer from the saved responses
+# without calling the APIs. The stub server serves the same fixtures, with
+# STUB_LATENCY_MS of latency and STUB_ERROR_RATE of requests failing.
+TRANSPORT_MODE = config.get('transport', 'mode', fallback='live')
+TRANSPORT_FIXTURES_PATH = config.get('transport', 'fixtures_path',
+                                     fallback='fixtures')
+STUB_HOST = config.get('transport', 'stub_host', fallback='127.0.0.1')
+STUB_PORT = int(config.get('transport', 'stub_port', fallback='8081'))
+STUB_LATENCY_MS = float(config.get('transport', 'stub_latency_ms',
+                                   fallback='0'))
+STUB_ERROR_RATE = float(config.get('transport', 'stub_error_rate',
+                                   fallback='0'))
+
+# Ephemeris. A backend of 'local' computes the times offline instead of
+# calling the API. TIMEZONE is used for all local times in the forecast.
+SUN_BACKEND = config.get('ephemeris', 'sun_backend', fallback='api')
+LUNAR_BACKEND = config.get('ephemeris', 'lunar_backend', fallback='api')
+TIMEZONE = config.get('ephemeris', 'timezone', fallback='Europe/London')
+
+# Aurora. A mode of 'local' fetches the global three-day Kp forecast once per
+# run and estimates each site's probability offline. REFINE_WITH_API still
+# asks the API for each site's probability, using the estimate as a fallback.
+AURORA_MODE = config.get('aurora', 'mode', fallback='api')
+AURORA_REFINE_WITH_API = config.getboolean('aurora', 'refine_with_api',
+                                           fallback=False)
+
+# Cloud analysis. The night's cloud cover is summarised by its mean, minimum
+# and CLOUD_PERCENTILE percentile, and hours with less than CLEAR_THRESHOLD
+# percent cloud cover count as clear.
+CLOUD_PERCENTILE = float(config.get('clouds', 'night_percentile',
+                                    fallback='75'))
+CLEAR_THRESHOLD = float(config.get('clouds', 'clear_threshold',
+                                   fallback='20'))
+
+# Stargazing score. Hours scoring at least GOOD_SCORE (out of 100) can be
+# part of the night's best observing window. MOON_WEIGHT is how much a full
+# moon high in the sky takes off the score, as a fraction, and AURORA_WEIGHT
+# how much a certain aurora sighting adds.
+GOOD_SCORE = float(config.get('scoring', 'good_score', fallback='60'))
+MOON_WEIGHT = float(config.get('scoring', 'moon_weight', fallback='0.7'))
+AURORA_WEIGHT = float(config.get('scoring', 'aurora_weight', fallback='0.3'))
+
+# Metrics. If TEXTFILE is set, the Prometheus text format metrics are written
+# there at the end of each run, e.g. for a node exporter's textfile collector.
+METRICS_TEXTFILE = config.get('metrics', 'textfile_path', fallback='')
+
+# Grid search. Each provider is fetched once per cell of its resolution (in
+# degrees), so nearby grid points share one upstream fetch. GRID_PROCESSES is
+# the size of the process pool, or every CPU if 0.
+GRID_RESOLUTIONS = {
+    'sun': float(config.get('grid', 'sun_resolution', fallback='0.1')),
+    'visualcrossing': float(config.get('grid', 'visualcrossing_resolution',
+                                       fallback='0.1')),
+    'aurora': float(config.get('grid', 'aurora_resolution', fallback='1.0')),
+}
+GRID_PROCESSES = int(config.get('grid', 'processes', fallback='0'))
+
+# Forecast server. CACHE_SIZE is the number of built forecasts kept in memory
+# and CACHE_TTL how many seconds each is served for.
+SERVER_HOST = config.get('server', 'host', fallback='127.0.0.1')
+SERVER_PORT = int(config.get('server', 'port', fallback='8080'))
+SERVER_CACHE_SIZE = int(config.get('server', 'cache_size', fallback='4096'))
+SERVER_CACHE_TTL = float(config.get('server', 'cache_ttl', fallback='300'))
+
+# Response cache. The TTLs are in seconds. Sun and lunar data for a given
+# place and date never change, so they are kept for 30 days.
+CACHE_ENABLED = config.getboolean('cache', 'enabled', fallback=True)
+CACHE_PATH = config.get('cache', 'cache_path',
+                        fallback=os.path.join('cache', 'responses.sqlite3'))
+CACHE_MAX_ENTRIES = int(config.get('cache', 'max_entries', fallback='10000'))
+CACHE_COORD_PRECISION = int(config.get('cache', 'coord_precision',
+                                       fallback='2'))
+CACHE_TTLS = {
+    'sun': int(config.get('cache', 'sun_ttl', fallback='2592000')),
+    'lunar': int(config.get('cache', 'lunar_ttl', fallback='2592000')),
+    'cloud': int(config.get('cache', 'cloud_ttl', fallback='3600')),
+    'aurora': int(config.get('cache', 'aurora_ttl', fallback='900')),
+}
+# Seconds past its TTL a response may still be served while it is refreshed
+# in the background, and how many seconds before its TTL a response of a
+# provider with a stale limit is refreshed when it is served.
+CACHE_STALE = {
+    'sun': int(config.get('cache', 'sun_stale', fallback='0')),
+    'lunar': int(config.get('cache', 'lunar_stale', fallback='0')),
+    'cloud': int(config.get('cache', 'cloud_stale', fallback='1800')),
+    'aurora': int(config.get('cache', 'aurora_stale', fallback='900')),
+}
+CACHE_REFRESH_AHEAD = int(config.get('cache', 'refresh_ahead',
+                                     fallback='120'))
+
+# Prefetch. Every PREFETCH_INTERVAL seconds the responses of
+# PREFETCH_PROVIDERS that expire within PREFETCH_LEAD seconds are refreshed.
+PREFETCH_INTERVAL = float(config.get('prefetch', 'interval', fallback='60'))
+PREFETCH_LEAD = float(config.get('prefetch', 'lead', fallback='300'))
+PREFETCH_PROVIDERS = tuple(provider.strip() for provider in config.get(
+    'prefetch', 'providers', fallback='cloud,aurora').split(',')
+    if provider.strip())
+
+# Incremental builds. main.py keeps the forecast it built in
+# INCREMENTAL_STATE_PATH and only refetches the cloud cover and the aurora
+# forecast once they are older than CLOUD_MAX_AGE and AURORA_MAX_AGE seconds.
+INCREMENTAL_ENABLED = config.getboolean('incremental', 'enabled',
+                                        fallback=True)
+INCREMENTAL_STATE_PATH = config.get(
+    'incremental', 'state_path',
+    fallback=os.path.join('cache', 'forecast_state.json'))
+CLOUD_MAX_AGE = float(config.get('incremental', 'cloud_max_age',
+                                 fallback='3600'))
+AURORA_MAX_AGE = float(config.get('incremental', 'aurora_max_age',
+                                  fallback='1800'))
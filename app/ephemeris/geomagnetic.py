@@ -0,0 +1,73 @@
+"""
+Offline aurora visibility model. Converts locations to geomagnetic latitude
+with a centred dipole model of the Earth's field and estimates the chance of
+seeing the aurora for a Kp index, with NumPy for whole arrays of locations.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# NumPy does the maths for every location in one pass.
+# It may be necessary to pip install numpy
+import numpy as np
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+# Geographic position of the north geomagnetic pole (IGRF-13, 2020)
+POLE_LAT = 80.65
+POLE_LNG = -72.68
+
+# Geomagnetic latitude, in degrees, of the equatorward edge of the visible
+# aurora for Kp 0, and how far it moves towards the equator per Kp step.
+# Kp 5 puts the edge at about 56 degrees.
+BOUNDARY_AT_KP0 = 66.0
+BOUNDARY_PER_KP = 2.0
+
+# Degrees over which the probability rises from about 27% to 73% around the
+# edge of the visible aurora.
+BOUNDARY_WIDTH = 2.0
+
+# Probability (%) at which each colour status starts, in the same colours as
+# auroras.live uses.
+COLOUR_THRESHOLDS = ((50, 'red'), (30, 'amber'), (10, 'yellow'))
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def geomagnetic_latitude(lats: np.ndarray | float,
+                         lngs: np.ndarray | float) -> np.ndarray:
+    """
+    Returns the geomagnetic latitude, in degrees, of geographic locations
+    using a centred dipole aligned with the geomagnetic poles.
+    """
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lng_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+    pole_lat, pole_lng = np.radians(POLE_LAT), np.radians(POLE_LNG)
+    return np.degrees(np.arcsin(
+        np.sin(lat_rad) * np.sin(pole_lat)
+        + np.cos(lat_rad) * np.cos(pole_lat) * np.cos(lng_rad - pole_lng)))
+
+
+def aurora_probability(geomag_lats: np.ndarray | float,
+                       kp: np.ndarray | float) -> np.ndarray:
+    """
+    Estimates the probability (%) of seeing the aurora from geomagnetic
+    latitudes for a Kp index. It rises smoothly from 0 to 100 across the
+    equatorward edge of the visible aurora, which moves to lower latitudes
+    as Kp increases. Both hemispheres are treated alike.
+    """
+    boundary = BOUNDARY_AT_KP0 - BOUNDARY_PER_KP * np.asarray(kp,
+                                                              dtype=np.float64)
+    distance = np.abs(np.asarray(geomag_lats, dtype=np.float64)) - boundary
+    return 100.0 / (1.0 + np.exp(-distance / BOUNDARY_WIDTH))
+
+
+def aurora_colour(probability: np.ndarray | float) -> np.ndarray:
+    """Returns the colour status for each probability (%)."""
+    probability = np.asarray(probability, dtype=np.float64)
+    return np.select([probability >= threshold
+                      for threshold, _ in COLOUR_THRESHOLDS],
+                     [colour for _, colour in COLOUR_THRESHOLDS],
+                     default='green')
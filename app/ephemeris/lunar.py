@@ -0,0 +1,233 @@
+"""
+Offline lunar ephemeris. Computes moonrise, moonset, the moon phase and its
+illumination with NumPy, for whole arrays of dates and locations at once.
+
+The moon's position uses the low precision series from the Astronomical
+Almanac, which is good to a few tenths of a degree, or a minute or two in
+the rise and set times.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# Datetime and ZoneInfo find the start of each local day
+from datetime import datetime as dt
+from zoneinfo import ZoneInfo
+
+# NumPy does the maths for every date and location in one pass.
+# It may be necessary to pip install numpy
+import numpy as np
+
+# Shared constant for converting Unix times to Julian dates
+from ephemeris.solar import UNIX_EPOCH_JD
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+# Minutes between altitude samples when searching for rise and set
+STEP_MINUTES = 20
+SAMPLES = 24 * 60 // STEP_MINUTES + 1
+
+# Number of date and location pairs sampled at once, which bounds memory use
+CHUNK_SIZE = 4096
+
+# Principal phases. A day on which the moon passes one of these is given
+# exactly that phase, as Visual Crossing does.
+PRINCIPAL_PHASES = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def _sin_deg(angle: np.ndarray) -> np.ndarray:
+    """Sine of an angle in degrees."""
+    return np.sin(np.radians(angle))
+
+
+def moon_position(jd: np.ndarray) -> tuple:
+    """
+    Returns the moon's geocentric ecliptic longitude and latitude and its
+    horizontal parallax, all in degrees, for an array of Julian dates.
+    """
+    t = (jd - 2451545.0) / 36525.0
+    lng = (218.32 + 481267.881 * t
+           + 6.29 * _sin_deg(135.0 + 477198.87 * t)
+           - 1.27 * _sin_deg(259.3 - 413335.36 * t)
+           + 0.66 * _sin_deg(235.7 + 890534.22 * t)
+           + 0.21 * _sin_deg(269.9 + 954397.74 * t)
+           - 0.19 * _sin_deg(357.5 + 35999.05 * t)
+           - 0.11 * _sin_deg(186.5 + 966404.03 * t))
+    lat = (5.13 * _sin_deg(93.3 + 483202.02 * t)
+           + 0.28 * _sin_deg(228.2 + 960400.89 * t)
+           - 0.28 * _sin_deg(318.3 + 6003.15 * t)
+           - 0.17 * _sin_deg(217.6 - 407332.21 * t))
+    parallax = (0.9508
+                + 0.0518 * np.cos(np.radians(135.0 + 477198.87 * t))
+                + 0.0095 * np.cos(np.radians(259.3 - 413335.36 * t))
+                + 0.0078 * np.cos(np.radians(235.7 + 890534.22 * t))
+                + 0.0028 * np.cos(np.radians(269.9 + 954397.74 * t)))
+    return np.mod(lng, 360.0), lat, parallax
+
+
+def moon_altitude(jd: np.ndarray,
+                  lats: np.ndarray,
+                  lngs: np.ndarray) -> tuple:
+    """
+    Returns the moon's geocentric altitude and horizontal parallax, in
+    degrees, at the given Julian dates and locations.
+    """
+    ecl_lng, ecl_lat, parallax = moon_position(jd)
+    lam, beta = np.radians(ecl_lng), np.radians(ecl_lat)
+    obliq = np.radians(23.439 - 0.013 * (jd - 2451545.0) / 36525.0)
+    # Ecliptic to equatorial coordinates
+    right_asc = np.arctan2(
+        np.sin(lam) * np.cos(obliq) - np.tan(beta) * np.sin(obliq),
+        np.cos(lam))
+    declination = np.arcsin(np.sin(beta) * np.cos(obliq)
+                            + np.cos(beta) * np.sin(obliq) * np.sin(lam))
+    # Local sidereal time gives the hour angle
+    sidereal = np.radians(280.46061837
+                          + 360.98564736629 * (jd - 2451545.0) + lngs)
+    hour_angle = sidereal - right_asc
+    lat_rad = np.radians(lats)
+    altitude = np.degrees(np.arcsin(
+        np.sin(lat_rad) * np.sin(declination)
+        + np.cos(lat_rad) * np.cos(declination) * np.cos(hour_angle)))
+    return altitude, parallax
+
+
+def moon_phase(jd: np.ndarray) -> np.ndarray:
+    """
+    Returns the fraction of the way through the lunation, from 0 (new moon)
+    through 0.5 (full moon) to 1, for an array of Julian dates.
+    """
+    n = jd - 2451545.0
+    # Low precision apparent longitude of the sun
+    mean_anom = np.radians(357.528 + 0.9856003 * n)
+    sun_lng = (280.460 + 0.9856474 * n + 1.915 * np.sin(mean_anom)
+               + 0.020 * np.sin(2 * mean_anom))
+    moon_lng, _, _ = moon_position(jd)
+    return np.mod(moon_lng - sun_lng, 360.0) / 360.0
+
+
+def illumination(phase: np.ndarray) -> np.ndarray:
+    """Returns the illuminated fraction of the moon's disc for a phase."""
+    return (1.0 - np.cos(2.0 * np.pi * phase)) / 2.0
+
+
+def local_midnights(dates: np.ndarray, tz_name: str) -> np.ndarray:
+    """
+    Returns the Unix time of 00:00 local time in tz_name on each date.
+    """
+    zone = ZoneInfo(tz_name)
+    days = np.asarray(dates, dtype='datetime64[D]')
+    # The UTC offset only needs finding once for each distinct date
+    unique_days, index = np.unique(days, return_inverse=True)
+    offsets = np.array([
+        dt.fromisoformat(str(day)).replace(tzinfo=zone).utcoffset()
+        .total_seconds() for day in unique_days])
+    seconds = days.astype('datetime64[s]').astype(np.float64)
+    return seconds - offsets[index].reshape(days.shape)
+
+
+def _crossings(epochs: np.ndarray, height: np.ndarray, rising: bool) -> np.ndarray:
+    """
+    Returns the first time in each row where height crosses zero, upwards if
+    rising is True and downwards otherwise, interpolated linearly between
+    samples. Rows without a crossing are NaN.
+    """
+    before, after = height[:, :-1], height[:, 1:]
+    if rising:
+        crossed = (before < 0) & (after >= 0)
+    else:
+        crossed = (before >= 0) & (after < 0)
+    found = crossed.any(axis=1)
+    first = np.argmax(crossed, axis=1)
+    rows = np.arange(len(height))
+    h_before, h_after = before[rows, first], after[rows, first]
+    fraction = h_before / (h_before - h_after)
+    times = epochs[rows, first] + fraction * STEP_MINUTES * 60.0
+    return np.where(found, times, np.nan)
+
+
+def _rise_and_set(midnights: np.ndarray,
+                  lats: np.ndarray,
+                  lngs: np.ndarray) -> tuple:
+    """
+    Returns the first moonrise and moonset in the 24 hours after each of the
+    1-D arrays of midnights, at the matching lats and lngs. The altitudes are
+    sampled CHUNK_SIZE days at a time.
+    """
+    rises = np.empty(midnights.size)
+    sets = np.empty(midnights.size)
+    offsets = np.arange(SAMPLES) * STEP_MINUTES * 60.0
+    for start in range(0, midnights.size, CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        # (pairs in chunk, samples through the day)
+        epochs = midnights[chunk, None] + offsets
+        altitude, parallax = moon_altitude(epochs / 86400.0 + UNIX_EPOCH_JD,
+                                           lats[chunk, None],
+                                           lngs[chunk, None])
+        height = altitude - (0.7275 * parallax - 0.5667)
+        rises[chunk] = _crossings(epochs, height, rising=True)
+        sets[chunk] = _crossings(epochs, height, rising=False)
+    return rises, sets
+
+
+def _daily_phase(midnights: np.ndarray) -> tuple:
+    """
+    Returns the phase for the day starting at each midnight, and the exact
+    phase at local noon. The daily phase is the noon phase rounded to two
+    decimal places, or a principal phase if the moon passes one that day.
+    """
+    start_phase = moon_phase(midnights / 86400.0 + UNIX_EPOCH_JD)
+    end_phase = moon_phase((midnights + 86400.0) / 86400.0 + UNIX_EPOCH_JD)
+    end_phase = np.where(end_phase < start_phase, end_phase + 1.0, end_phase)
+    noon_phase = moon_phase((midnights + 43200.0) / 86400.0 + UNIX_EPOCH_JD)
+    phase = np.round(noon_phase, 2)
+    for principal in PRINCIPAL_PHASES:
+        passed = (start_phase <= principal) & (principal < end_phase)
+        phase = np.where(passed, principal % 1.0, phase)
+    # Rounding can give 1.0 just before a new moon, which is the same as 0
+    return np.mod(phase, 1.0), noon_phase
+
+
+def lunar_events(dates: np.ndarray,
+                 lats: np.ndarray | float,
+                 lngs: np.ndarray | float,
+                 tz_name: str) -> dict:
+    """
+    Computes the moonrise, moonset, phase and illumination for arrays of
+    dates and locations, with days running from local midnight in tz_name.
+    The inputs are broadcast against each other, so for example dates of
+    shape (days, 1) and lats/lngs of shape (sites,) give results of shape
+    (days, sites).
+
+    The moon's altitude is sampled every STEP_MINUTES through each day and
+    rise and set are the first upward and downward crossings of the
+    standard altitude for the moon, 0.7275 * parallax - 0.5667 degrees.
+
+    Parameters:
+        dates (np.ndarray): Dates as numpy datetime64[D] values.
+        lats (np.ndarray | float): Latitudes in degrees.
+        lngs (np.ndarray | float): Longitudes in degrees, east positive.
+        tz_name (str): IANA timezone the days are counted in.
+
+    Returns:
+        dict: 'moonrise' and 'moonset' as Unix times (NaN on days without
+        one), 'moonphase' as a lunation fraction rounded to two decimal
+        places like Visual Crossing's, and 'illumination' as a fraction.
+    """
+    midnights = local_midnights(dates, tz_name)
+    midnights, lats, lngs = np.broadcast_arrays(
+        midnights, np.asarray(lats, dtype=np.float64),
+        np.asarray(lngs, dtype=np.float64))
+    shape = midnights.shape
+    midnights, lats, lngs = midnights.ravel(), lats.ravel(), lngs.ravel()
+
+    rises, sets = _rise_and_set(midnights, lats, lngs)
+    phase, noon_phase = _daily_phase(midnights)
+    return {'moonrise': rises.reshape(shape),
+            'moonset': sets.reshape(shape),
+            'moonphase': phase.reshape(shape),
+            'illumination': illumination(noon_phase).reshape(shape)}
@@ -0,0 +1,139 @@
+"""
+Offline solar ephemeris. Computes sunrise, sunset and civil, nautical and
+astronomical twilight times with NumPy, for whole arrays of dates and
+locations at once.
+
+The solar position uses the NOAA low precision formulas (from Meeus), which
+are accurate to about a minute for event times.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# NumPy does the maths for every date and location in one pass.
+# It may be necessary to pip install numpy
+import numpy as np
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+# Julian date of the Unix epoch, 1970-01-01 00:00 UTC
+UNIX_EPOCH_JD = 2440587.5
+
+# Altitude of the sun's centre, in degrees, for each pair of events. -0.833
+# allows for refraction and the size of the sun's disc at sunrise and sunset.
+EVENT_ALTITUDES = {
+    ('sunrise', 'sunset'): -0.833,
+    ('civil_twilight_begin', 'civil_twilight_end'): -6.0,
+    ('nautical_twilight_begin', 'nautical_twilight_end'): -12.0,
+    ('astronomical_twilight_begin', 'astronomical_twilight_end'): -18.0,
+}
+
+# Event names in the same order as the sunrise-sunset.org API response
+EVENT_NAMES = [name for pair in EVENT_ALTITUDES for name in pair]
+
+# Number of times each event time is refined with the sun's position at the
+# previous estimate.
+ITERATIONS = 3
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def solar_position(jd: np.ndarray) -> tuple:
+    """
+    Returns the sun's declination (radians) and the equation of time
+    (minutes) for an array of Julian dates.
+    """
+    # Julian centuries since J2000.0
+    t = (jd - 2451545.0) / 36525.0
+    # Geometric mean longitude and mean anomaly of the sun, in degrees
+    mean_lng = np.mod(280.46646 + t * (36000.76983 + t * 0.0003032), 360.0)
+    mean_anom = 357.52911 + t * (35999.05029 - 0.0001537 * t)
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    m_rad = np.radians(mean_anom)
+    # Equation of centre and the sun's apparent longitude
+    centre = (np.sin(m_rad) * (1.914602 - t * (0.004817 + 0.000014 * t))
+              + np.sin(2 * m_rad) * (0.019993 - 0.000101 * t)
+              + np.sin(3 * m_rad) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    app_lng = np.radians(mean_lng + centre - 0.00569 - 0.00478 * np.sin(omega))
+    # Obliquity of the ecliptic, corrected for nutation
+    obliq = np.radians(
+        23.0 + (26.0 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813)))
+                / 60.0) / 60.0 + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliq) * np.sin(app_lng))
+    # Equation of time, in minutes
+    y = np.tan(obliq / 2.0) ** 2
+    l_rad = np.radians(mean_lng)
+    eq_time = 4.0 * np.degrees(
+        y * np.sin(2 * l_rad)
+        - 2 * eccent * np.sin(m_rad)
+        + 4 * eccent * y * np.sin(m_rad) * np.cos(2 * l_rad)
+        - 0.5 * y * y * np.sin(4 * l_rad)
+        - 1.25 * eccent * eccent * np.sin(2 * m_rad))
+    return declination, eq_time
+
+
+def event_minutes(jd_midnight: np.ndarray,
+                  lat_rad: np.ndarray,
+                  lngs: np.ndarray,
+                  altitude: float,
+                  sign: float) -> np.ndarray:
+    """
+    Finds the time the sun's centre crosses altitude (degrees), in minutes
+    after 00:00 UTC. A sign of -1 gives the morning crossing and +1 the
+    evening crossing. Dates and locations where the sun never reaches the
+    altitude are NaN.
+    """
+    sin_alt = np.sin(np.radians(altitude))
+    # First guess is solar noon
+    minutes = 720.0 - 4.0 * lngs
+    for _ in range(ITERATIONS):
+        declination, eq_time = solar_position(jd_midnight + minutes / 1440.0)
+        cos_ha = ((sin_alt - np.sin(lat_rad) * np.sin(declination))
+                  / (np.cos(lat_rad) * np.cos(declination)))
+        # Outside [-1, 1] the sun never reaches the altitude, which leaves NaN
+        with np.errstate(invalid='ignore'):
+            hour_angle = np.degrees(np.arccos(cos_ha))
+        minutes = 720.0 - 4.0 * (lngs - sign * hour_angle) - eq_time
+    return minutes
+
+
+def solar_events(dates: np.ndarray,
+                 lats: np.ndarray | float,
+                 lngs: np.ndarray | float) -> dict:
+    """
+    Computes the sunrise, sunset and twilight times for arrays of dates and
+    locations. The inputs are broadcast against each other, so for example
+    dates of shape (days, 1) and lats/lngs of shape (sites,) give results of
+    shape (days, sites).
+
+    Each event is found from the time of solar noon and the hour angle at
+    which the sun reaches the event's altitude, refined ITERATIONS times
+    using the sun's position at the event itself.
+
+    Parameters:
+        dates (np.ndarray): Dates as numpy datetime64[D] values.
+        lats (np.ndarray | float): Latitudes in degrees.
+        lngs (np.ndarray | float): Longitudes in degrees, east positive.
+
+    Returns:
+        dict: Arrays of event times in seconds since the Unix epoch (UTC),
+        keyed by the sunrise-sunset.org event names. Events that do not
+        happen on a date, e.g. astronomical twilight in a British summer,
+        are NaN.
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.float64)
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.asarray(lngs, dtype=np.float64)
+    days, lat_rad, lngs = np.broadcast_arrays(days, lat_rad, lngs)
+    # Julian date at 00:00 UTC on each date
+    jd_midnight = days + UNIX_EPOCH_JD
+
+    events = {}
+    for (rise_name, set_name), altitude in EVENT_ALTITUDES.items():
+        for name, sign in ((rise_name, -1.0), (set_name, 1.0)):
+            minutes = event_minutes(jd_midnight, lat_rad, lngs, altitude, sign)
+            events[name] = days * 86400.0 + minutes * 60.0
+    return {name: events[name] for name in EVENT_NAMES}
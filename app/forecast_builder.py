@@ -5,21 +5,65 @@ provided data.
 ###############################################################################
 # IMPORTS
 ###############################################################################
-# Datetime combines date and time info. Imported as 'dt' for readability.
-from datetime import datetime as dt
+# Math is used to check for nights that couldn't be analysed
+import math
+
+# Packed arrays for the event times and the hourly cloud cover
+from array import array
+
+# Thread pools let the blocking API calls run at the same time
+from concurrent.futures import ThreadPoolExecutor
+
+# NumPy arrays are passed to the offline ephemeris engines.
+# It may be necessary to pip install numpy
+import numpy as np
 
 # Functions to call the APIs are imported from their relevant file
-from apis.sun_api import sun_api_call
-from apis.visualcrossing_api import lunar_api_call, cloud_api_call
-from apis.auroraslive_api import aurora_api_call
+from apis.sun_api import sun_api_call, sun_range_api_call
+from apis.visualcrossing_api import cloud_api_call, lunar_cloud_api_call
+# The aurora calls, and the offline estimate used in the local aurora mode
+from apis.auroraslive_api import aurora_api_call, aurora_threeday_call, \
+    aurora_local_probability
+# The deadline of a build, which in_context carries onto the thread pools
+from apis.resilience import deadline, in_context
+
+# Offline solar ephemeris engine, used instead of the Sun API when configured
+from ephemeris.solar import solar_events, EVENT_NAMES
+# Offline lunar ephemeris engine, used instead of the lunar API when configured
+from ephemeris.lunar import lunar_events, local_midnights
+
+# Utils are imported to convert the API times to epoch seconds
+from utils.datetime_utils import local_time_to_epoch, iso8601_to_epoch, \
+    sun_api_time_to_epoch, NO_EVENT_EPOCH
+# Functions to analyse the cloud cover while it is dark
+from utils.data_utils import dark_windows, night_cloud_stats
+
+# The typed forecast model the builders produce
+from forecast_model import SunDay, LunarDay, CloudDay, AuroraPeriod, \
+    AuroraTonight, NightScore, DayForecast, SiteForecast
 
-# Utils are imported for datetime formatting and data transformation
-from utils.datetime_utils import convert_to_24hr, reformat_iso8601
-from utils.data_utils import find_how_cloudy, find_moon_phase
+# The stargazing score engine
+from scoring import Timeline, score_timeline
 
 # Logging modules
 from logger import logging_setup
 
+# Decorator that records the time spent in each stage
+from metrics import stage
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import MAX_WORKERS, SUN_BACKEND, LUNAR_BACKEND, TIMEZONE, \
+    AURORA_MODE, AURORA_REFINE_WITH_API, DEADLINE
+
+# Shared, bounded pool for the individual API calls. The builders themselves
+# run on a separate pool (see build_forecasts) so a builder waiting on its
+# API calls never holds a slot the calls need.
+api_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS,
+                                  thread_name_prefix='api_call')
+
 
 ###############################################################################
 # SETUP LOGGING
@@ -30,16 +74,20 @@ logger = logging_setup(__name__)
 ###############################################################################
 # FORECAST BUILD FUNCTIONS
 ###############################################################################
-def sun_forecast_build(dates: list, user_lat: float, user_lng: float) -> dict:
+@stage
+def sun_forecast_build(dates: list, user_lat: float, user_lng: float) -> list:
     """
-    Builds a dictionary of the sun rise/set and twilight times for the given
-    dates and location.
+    Builds a SunDay of the sun rise/set and twilight times for each of the
+    given dates at the location.
+
+    It calls the sun_range_api_call function to get the times for every date
+    in one request. If that fails, it falls back to calling sun_api_call for
+    every date at once on the shared API pool. Then for each date it converts
+    the 12-hour clock times, which are in TIMEZONE, to epoch seconds in
+    EVENT_NAMES order, leaving out 'day_length', 'solar_noon' and 'date'.
 
-    For each date, it:
-    - Calls the sun_api_call function to get sunrise/sunset/twilight times.
-    - Formats the date as a string.
-    - Removes unwanted keys like 'day_length' and 'solar_noon'.
-    - Converts times to 24-hour format.
+    If SUN_BACKEND is 'local' in config.ini, the times are computed offline
+    by the solar ephemeris engine instead.
 
     Parameters:
         dates (list): List of datetime.date objects.
@@ -47,51 +95,124 @@ def sun_forecast_build(dates: list, user_lat: float, user_lng: float) -> dict:
         user_lng (float): Longitude of the user.
 
     Returns:
-        dict: A nested dictionary keyed by date with sun event times.
+        list: A SunDay for each date, in the same order as dates.
+        None: If the API calls failed.
     """
     logger.info('Running sun_forecast_build.')
 
-    sun_forecast = {}
-    for day in dates:
-        # Running sun_api_call function to get sun and twilight times
-        sun_api_response = sun_api_call(lat=user_lat, lng=user_lng, day=day)
-        # Formatting the date into the specified string format
-        day_str = dt.strftime(day, '%Y-%m-%d')
-        # Using the day string to populate the sun_forecast dictionary with the
-        # results section of the API response
-        sun_forecast[day_str] = sun_api_response['results']
-        # Removing unwanted data points from sun_forecast
-        sun_forecast[day_str].pop('day_length', None)
-        sun_forecast[day_str].pop('solar_noon', None)
-    # For loop that loops through the top level of sun_forecast
-    for _, forecast_times in sun_forecast.items():
-        # Each day has a dictionary of times. This for loop loops through the
-        # dictionary of times.
-        for key, time in forecast_times.items():
-            # Convert times to 24-hour clock using convert_to_24hr function
-            forecast_times[key] = convert_to_24hr(time)
+    if SUN_BACKEND == 'local':
+        # Computing all the event times for all dates in one pass
+        sun_events = solar_events(np.array(dates, dtype='datetime64[D]'),
+                                  user_lat, user_lng)
+        # One row of event times per date, with the same epoch as
+        # sunrise-sunset.org for events that don't happen
+        times = np.column_stack([sun_events[name] for name in EVENT_NAMES])
+        times = np.where(np.isnan(times), NO_EVENT_EPOCH,
+                         np.round(times)).astype(np.int64)
+        sun_forecast = [SunDay(array('q', row.tolist())) for row in times]
+        logger.debug('sun_forecast is %s', sun_forecast)
+        return sun_forecast
+
+    # One request for the whole range of dates
+    sun_api_results = sun_range_api_call(lat=user_lat,
+                                         lng=user_lng,
+                                         start_date=dates[0],
+                                         end_date=dates[-1])
+    if sun_api_results is None:
+        # Running the sun_api_call function for all dates concurrently. map
+        # keeps the responses in the same order as dates.
+        sun_api_responses = list(api_executor.map(in_context(
+            lambda day: sun_api_call(lat=user_lat, lng=user_lng, day=day)),
+            dates))
+        # The sun forecast is unavailable without every date's times
+        if None in sun_api_responses:
+            return None
+        sun_api_results = [sun_api_response['results']
+                           for sun_api_response in sun_api_responses]
+    sun_forecast = [
+        SunDay(array('q', (
+            # The API gives the 12-hour clock in TIMEZONE
+            sun_api_time_to_epoch(day, sun_api_result[name], TIMEZONE)
+            for name in EVENT_NAMES)))
+        for day, sun_api_result in zip(dates, sun_api_results)]
     logger.debug('sun_forecast is %s', sun_forecast)
     return sun_forecast
 
 
+def lunar_local_build(dates: list,
+                      user_lat: float,
+                      user_lng: float) -> list:
+    """
+    Computes the moon rise and set times and the moon phase offline with the
+    lunar ephemeris engine.
+
+    Parameters:
+        dates (list): List of datetime.date objects.
+        user_lat (float): Latitude of the user.
+        user_lng (float): Longitude of the user.
+
+    Returns:
+        list: A LunarDay for each date. Rise and set times are None on days
+        the moon doesn't rise or set.
+    """
+    lunar_events_by_day = lunar_events(np.array(dates, dtype='datetime64[D]'),
+                                       user_lat, user_lng, TIMEZONE)
+    rise_set = {
+        name: [None if np.isnan(epoch) else int(round(epoch))
+               for epoch in lunar_events_by_day[name].tolist()]
+        for name in ('moonrise', 'moonset')}
+    return [LunarDay(phase=phase, moonrise=moonrise, moonset=moonset)
+            for phase, moonrise, moonset in zip(
+                lunar_events_by_day['moonphase'].tolist(),
+                rise_set['moonrise'], rise_set['moonset'])]
+
+
+def lunar_api_build(dates: list, lunar_api_response: dict) -> list:
+    """
+    Converts the lunar part of a Visual Crossing response to a LunarDay for
+    each date. The rise and set times are in TIMEZONE, and are missing on
+    days the moon doesn't rise or set.
+    """
+    return [LunarDay(
+        phase=float(day['moonphase']),
+        moonrise=local_time_to_epoch(date, day['moonrise'], TIMEZONE)
+        if day.get('moonrise') else None,
+        moonset=local_time_to_epoch(date, day['moonset'], TIMEZONE)
+        if day.get('moonset') else None)
+        for date, day in zip(dates, lunar_api_response['days'])]
+
+
+def cloud_api_build(cloud_api_response: dict) -> list:
+    """
+    Converts the cloud part of a Visual Crossing response to a CloudDay for
+    each date, packing the hourly cloud cover into an array.
+    """
+    return [CloudDay(cloudcover=float(day['cloudcover']),
+                     hourly=array('f', (hour['cloudcover']
+                                        for hour in day.get('hours', []))))
+            for day in cloud_api_response['days']]
+
+
+@stage
 def vc_forecast_build(vc_api_key: str,
                       dates: list,
                       user_lat: float,
                       user_lng: float
-                      ) -> list | None:
+                      ) -> tuple | None:
     """
-    Builds a list of two dictionaries when a user API key is provided. One
-    dictionary is for the lunar forecast and one is or the cloud forecast.
+    Builds the lunar and cloud forecasts when a user API key is provided.
+
+    If an Visual Crossing API key is provided, it calls lunar_cloud_api_call,
+    which gets the lunar and cloud information in one request. Then for each
+    date it:
+    - Converts the moon rise and set times from the response to epoch
+    seconds and keeps the moon phase value.
+    - Extracts the level of cloud cover and the hourly cloud cover from the
+    API response.
 
-    If an Visual Crossing API key is provided, for each date it:
-    - Calls the lunar_api_call function to get moon rise and set times and the
-        moon phase.
-    - Extracts the moon rise and set times from the response.
-    - Extracts the moon phase value and calls find_moon_phase function to
-    convert this to a descriptive name.
-    - Calls the cloud_api_call function to get the level of cloud cover.
-    - Extracts the level of cloud cover from the API response.
-    - Uses the find_how_cloudy function to add a descriptive forecast.
+    If LUNAR_BACKEND is 'local' in config.ini, the lunar forecast is computed
+    offline by lunar_local_build instead, so it is given even without an
+    API key or if the API fails, and only cloud_api_call is called.
 
     Parameters:
         vc_api_key (str): user's API key for Visual Crossing.
@@ -100,79 +221,72 @@ def vc_forecast_build(vc_api_key: str,
         user_lng (float): Longitude of the user.
 
     Returns:
-        List: a list with two nested dictionaries. The first dictionary is the
-        lunar forecast keyed by date with moon rise/set times and phase. The
-        second dictionary is the cloud cover forecast keyed by date.
-        None: in the case a user API key is not given, None is returned.
+        tuple: (lunar_forecast, cloud_forecast). The first is a list of a
+        LunarDay for each date. The second is a list of a CloudDay for each
+        date, or None if the lunar forecast was computed offline and no API
+        key is given or cloud_api_call failed.
+        None: in the case a user API key is not given and the lunar forecast
+        needs one, or the API calls fail, None is returned.
     """
     logger.info('Running vc_forecast_build.')
 
-    lunar_forecast = {}
-    cloud_forecast = {}
-    if vc_api_key != 'xxx':
-        # Running the lunar_api_call function.
-        lunar_api_response = lunar_api_call(lat=user_lat,
-                                            lng=user_lng,
-                                            start_date=dates[0],
-                                            end_date=dates[-1],
-                                            api_key=vc_api_key)
-        # API call returns None for invalid API key. This if statement checks
-        # None has not been returned
-        if lunar_api_response is not None:
-            # Using a for loop to format the API response and populate the
-            # lunar_forecast dictionary
-            for day in lunar_api_response['days']:
-                day_str = day['datetime']
-                day.pop('datetime', None)
-                # Adding each day's lunar information to the lunar_forecast
-                # dictionary with the date at the key.
-                lunar_forecast[day_str] = day
-                # Converting the moon phase percentage into a descriptive name
-                # using the find_moon_phase function.
-                lunar_forecast[day_str]['moonphase'] = find_moon_phase(
-                    lunar_forecast[day_str]['moonphase'])
-
-            logger.debug('lunar_forecast is: %s', lunar_forecast)
-            # Cloud and lunar have the same API key so cloud can remain in the
-            # if statement
-            # Running the cloud function with the user's location and for the
-            # full three days.
-            cloud_api_response = cloud_api_call(lat=user_lat,
-                                                lng=user_lng,
-                                                start_date=dates[0],
-                                                end_date=dates[-1],
-                                                api_key=vc_api_key)
-            # Using a for loop to format the API response and populate the
-            # cloud_forecast dictionary.
-            for day in cloud_api_response['days']:
-                day_str = day['datetime']
-                day.pop('datetime', None)
-                # Adding an entry with a descriptive forecast of the cloud
-                # cover using the find_how_cloudy function.
-                day['cloudforecast'] = find_how_cloudy(day['cloudcover'])
-                # Adding cloud cover information to the cloud_forecast
-                # dictionary with the date at the key.
-                cloud_forecast[day_str] = day
-            logger.debug('cloud_forecast is: %s', cloud_forecast)
-            return [lunar_forecast, cloud_forecast]
-    return None
+    lunar_local = LUNAR_BACKEND == 'local'
+    if vc_api_key == 'xxx' and not lunar_local:
+        return None
+
+    cloud_api_response = None
+    call_kwargs = {'lat': user_lat,
+                   'lng': user_lng,
+                   'start_date': dates[0],
+                   'end_date': dates[-1],
+                   'api_key': vc_api_key}
+    if lunar_local:
+        lunar_forecast = lunar_local_build(dates, user_lat, user_lng)
+        if vc_api_key != 'xxx':
+            cloud_api_response = cloud_api_call(**call_kwargs)
+            # API calls return None for an invalid API key. The offline
+            # lunar forecast is still given without the cloud cover.
+            if cloud_api_response is None:
+                logger.warning('Cloud forecast failed, giving the lunar '
+                               'forecast only.')
+    else:
+        # One request for both the lunar and cloud information
+        lunar_api_response, cloud_api_response = lunar_cloud_api_call(
+            **call_kwargs)
+        # The API call returns None for an invalid API key. This if
+        # statement checks None has not been returned
+        if lunar_api_response is None:
+            return None
+        lunar_forecast = lunar_api_build(dates, lunar_api_response)
+    logger.debug('lunar_forecast is: %s', lunar_forecast)
 
+    if cloud_api_response is None:
+        return lunar_forecast, None
+    cloud_forecast = cloud_api_build(cloud_api_response)
+    logger.debug('cloud_forecast is: %s', cloud_forecast)
+    return lunar_forecast, cloud_forecast
 
+
+@stage
 def aurora_forecast_build(dates: list,
                           user_lat: float,
-                          user_lng: float) -> list:
+                          user_lng: float) -> tuple:
     """
-    Builds a list of two dictionaries containing the probability of seeing an
-    aurora on the first night and a longer three day forecast.
+    Builds the probability of seeing an aurora on the first night and a
+    longer three day forecast.
 
     It:
     - Calls the aurora_api_call function for probability of auroras at the
-      user's location.
-    - Extracts the probability from the API response and stores it in a dict.
-    - Calls the aurora_api_call function for the three day aurora forecast.
+      user's location and for the three day aurora forecast concurrently.
+    - Extracts the probability from the API response as an AuroraTonight.
     - Extracts the three-day forecast from from the API response
-    - Reformats the times within the forecast from ISO 8601 to a more readable
-      form.
+    - Converts the times within the forecast from ISO 8601 to epoch seconds.
+
+    If AURORA_MODE is 'local' in config.ini, the three-day forecast is the
+    global one fetched once per run by aurora_threeday_call, and the
+    probability is estimated offline by aurora_local_probability. The
+    probability is only requested from the API if AURORA_REFINE_WITH_API is
+    set.
 
     Parameters:
         dates (list): List of datetime.date objects.
@@ -180,50 +294,248 @@ def aurora_forecast_build(dates: list,
         user_lng (float): Longitude of the user.
 
     Returns:
-        List: a list of two nested dictionaries. The first dictionary contains
-        the likelihood of seeing the aurora that evening, while the second
-        gives a three-day probability forecast.
+        tuple: (aurora_prob, aurora_3day). The first is an AuroraTonight with
+        the likelihood of seeing the aurora that evening, while the second is
+        a dictionary keyed by date of a tuple of AuroraPeriods. If only one
+        of the API calls failed, its part is None or an empty dictionary.
+        None: If both the API calls failed.
     """
     logger.info('Running aurora_forecast_build.')
 
-    aurora_prob = {}
-    aurora_3day = {}
-    # Running the aurora_api_call function to call the API and receive the
-    # probability data
-    aurora_prob_api_response = aurora_api_call(
-        lat=user_lat, lng=user_lng, data='probability')
-    # Populating the aurora_prob dictionary with information from the full API
-    # response
-    aurora_prob['Probability'] = aurora_prob_api_response['value']
-    aurora_prob['Colour'] = aurora_prob_api_response['colour']
+    if AURORA_MODE == 'local':
+        # The three-day forecast is global, so it is shared by every site
+        aurora_3day_future = api_executor.submit(
+            in_context(aurora_threeday_call))
+        aurora_prob_api_response = None
+        if AURORA_REFINE_WITH_API:
+            aurora_prob_api_response = aurora_api_call(
+                lat=user_lat, lng=user_lng, data='probability')
+        aurora_3day_api_response = aurora_3day_future.result()
+        if aurora_prob_api_response is None and \
+                aurora_3day_api_response is not None:
+            aurora_prob_api_response = aurora_local_probability(
+                user_lat, user_lng, aurora_3day_api_response)
+    else:
+        # Running the aurora_api_call function twice at the same time to
+        # receive the probability data and the three-day forecast data.
+        aurora_prob_future = api_executor.submit(
+            in_context(aurora_api_call), lat=user_lat, lng=user_lng,
+            data='probability')
+        aurora_3day_future = api_executor.submit(
+            in_context(aurora_api_call), lat=user_lat, lng=user_lng,
+            data='threeday')
+        aurora_prob_api_response = aurora_prob_future.result()
+        aurora_3day_api_response = aurora_3day_future.result()
+    if aurora_prob_api_response is None and aurora_3day_api_response is None:
+        return None
+    # Populating aurora_prob with information from the full API response
+    aurora_prob = None if aurora_prob_api_response is None else AuroraTonight(
+        probability=int(aurora_prob_api_response['value']),
+        colour=aurora_prob_api_response['colour'])
 
     logger.debug('aurora_prob is: %s', aurora_prob)
-    # Running the aurora_api_call function to call the API and receive the
-    # three-day forecast data.
-    aurora_3day_api_response = aurora_api_call(
-        lat=user_lat, lng=user_lng, data='threeday')
     # aurora_3day_api_response['values'] is a list with three lists of
     # dictionaries. The following zips this list to the dates list, creating a
     # dictionary with an item for each day.
-    aurora_3day_zip = dict(zip(dates, aurora_3day_api_response['values']))
-    # Simplifying aurora_3day_zip for readability using dictionary
-    # comprehensions to iterate through aurora_3day_zip and the list of each
-    # time period's forecast.
+    aurora_3day_zip = {} if aurora_3day_api_response is None else \
+        dict(zip(dates, aurora_3day_api_response['values']))
+    # Simplifying aurora_3day_zip using dictionary comprehensions to iterate
+    # through aurora_3day_zip and the list of each time period's forecast.
     aurora_3day = {
-        date: [
-            {
-                # Using the reformat_iso8601 to format the start and end time
-                # of each period more clearly
-                'Start Time': reformat_iso8601(period['start']),
-                'End Time': reformat_iso8601(period['end']),
-                'Colour Status': period['colour'],
-                'Kp Value': period['value']
-            }
-            # Dictionary comprehension for individual time periods in the list
+        date: tuple(
+            AuroraPeriod(
+                # Using iso8601_to_epoch to store the start and end time of
+                # each period as epoch seconds
+                start=iso8601_to_epoch(period['start']),
+                end=iso8601_to_epoch(period['end']),
+                colour=period['colour'],
+                kp=float(period['value']))
+            # Comprehension for individual time periods in the list
             for period in periods
-        ]
+        )
         # Dictionary comprehension for each day in aurora_3day_zip
         for date, periods in aurora_3day_zip.items()
     }
     logger.debug('aurora_3day is: %s', aurora_3day)
-    return [aurora_prob, aurora_3day]
+    return aurora_prob, aurora_3day
+
+
+def failed_parts(provider: str, result, vc_api_key: str) -> list:
+    """
+    Returns the names of the parts of a provider's forecast that failed,
+    from its builder's result: [provider] if the builder failed, or
+    ['cloud'] if only the cloud cover of vc_forecast_build did, after the
+    lunar forecast was computed offline. Only vc_forecast_build gives None,
+    or no cloud cover, without failing, when no API key is given.
+    """
+    if provider == 'visualcrossing' and vc_api_key == 'xxx':
+        return []
+    if result is None:
+        return [provider]
+    if provider == 'visualcrossing' and result[1] is None:
+        return ['cloud']
+    return []
+
+
+def site_forecast(dates: list,
+                  user_lat: float,
+                  user_lng: float,
+                  built: tuple) -> SiteForecast:
+    """
+    Combines the results of the three builders into a SiteForecast.
+
+    Parameters:
+        dates (list): List of datetime.date objects.
+        user_lat (float): Latitude of the user.
+        user_lng (float): Longitude of the user.
+        built (tuple): (sun_forecast, vc_forecasts, aurora_forecast) as
+            returned by the builders. Any of them can be None.
+
+    Returns:
+        SiteForecast: A DayForecast for each date.
+    """
+    sun_forecast, vc_forecasts, aurora_forecast = built
+    lunar_forecast, cloud_forecast = vc_forecasts or (None, None)
+    aurora_prob, aurora_3day = aurora_forecast or (None, {})
+    days = [DayForecast(date=day, aurora=aurora_3day.get(day, ()))
+            for day in dates]
+    for index, day in enumerate(days):
+        day.sun = sun_forecast[index] if sun_forecast else None
+        day.lunar = lunar_forecast[index] if lunar_forecast else None
+        day.cloud = cloud_forecast[index] if cloud_forecast else None
+    return SiteForecast(lat=user_lat, lng=user_lng, days=days,
+                        aurora=aurora_prob)
+
+
+def build_forecasts(vc_api_key: str,
+                    dates: list,
+                    user_lat: float,
+                    user_lng: float) -> SiteForecast:
+    """
+    Runs sun_forecast_build, vc_forecast_build and aurora_forecast_build
+    concurrently, so the total wait is roughly the slowest single API call
+    rather than the sum of all of them.
+
+    Each builder runs on its own thread, while the API calls inside the
+    builders share the bounded api_executor pool. The API calls must finish
+    within DEADLINE seconds, and any provider that fails, or runs out of
+    time, is listed in the forecast's failed attribute.
+
+    Parameters:
+        vc_api_key (str): user's API key for Visual Crossing.
+        dates (list): List of datetime.date objects.
+        user_lat (float): Latitude of the user.
+        user_lng (float): Longitude of the user.
+
+    Returns:
+        SiteForecast: The combined forecast, ready for forecast_output.
+    """
+    logger.info('Running build_forecasts.')
+
+    with deadline(DEADLINE), ThreadPoolExecutor(
+            max_workers=3, thread_name_prefix='builder') as executor:
+        futures = {
+            'sun': executor.submit(in_context(sun_forecast_build),
+                                   dates, user_lat, user_lng),
+            'visualcrossing': executor.submit(
+                in_context(vc_forecast_build), vc_api_key, dates, user_lat,
+                user_lng),
+            'aurora': executor.submit(in_context(aurora_forecast_build),
+                                      dates, user_lat, user_lng)}
+        built = {provider: future.result()
+                 for provider, future in futures.items()}
+    forecast = site_forecast(dates, user_lat, user_lng, tuple(built.values()))
+    forecast.failed = [name for provider, result in built.items()
+                       for name in failed_parts(provider, result, vc_api_key)]
+    analyse_nights([forecast])
+    return forecast
+
+
+###############################################################################
+# ANALYSIS FUNCTIONS
+###############################################################################
+def night_arrays(nights: list) -> Timeline:
+    """
+    Stacks the hourly cloud cover, aurora Kp and sun times of each night for
+    night_cloud_stats and score_timeline.
+
+    Parameters:
+        nights (list): (forecast, index) pairs, where forecast is a
+            SiteForecast and index the day the night starts on.
+
+    Returns:
+        Timeline: Each night has 48 hours from midnight, so it runs into the
+        next day's forecasts, with NaN where there is no forecast.
+    """
+    hourly = np.full((len(nights), 48), np.nan, dtype=np.float32)
+    kp = np.full((len(nights), 48), np.nan, dtype=np.float32)
+    midnights = local_midnights(
+        np.array([forecast.days[index].date for forecast, index in nights],
+                 dtype='datetime64[D]'), TIMEZONE)
+    hour_starts = midnights[:, None] + np.arange(48) * 3600.0
+    for row, (forecast, index) in enumerate(nights):
+        middles = hour_starts[row] + 1800.0
+        for offset, day in enumerate(forecast.days[index:index + 2]):
+            if day.cloud is not None:
+                # The array('f') is copied without unpacking each value
+                hours = np.frombuffer(day.cloud.hourly, dtype=np.float32)
+                hourly[row, offset * 24:offset * 24 + hours.size] = hours[:24]
+            for period in day.aurora:
+                kp[row, (middles >= period.start)
+                   & (middles < period.end)] = period.kp
+    return Timeline(
+        hour_starts=hour_starts,
+        sun_times=np.array([forecast.days[index].sun.times
+                            for forecast, index in nights], dtype=np.float64),
+        cloud=hourly, kp=kp,
+        lats=np.array([forecast.lat for forecast, _ in nights]),
+        lngs=np.array([forecast.lng for forecast, _ in nights]))
+
+
+def optional_epoch(value: float) -> int | None:
+    """Returns NaN epoch seconds as None and the rest as an int."""
+    return None if math.isnan(value) else int(value)
+
+
+@stage
+def analyse_nights(forecasts: list) -> None:
+    """
+    Summarises the cloud cover while it is dark and scores the stargazing on
+    every night of every forecast in one vectorised pass.
+
+    It fills in the night_ fields and clear_hours of each CloudDay, and the
+    NightScore of each DayForecast. Days without a sun forecast are skipped,
+    and days without a cloud forecast are scored on the sky alone.
+
+    Parameters:
+        forecasts (list): SiteForecast objects.
+    """
+    nights = [(forecast, index) for forecast in forecasts
+              for index, day in enumerate(forecast.days)
+              if day.sun is not None]
+    if not nights:
+        return
+    timeline = night_arrays(nights)
+    stats = night_cloud_stats(timeline.cloud, timeline.hour_starts,
+                              *dark_windows(timeline.sun_times))
+    scores = score_timeline(timeline)
+    # tolist gives Python floats and ints, with NaN for nights that had no
+    # dark hours or no good hours.
+    for row, (mean, least, percentile, clear_hours) in enumerate(zip(
+            stats['mean'].tolist(), stats['min'].tolist(),
+            stats['percentile'].tolist(), stats['clear_hours'].tolist())):
+        forecast, index = nights[row]
+        day = forecast.days[index]
+        if day.cloud is not None and not math.isnan(mean):
+            day.cloud.night_mean = round(mean, 1)
+            day.cloud.night_min = round(least, 1)
+            day.cloud.night_percentile = round(percentile, 1)
+            day.cloud.clear_hours = clear_hours
+        window_score = float(scores['score'][row])
+        day.score = NightScore(
+            hourly=array('f', scores['scores'][row].round(1)),
+            peak=round(float(scores['peak'][row]), 1),
+            window_start=optional_epoch(scores['start'][row]),
+            window_end=optional_epoch(scores['end'][row]),
+            window_score=None if math.isnan(window_score)
+            else round(window_score, 1))
@@ -0,0 +1,129 @@
+"""
+The typed model the forecast builders produce and the output writers read.
+
+Every class uses __slots__ so a forecast doesn't carry a dictionary per
+object. Event times are stored as seconds since the Unix epoch, and are only
+formatted as clock times in TIMEZONE when they are written out. The hourly
+cloud cover is kept as a packed array of floats.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# Packed arrays for the event times and the hourly cloud cover
+from array import array
+
+# Dataclasses for the model's records
+from dataclasses import dataclass, field
+from datetime import date
+
+# Names of the solar and twilight events, in the order they are stored
+from ephemeris.solar import EVENT_NAMES
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+@dataclass(slots=True)
+class SunDay:
+    """
+    One day's solar and twilight event times, as epoch seconds in
+    EVENT_NAMES order. Events that don't happen are NO_EVENT_EPOCH, the same
+    as sunrise-sunset.org gives.
+    """
+    times: array
+
+    def items(self):
+        """Returns (event name, epoch seconds) pairs in EVENT_NAMES order."""
+        return zip(EVENT_NAMES, self.times)
+
+    def __getitem__(self, name: str) -> int:
+        return self.times[EVENT_NAMES.index(name)]
+
+
+@dataclass(slots=True)
+class LunarDay:
+    """
+    One day's moon phase, from 0 to 1 where 0.5 is a full moon, and its rise
+    and set times as epoch seconds, or None if it doesn't rise or set.
+    """
+    phase: float
+    moonrise: int | None
+    moonset: int | None
+
+
+@dataclass(slots=True)
+class CloudDay:
+    """
+    One day's cloud cover (%) and the cloud cover for each hour from
+    midnight, in an array('f').
+
+    The night_ fields summarise the cloud cover while it is dark that night
+    and clear_hours is the longest clear spell in hours. They are None until
+    analyse_nights has run, or if the night couldn't be analysed.
+    """
+    cloudcover: float
+    hourly: array
+    night_mean: float | None = None
+    night_min: float | None = None
+    night_percentile: float | None = None
+    clear_hours: int | None = None
+
+
+@dataclass(slots=True)
+class AuroraPeriod:
+    """One period of the three-day aurora forecast, with epoch second times."""
+    start: int
+    end: int
+    colour: str
+    kp: float
+
+
+@dataclass(slots=True)
+class AuroraTonight:
+    """The probability (%) of seeing the aurora tonight and its colour."""
+    probability: int
+    colour: str
+
+
+@dataclass(slots=True)
+class NightScore:
+    """
+    The night's stargazing score (0-100) for each hour from noon, in an
+    array('f'), its peak and the best observing window: the run of good hours
+    with the highest total score. The window's times are epoch seconds, or
+    None if no hour scored well enough.
+    """
+    hourly: array
+    peak: float
+    window_start: int | None = None
+    window_end: int | None = None
+    window_score: float | None = None
+
+
+@dataclass(slots=True)
+class DayForecast:
+    """
+    Everything forecast for one date. A part that wasn't built, e.g. the
+    cloud cover without an API key, is None. The score is None until
+    analyse_nights has run.
+    """
+    date: date
+    sun: SunDay | None = None
+    lunar: LunarDay | None = None
+    cloud: CloudDay | None = None
+    aurora: tuple = ()
+    score: NightScore | None = None
+
+
+@dataclass(slots=True)
+class SiteForecast:
+    """
+    The forecast for one location: a DayForecast per date, tonight's aurora
+    probability and the names of the providers that failed.
+    """
+    lat: float
+    lng: float
+    days: list
+    aurora: AuroraTonight | None = None
+    failed: list = field(default_factory=list)
+    site_id: str | None = None
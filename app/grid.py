@@ -0,0 +1,359 @@
+"""
+GRID STARGAZING SEARCH
+Finds where in a region it will be best for stargazing. A lattice of points
+is laid over a bounding box, every point is forecast and scored, and the
+points are written out ranked by their best observing window, along with a
+raster of the score.
+
+Each provider's forecasts are fetched once per cell of its resolution in the
+[grid] section of config.ini, so nearby points share one upstream fetch. The
+fetches run on a pool of processes.
+
+Usage:
+    python3 grid.py --bbox 50.5,-2.0,52.5,1.0 --resolution 0.05
+    python3 grid.py --around 51.5,-0.1 --radius 200 --output grid
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import csv
+import math
+import os
+import time
+
+# Process pool for the upstream fetches
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+# NumPy builds the lattice and the raster.
+# It may be necessary to pip install numpy
+import numpy as np
+
+# Logging modules
+from logger import logging_setup
+
+# Functions to validate the region
+from utils.validation_utils import validate_lat, validate_lng, \
+    validate_length, validate_key
+# Function to create a list of dates
+from utils.datetime_utils import get_forecast_dates
+
+# Functions to combine the providers' forecasts and score the nights
+from forecast_builder import site_forecast, analyse_nights
+
+# The typed forecast model
+from forecast_model import SiteForecast
+
+# Function to run one provider's builder, as the batch mode does
+from batch import build_provider, PROVIDERS
+
+# Function to format the best observing window
+from output_writer import score_summary
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import GRID_RESOLUTIONS, GRID_PROCESSES
+
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.32
+
+# Columns of the ranked site list
+RANKING_FIELDS = ['rank', 'lat', 'lng', 'window_score', 'peak_score',
+                  'best_window_start', 'best_window_end', 'night_cloud_mean',
+                  'failed']
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def parse_bbox(value: str) -> tuple:
+    """
+    Validates a 'south,west,north,east' bounding box in degrees.
+
+    Raises:
+        ValueError: If a value isn't a valid latitude or longitude, or the
+        box is empty.
+    """
+    try:
+        south, west, north, east = value.split(',')
+    except ValueError as e:
+        raise ValueError('Expected south,west,north,east') from e
+    bbox = (validate_lat(south), validate_lng(west),
+            validate_lat(north), validate_lng(east))
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError('South must not be north of north, or west east '
+                         'of east')
+    return bbox
+
+
+def bbox_around(lat: float, lng: float, radius_km: float) -> tuple:
+    """
+    Returns the (south, west, north, east) bounding box of a circle of
+    radius_km around a point, clipped to valid coordinates.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    # A degree of longitude shrinks towards the poles
+    dlng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)),
+                                            1e-6))
+    return (max(lat - dlat, -90.0), max(lng - dlng, -180.0),
+            min(lat + dlat, 90.0), min(lng + dlng, 180.0))
+
+
+def grid_axes(bbox: tuple, resolution: float) -> tuple:
+    """
+    Returns the latitudes and longitudes of a lattice covering bbox, every
+    resolution degrees from its south west corner.
+    """
+    if resolution <= 0:
+        raise ValueError('Resolution must be positive')
+    south, west, north, east = bbox
+    # The small tolerance keeps the edge of the box when its size is a
+    # multiple of the resolution.
+    lats = south + np.arange(int((north - south) / resolution + 1e-9) + 1) \
+        * resolution
+    lngs = west + np.arange(int((east - west) / resolution + 1e-9) + 1) \
+        * resolution
+    return lats.round(6), lngs.round(6)
+
+
+def snap(values: np.ndarray, resolution: float) -> np.ndarray:
+    """Rounds coordinates to the nearest multiple of resolution."""
+    return (np.round(values / resolution) * resolution).round(6)
+
+
+def provider_cells(lats: np.ndarray, lngs: np.ndarray) -> dict:
+    """
+    Snaps every point to each provider's resolution in GRID_RESOLUTIONS.
+
+    Returns:
+        dict: (cells, inverse) for each provider, where cells is an (M, 2)
+        array of the distinct snapped locations and inverse gives the cell
+        of each point.
+    """
+    cells = {}
+    for provider in PROVIDERS:
+        resolution = GRID_RESOLUTIONS[provider]
+        points = np.column_stack([snap(lats, resolution),
+                                  snap(lngs, resolution)])
+        unique, inverse = np.unique(points, axis=0, return_inverse=True)
+        cells[provider] = (unique, inverse.reshape(-1))
+    return cells
+
+
+def build_job(job: tuple) -> tuple:
+    """Runs build_provider for one (provider, key, dates, lat, lng) job."""
+    return build_provider(*job)
+
+
+def fetch_cells(vc_api_key: str, dates: list, cells: dict,
+                processes: int) -> dict:
+    """
+    Builds each provider's forecast for each of its cells on a process pool.
+
+    Returns:
+        dict: The list of (result, failed) tuples from build_provider for
+        each provider, in the order of its cells.
+    """
+    jobs = [(provider, vc_api_key, dates, float(lat), float(lng))
+            for provider, (unique, _) in cells.items()
+            for lat, lng in unique]
+    logger.info('Fetching %s cells for %s points.', len(jobs),
+                len(next(iter(cells.values()))[1]))
+    with ProcessPoolExecutor(max_workers=processes or None) as executor:
+        results = list(executor.map(
+            build_job, jobs,
+            chunksize=max(1, len(jobs) // (4 * (processes or os.cpu_count()
+                                                or 1)))))
+    parts, start = {}, 0
+    for provider, (unique, _) in cells.items():
+        parts[provider] = results[start:start + len(unique)]
+        start += len(unique)
+    return parts
+
+
+def grid_forecasts(dates: list, points: tuple, cells: dict,
+                   parts: dict) -> list:
+    """
+    Combines the shared cell forecasts into a SiteForecast per point and
+    scores every night in one pass.
+
+    Parameters:
+        dates (list): List of datetime.date objects.
+        points (tuple): (lats, lngs) arrays of the points.
+        cells (dict): The cells from provider_cells.
+        parts (dict): The cell forecasts from fetch_cells.
+    """
+    forecasts = []
+    for index, (lat, lng) in enumerate(zip(*points)):
+        built = [parts[provider][cells[provider][1][index]]
+                 for provider in PROVIDERS]
+        forecast = site_forecast(dates, float(lat), float(lng),
+                                 tuple(result for result, _ in built))
+        forecast.failed = [name for _, failed in built for name in failed]
+        for day in forecast.days:
+            # Points sharing a cloud forecast can still have different
+            # nights, so each gets its own copy for analyse_nights to fill.
+            if day.cloud is not None:
+                day.cloud = replace(day.cloud)
+        forecasts.append(forecast)
+    analyse_nights(forecasts)
+    return forecasts
+
+
+def tonight(forecasts: list, field: str) -> np.ndarray:
+    """
+    Returns a NightScore field of each forecast's first night as an array,
+    NaN where it wasn't scored.
+    """
+    return np.array([np.nan if forecast.days[0].score is None
+                     or getattr(forecast.days[0].score, field) is None
+                     else getattr(forecast.days[0].score, field)
+                     for forecast in forecasts], dtype=np.float64)
+
+
+def rank_points(forecasts: list) -> np.ndarray:
+    """
+    Returns the order of the forecasts from the best first night to the
+    worst: by the best window's mean score, then the peak score, with
+    unscored nights last.
+    """
+    window = np.nan_to_num(tonight(forecasts, 'window_score'), nan=-1.0)
+    peak = np.nan_to_num(tonight(forecasts, 'peak'), nan=-1.0)
+    return np.lexsort((-peak, -window))
+
+
+def write_ranking(path: str, forecasts: list, order: np.ndarray) -> None:
+    """Writes the ranked site list as a CSV with the RANKING_FIELDS."""
+    with open(path, 'w', encoding='utf-8', newline='') as ranking_file:
+        writer = csv.DictWriter(ranking_file, fieldnames=RANKING_FIELDS,
+                                extrasaction='ignore')
+        writer.writeheader()
+        for rank, index in enumerate(order.tolist(), start=1):
+            forecast = forecasts[index]
+            day = forecast.days[0]
+            row = {'rank': rank, 'lat': forecast.lat, 'lng': forecast.lng,
+                   'failed': ';'.join(forecast.failed)}
+            if day.score is not None:
+                row.update(score_summary(day.score))
+            if day.cloud is not None:
+                row['night_cloud_mean'] = day.cloud.night_mean
+            writer.writerow(row)
+
+
+def write_raster(stem: str, axes: tuple, forecasts: list) -> None:
+    """
+    Writes the first night's scores as a raster, one row per latitude from
+    the south, to stem.npz with 'lats', 'lngs', 'window_score' and
+    'peak_score' arrays, and the peak scores to stem_raster.csv.
+    """
+    lats, lngs = axes
+    shape = (lats.size, lngs.size)
+    window = tonight(forecasts, 'window_score').reshape(shape)
+    peak = tonight(forecasts, 'peak').reshape(shape)
+    np.savez_compressed(f'{stem}.npz', lats=lats, lngs=lngs,
+                        window_score=window.astype(np.float32),
+                        peak_score=peak.astype(np.float32))
+    with open(f'{stem}_raster.csv', 'w', encoding='utf-8',
+              newline='') as raster_file:
+        writer = csv.writer(raster_file)
+        writer.writerow(['lat', *lngs.tolist()])
+        for lat, row in zip(lats.tolist(), peak.tolist()):
+            writer.writerow([lat, *('' if math.isnan(value) else value
+                                    for value in row)])
+
+
+def best_site(forecast: SiteForecast) -> dict:
+    """Returns the location and first night's best window of a forecast."""
+    best = {'lat': forecast.lat, 'lng': forecast.lng}
+    if forecast.days[0].score is not None:
+        best.update(score_summary(forecast.days[0].score))
+        del best['hourly_score']
+    return best
+
+
+def run_grid(bbox: tuple, resolution: float, output_path: str,
+             vc_api_key: str = 'xxx', days: int = 1) -> dict:
+    """
+    Forecasts and scores a lattice of points over bbox and writes the ranked
+    site list to output_path_ranking.csv and the score raster next to it.
+
+    Parameters:
+        bbox (tuple): (south, west, north, east) in degrees.
+        resolution (float): Spacing of the points in degrees.
+        output_path (str): Path the output files are named after.
+        vc_api_key (str): user's API key for Visual Crossing, or 'xxx'.
+        days (int): Number of days forecast. Points are ranked on the first
+            night.
+
+    Returns:
+        dict: Summary with the number of points and upstream fetches, the
+        time taken and the best point.
+    """
+    logger.info('Running grid for %s at %s degrees.', bbox, resolution)
+    start = time.perf_counter()
+    axes = grid_axes(bbox, resolution)
+    # One point per lattice node, latitude major so they reshape to the
+    # raster
+    points = tuple(grid.ravel() for grid in np.meshgrid(*axes,
+                                                        indexing='ij'))
+    dates = get_forecast_dates(days)
+    cells = provider_cells(*points)
+    parts = fetch_cells(vc_api_key, dates, cells, GRID_PROCESSES)
+    forecasts = grid_forecasts(dates, points, cells, parts)
+
+    stem = os.path.splitext(output_path)[0]
+    order = rank_points(forecasts)
+    write_ranking(f'{stem}_ranking.csv', forecasts, order)
+    write_raster(stem, axes, forecasts)
+
+    summary = {'points': len(forecasts),
+               'fetches': sum(len(unique) for unique, _ in cells.values()),
+               'seconds': round(time.perf_counter() - start, 3),
+               'best': best_site(forecasts[order[0]])}
+    logger.info('Grid summary: %s', summary)
+    return summary
+
+
+def main() -> None:
+    """Parses the command line arguments and runs the grid search."""
+    parser = argparse.ArgumentParser(
+        description='Find the best stargazing site in a region.')
+    region = parser.add_mutually_exclusive_group(required=True)
+    region.add_argument('--bbox', type=parse_bbox,
+                        help='south,west,north,east in degrees')
+    region.add_argument('--around',
+                        help='lat,lng of the centre of a --radius circle')
+    parser.add_argument('--radius', type=float, default=200.0,
+                        help='km around --around to search')
+    parser.add_argument('--resolution', type=float, default=0.05,
+                        help='spacing of the points in degrees')
+    parser.add_argument('--days', type=validate_length, default=1,
+                        help='number of days forecast, from 1 to 3')
+    parser.add_argument('--output', default='Stargazing_Grid',
+                        help='path the output files are named after')
+    parser.add_argument('--vc-key', default=os.environ.get('VC_API_KEY',
+                                                           'xxx'),
+                        help='Visual Crossing API key, "xxx" for none')
+    args = parser.parse_args()
+
+    bbox = args.bbox
+    if bbox is None:
+        lat, lng = args.around.split(',')
+        bbox = bbox_around(validate_lat(lat), validate_lng(lng), args.radius)
+    summary = run_grid(bbox, args.resolution, args.output,
+                       validate_key(args.vc_key), args.days)
+    print(f'[DONE] {summary["points"]} points from {summary["fetches"]} '
+          f'fetches in {summary["seconds"]}s. Best site: {summary["best"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+Incremental forecast builds, which only refetch the stale parts of the last
+forecast.
+
+The forecast built for a location is saved with the time each part of it was
+fetched. The next run for the same location, backends and Visual Crossing
+key reuses what is still fresh:
+- The sun and lunar forecasts of a date never change, so only the dates added
+  as the horizon rolls forward are fetched.
+- The cloud cover is fetched again once it is older than CLOUD_MAX_AGE
+  seconds, along with the lunar forecast from the same request.
+- The aurora forecast is fetched again once tonight's probability or the
+  periods of any date are older than AURORA_MAX_AGE seconds or missing, or
+  on a new day, as the probability is for tonight.
+
+If a refetch fails, or only gives some of the parts, the older parts are
+kept, so a provider is only listed as failed when the forecast has nothing
+from it. The nights are then analysed and scored again from the merged
+forecast.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import os
+import time
+
+# Packed arrays for the event times and the hourly cloud cover
+from array import array
+
+# The builders run at the same time, as in build_forecasts
+from concurrent.futures import ThreadPoolExecutor
+
+# The deadline of a build, which in_context carries onto the thread pool
+from apis.resilience import deadline, in_context
+
+# The parts are saved as fetched now, so no expired response may answer them
+from apis.response_cache import fresh_only
+
+# The hash that names the Visual Crossing key in the saved state
+from apis.quota import key_id
+
+# The builders of each part of the forecast and the night analysis
+from forecast_builder import sun_forecast_build, vc_forecast_build, \
+    aurora_forecast_build, failed_parts, analyse_nights
+
+# The typed forecast model the saved state is turned back into
+from forecast_model import SunDay, LunarDay, CloudDay, AuroraPeriod, \
+    AuroraTonight, DayForecast, SiteForecast
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import DEADLINE, INCREMENTAL_STATE_PATH, AURORA_MAX_AGE, \
+    CLOUD_MAX_AGE, SUN_BACKEND, LUNAR_BACKEND, AURORA_MODE
+
+# The version of the saved state's layout. A state saved with another one is
+# ignored.
+STATE_VERSION = 3
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def state_sources(vc_api_key: str) -> dict:
+    """
+    Returns where the saved parts come from: the sun, lunar and aurora
+    backends, and a hash of the Visual Crossing key, which is never saved
+    itself.
+    """
+    return {'sun': SUN_BACKEND, 'lunar': LUNAR_BACKEND, 'aurora': AURORA_MODE,
+            'key': key_id(vc_api_key)}
+
+
+def empty_state(user_lat: float, user_lng: float, vc_api_key: str) -> dict:
+    """Returns a state for the location with nothing fetched yet."""
+    return {'version': STATE_VERSION, 'lat': user_lat, 'lng': user_lng,
+            'sources': state_sources(vc_api_key), 'days': {},
+            'tonight': None}
+
+
+def load_state(user_lat: float,
+               user_lng: float,
+               vc_api_key: str,
+               path: str = INCREMENTAL_STATE_PATH) -> dict:
+    """
+    Returns the state saved at path if it is for the same location and
+    state_sources, or an empty state if it is for other ones, has another
+    layout or can't be read.
+    """
+    if not os.path.exists(path):
+        return empty_state(user_lat, user_lng, vc_api_key)
+    try:
+        with open(path, encoding='utf-8') as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        logger.warning('Could not read the forecast state at %s.', path)
+        return empty_state(user_lat, user_lng, vc_api_key)
+    if (state.get('version'), state.get('lat'), state.get('lng'),
+            state.get('sources')) != (STATE_VERSION, user_lat, user_lng,
+                                      state_sources(vc_api_key)):
+        return empty_state(user_lat, user_lng, vc_api_key)
+    return state
+
+
+def save_state(state: dict, path: str = INCREMENTAL_STATE_PATH) -> None:
+    """Writes the state in one step so it is never read half written."""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file)
+    os.replace(path + '.tmp', path)
+
+
+def date_span(dates: list, needed: list) -> list:
+    """
+    Returns the dates from the first needed to the last, so a builder can
+    fetch them as one range, or an empty list if none are needed.
+    """
+    if not needed:
+        return []
+    return dates[dates.index(needed[0]):dates.index(needed[-1]) + 1]
+
+
+def plan_refresh(state: dict, dates: list, now: float) -> dict:
+    """
+    Works out which parts of the forecast are stale.
+
+    Parameters:
+        state (dict): The saved state of the location.
+        dates (list): List of datetime.date objects.
+        now (float): The current epoch seconds.
+
+    Returns:
+        dict: The dates to build for 'sun' and 'visualcrossing', which may be
+        empty, and whether to build 'aurora' for all of dates.
+    """
+    days = state['days']
+
+    def fresh(day, part, max_age=None):
+        saved = days.get(str(day), {}).get(part)
+        return saved is not None and (max_age is None
+                                      or now - saved['at'] <= max_age)
+
+    tonight = state['tonight']
+    return {
+        'sun': date_span(dates, [day for day in dates
+                                 if not fresh(day, 'sun')]),
+        'visualcrossing': date_span(dates, [
+            day for day in dates if not fresh(day, 'lunar')
+            or not fresh(day, 'cloud', CLOUD_MAX_AGE)]),
+        'aurora': tonight is None or tonight['date'] != str(dates[0])
+        or now - tonight['at'] > AURORA_MAX_AGE
+        or not all(fresh(day, 'aurora', AURORA_MAX_AGE) for day in dates)}
+
+
+def run_builds(plan: dict,
+               vc_api_key: str,
+               user_lat: float,
+               user_lng: float,
+               dates: list) -> dict:
+    """
+    Runs the builders the plan needs concurrently, within DEADLINE seconds,
+    without serving any expired cached responses.
+
+    Returns:
+        dict: The result of each builder that ran, keyed by provider.
+    """
+    with deadline(DEADLINE), fresh_only(), ThreadPoolExecutor(
+            max_workers=3, thread_name_prefix='builder') as executor:
+        futures = {}
+        if plan['sun']:
+            futures['sun'] = executor.submit(in_context(sun_forecast_build),
+                                             plan['sun'], user_lat, user_lng)
+        if plan['visualcrossing']:
+            futures['visualcrossing'] = executor.submit(
+                in_context(vc_forecast_build), vc_api_key,
+                plan['visualcrossing'], user_lat, user_lng)
+        if plan['aurora']:
+            futures['aurora'] = executor.submit(
+                in_context(aurora_forecast_build), dates, user_lat, user_lng)
+        return {provider: future.result()
+                for provider, future in futures.items()}
+
+
+def merge_built(state: dict,
+                plan: dict,
+                built: dict,
+                dates: list,
+                now: float) -> None:
+    """
+    Saves the parts the builders returned for the plan into state, fetched
+    at now. Parts that failed keep what was saved before.
+    """
+    days = state['days']
+    for day, sun in zip(plan['sun'], built.get('sun') or ()):
+        days.setdefault(str(day), {})['sun'] = {
+            'at': now, 'times': list(sun.times)}
+    lunar_forecast, cloud_forecast = built.get('visualcrossing') or (None,
+                                                                     None)
+    for index, day in enumerate(plan['visualcrossing']):
+        saved = days.setdefault(str(day), {})
+        if lunar_forecast:
+            lunar = lunar_forecast[index]
+            saved['lunar'] = {'at': now, 'phase': lunar.phase,
+                              'moonrise': lunar.moonrise,
+                              'moonset': lunar.moonset}
+        if cloud_forecast:
+            cloud = cloud_forecast[index]
+            saved['cloud'] = {'at': now, 'cloudcover': cloud.cloudcover,
+                              'hourly': list(cloud.hourly)}
+    if built.get('aurora'):
+        merge_aurora(state, built['aurora'], dates, now)
+
+
+def merge_aurora(state: dict,
+                 aurora_forecast: tuple,
+                 dates: list,
+                 now: float) -> None:
+    """
+    Saves tonight's probability and the periods of each of dates from
+    aurora_forecast_build's result into state, fetched at now. If one of
+    its two API calls failed, what was saved before is kept for that part.
+    """
+    aurora_prob, aurora_3day = aurora_forecast
+    if aurora_prob is not None:
+        state['tonight'] = {'at': now, 'date': str(dates[0]),
+                            'probability': aurora_prob.probability,
+                            'colour': aurora_prob.colour}
+    if aurora_3day:
+        # Dates past the end of the three-day forecast are saved without
+        # periods, so they aren't fetched again until they are stale
+        for day in dates:
+            state['days'].setdefault(str(day), {})['aurora'] = {
+                'at': now,
+                'periods': [[period.start, period.end, period.colour,
+                             period.kp] for period in aurora_3day.get(day, ())]}
+
+
+def day_from_state(day, saved: dict) -> DayForecast:
+    """Returns the DayForecast of day from its saved parts."""
+    sun, lunar, cloud, aurora = (saved.get(part) for part in
+                                 ('sun', 'lunar', 'cloud', 'aurora'))
+    return DayForecast(
+        date=day,
+        sun=None if sun is None else SunDay(array('q', sun['times'])),
+        lunar=None if lunar is None else LunarDay(
+            phase=lunar['phase'], moonrise=lunar['moonrise'],
+            moonset=lunar['moonset']),
+        cloud=None if cloud is None else CloudDay(
+            cloudcover=cloud['cloudcover'],
+            hourly=array('f', cloud['hourly'])),
+        aurora=() if aurora is None else tuple(
+            AuroraPeriod(*period) for period in aurora['periods']))
+
+
+def forecast_from_state(state: dict, dates: list) -> SiteForecast:
+    """
+    Returns the SiteForecast for dates from the parts saved in state. The
+    aurora probability is left out if it was for an earlier night.
+    """
+    days = [day_from_state(day, state['days'].get(str(day), {}))
+            for day in dates]
+    tonight = state['tonight']
+    if tonight is not None and tonight['date'] != str(dates[0]):
+        tonight = None
+    return SiteForecast(lat=state['lat'], lng=state['lng'], days=days,
+                        aurora=None if tonight is None else AuroraTonight(
+                            probability=tonight['probability'],
+                            colour=tonight['colour']))
+
+
+def missing_parts(forecast: SiteForecast) -> set:
+    """
+    Returns the providers the forecast has no parts from, and 'cloud' if it
+    has no cloud cover.
+    """
+    missing = set()
+    if any(day.sun is None for day in forecast.days):
+        missing.add('sun')
+    if any(day.lunar is None for day in forecast.days):
+        missing.add('visualcrossing')
+    if any(day.cloud is None for day in forecast.days):
+        missing.add('cloud')
+    if forecast.aurora is None and not any(day.aurora
+                                           for day in forecast.days):
+        missing.add('aurora')
+    return missing
+
+
+def build_incremental(vc_api_key: str,
+                      dates: list,
+                      user_lat: float,
+                      user_lng: float,
+                      full: bool = False) -> SiteForecast:
+    """
+    Builds the forecast like build_forecasts, but only runs the builders for
+    the parts of the forecast saved at INCREMENTAL_STATE_PATH that are
+    stale, or all of them if it was saved for other state_sources, then
+    saves the merged forecast for the next run. Dates before the first of
+    dates are dropped from the state.
+
+    Parameters:
+        vc_api_key (str): user's API key for Visual Crossing.
+        dates (list): List of datetime.date objects.
+        user_lat (float): Latitude of the user.
+        user_lng (float): Longitude of the user.
+        full (bool): Whether to build every part again, as if nothing was
+            saved.
+
+    Returns:
+        SiteForecast: The merged forecast, ready for forecast_output.
+    """
+    logger.info('Running build_incremental.')
+
+    now = time.time()
+    state = empty_state(user_lat, user_lng, vc_api_key) if full else \
+        load_state(user_lat, user_lng, vc_api_key, INCREMENTAL_STATE_PATH)
+    plan = plan_refresh(state, dates, now)
+    logger.info('Refreshing sun for %s dates, Visual Crossing for %s dates '
+                'and aurora: %s.', len(plan['sun']),
+                len(plan['visualcrossing']), plan['aurora'])
+    built = run_builds(plan, vc_api_key, user_lat, user_lng, dates)
+    merge_built(state, plan, built, dates, now)
+    state['days'] = {day: parts for day, parts in state['days'].items()
+                     if day >= str(dates[0])}
+    save_state(state, INCREMENTAL_STATE_PATH)
+
+    forecast = forecast_from_state(state, dates)
+    missing = missing_parts(forecast)
+    forecast.failed = [name for provider, result in built.items()
+                       for name in failed_parts(provider, result, vc_api_key)
+                       if name in missing]
+    analyse_nights([forecast])
+    return forecast
@@ -1,22 +1,37 @@
 """
 File to set up logging.
+
+Every module's logger puts its records on one shared queue, and a single
+QueueListener writes them to the rotating log file on a background thread,
+so logging never waits on the disk in the worker threads and only one
+handler rotates the file. A forked worker process has no listener thread, so
+it writes to its own log file named by its pid instead, and never rotates
+the parent's. The records can be written as JSON lines, and the high-volume
+DEBUG payloads can be sampled.
 """
 ###############################################################################
 # IMPORTS
 ###############################################################################
-import configparser
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 
-from logging.handlers import RotatingFileHandler
+# Tools for the shared handler and the debug sampling
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from threading import Lock
 
 
 ###############################################################################
 # VARIABLES
 ###############################################################################
-# Load config file and log details
-config = configparser.ConfigParser()
-config.read('config.ini')
+from config import load_config
+
+# Load config file and log details, parsed once and shared with config.py
+config = load_config()
 
 # Load config info from config.ini
 MAX_SIZE = int(config.get('logging', 'log_max_size', fallback='30000'))
@@ -25,19 +40,128 @@ log_folder = config.get('logging', 'log_folder', fallback='logs')
 log_file = config.get('logging', 'log_file', fallback='.log')
 log_level = config.get('logging', 'log_level'.upper(), fallback='DEBUG')
 log_format = config.get('logging', 'log_format', fallback='%%(asctime)s - %%(name)s')
+# Write each record as a JSON line instead of with log_format
+LOG_JSON = config.getboolean('logging', 'log_json', fallback=False)
+# Keep the first and then every Nth DEBUG record of each message, 1 keeps all
+DEBUG_SAMPLE = int(config.get('logging', 'log_debug_sample', fallback='1'))
 
 # Check logging folder exists
 log_path = os.path.join(log_folder, log_file)
 os.makedirs(os.path.dirname(log_path), exist_ok=True)
 
 
+###############################################################################
+# CLASSES
+###############################################################################
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc)
+                 .isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Keeps the first and then every Nth DEBUG record of each logger and
+    message template, and every record of a higher level. Dropped records
+    are never formatted.
+    """
+    def __init__(self, every: int = DEBUG_SAMPLE):
+        super().__init__()
+        self.every = max(every, 1)
+        self.counts = {}
+        self.lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        with self.lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        return count % self.every == 0
+
+
+class SharedQueueHandler(QueueHandler):
+    """
+    The QueueHandler shared by every logger. In a forked worker process,
+    where the listener thread doesn't exist, records are written directly
+    to the process's own log file by the direct handler instead.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.direct = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merges the args into the message and formats any traceback now, as
+        they may change before the listener gets to them, but leaves the
+        rest of the formatting to the listener thread.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.direct is not None:
+            self.direct.handle(record)
+        else:
+            super().emit(record)
+
+
 ###############################################################################
 # LOGGING SET UP
 ###############################################################################
+def file_handler(path: str = log_path) -> logging.Handler:
+    """Returns the rotating file handler that writes the log file at path."""
+    # Setting up file handler to rotate through logs
+    handler = RotatingFileHandler(path, maxBytes=MAX_SIZE,
+                                  backupCount=BACKUP_COUNT)
+
+    # Setting log format and applying to file handler
+    handler.setFormatter(JsonFormatter() if LOG_JSON
+                         else logging.Formatter(log_format))
+    handler.setLevel(getattr(logging, log_level, logging.INFO))
+    return handler
+
+
+def child_log_path(pid: int) -> str:
+    """Returns the log file of the forked worker process pid."""
+    return f'{log_path}.{pid}'
+
+
+def write_directly() -> None:
+    """
+    Makes a forked child process write its records without the queue, to
+    its own log file so only the parent's listener rotates log_path.
+    """
+    shared_handler.direct = file_handler(child_log_path(os.getpid()))
+
+
+def stop_logging() -> None:
+    """Writes the records still on the queue and stops the listener."""
+    if listener._thread is not None:  # pylint: disable=protected-access
+        listener.stop()
+
+
 def logging_setup(name: str):
     """
     Function to setup logging.
-    Returns a configured logger with rotating file handling.
+    Returns a configured logger that logs through the shared queue.
     """
     # Create logger
     logger = logging.getLogger(name)
@@ -46,18 +170,22 @@ def logging_setup(name: str):
     if not logger.handlers:
         logger.setLevel(getattr(logging, log_level, logging.INFO))
 
-        # Setting up file handler to rotate through logs
-        file_handler =RotatingFileHandler(log_path, maxBytes=MAX_SIZE,
-                                        backupCount=BACKUP_COUNT)
-
-        # Setting log format and applying to file handler
-        file_handler.setFormatter(logging.Formatter(log_format))
-        file_handler.setLevel(getattr(logging, log_level, logging.INFO))
-
-        # add handler
-        logger.addHandler(file_handler)
+        # add the shared handler
+        logger.addHandler(shared_handler)
 
         # Prevent log messages being passed to root logger
         logger.propagate = False
 
     return logger
+
+
+# One queue, handler and listener for the whole process. The listener
+# thread is started on import and stopped at exit, after the last record.
+shared_handler = SharedQueueHandler(queue.SimpleQueue())
+shared_handler.addFilter(SampleFilter())
+listener = QueueListener(shared_handler.queue, file_handler(),
+                         respect_handler_level=True)
+listener.start()
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=write_directly)
@@ -8,10 +8,25 @@ It will write a stargazing forecast to a text file listing:
 - The rise and set times of the moon and its phase.
 - The predicted cloud cover overnight.
 - An aurora forecast.
+
+The forecast pipeline, with numpy and requests, is imported in the background
+while the questions are being answered, so it is ready by the time they are.
+
+The forecast is kept between runs, so running the app again for the same
+location only fetches the parts that are stale (see incremental.py). --full
+fetches every part again.
+
+Usage:
+    python3 main.py
+    python3 main.py --timing
+    python3 main.py --full
 """
 ###############################################################################
 # IMPORTS
 ###############################################################################
+import argparse
+import time
+
 # Logging modules
 from logger import logging_setup
 
@@ -24,18 +39,31 @@ from utils.message_utils import welcome_message
 # Functions to create a list of dates
 from utils.datetime_utils import get_forecast_dates
 
-# Functions to build each component of the forecast
-from forecast_builder import sun_forecast_build, vc_forecast_build
-from forecast_builder import aurora_forecast_build
-
-# Function to output the forecast to a file
-from output_writer import forecast_output
+# Functions to import the forecast pipeline lazily and in the background
+from utils.import_utils import lazy_import, preload
 
 
 ###############################################################################
 # VARIABLES
 ###############################################################################
-from config import FOLDER_NAME
+from config import FOLDER_NAME, INCREMENTAL_ENABLED
+
+# The modules of the forecast pipeline, which are only run when preloaded or
+# first used. PIPELINE is the order they are preloaded in.
+PIPELINE = ('forecast_builder', 'incremental', 'output_writer',
+            'apis.response_cache', 'apis.http_client', 'metrics')
+# Function to build each component of the forecast concurrently
+forecast_builder = lazy_import('forecast_builder')
+# Function to only rebuild the stale components of the last forecast
+incremental = lazy_import('incremental')
+# Function to output the forecast to a file
+output_writer = lazy_import('output_writer')
+# Function to report how well the response cache did
+response_cache = lazy_import('apis.response_cache')
+# Function to find when the first API request was sent, for --timing
+http_client = lazy_import('apis.http_client')
+# Function to log the API metrics and export them for Prometheus
+metrics = lazy_import('metrics')
 
 
 ###############################################################################
@@ -45,39 +73,102 @@ logger = logging_setup(__name__)
 
 
 ###############################################################################
-# SCRIPT
+# FUNCTIONS
 ###############################################################################
-# Introduction
-welcome_message()
+def print_timing(startup: float, imports: tuple, collected: float,
+                 finished: float) -> None:
+    """
+    Prints how long the app took to start and to send its first API request,
+    without the time spent answering the questions.
+
+    Parameters:
+        startup (float): CPU seconds used before main() started, by the
+            interpreter and the imports.
+        imports (tuple): The seconds the pipeline imports took and the
+            seconds still waited for them once the questions were answered.
+        collected (float): perf_counter time the questions were answered.
+        finished (float): perf_counter time the forecast was written.
+    """
+    import_seconds, import_wait = imports
+    first_request = http_client.first_request_time()
+    print('\nTIMING')
+    print(f'Startup before main(): {startup * 1000:.0f} ms of CPU')
+    print(f'Pipeline imports: {import_seconds * 1000:.0f} ms in the '
+          f'background, {import_wait * 1000:.0f} ms waited for after the '
+          f'questions')
+    if first_request is None:
+        print('First API request: none were made')
+    else:
+        print(f'First API request: '
+              f'{(first_request - collected) * 1000:.0f} ms after the '
+              f'questions, {(startup + first_request - collected) * 1000:.0f}'
+              f' ms from the start without them')
+    print(f'Forecast built and written in {finished - collected:.2f} s')
+
+
+def main() -> None:
+    """
+    Asks for the forecast length, location and Visual Crossing API key,
+    then builds the forecast and writes it to file.
+    """
+    parser = argparse.ArgumentParser(
+        description='Write a stargazing forecast for a location.')
+    parser.add_argument('--timing', action='store_true',
+                        help='print the startup and import times')
+    parser.add_argument('--full', action='store_true',
+                        help='fetch the whole forecast again instead of only '
+                             'the stale parts')
+    args = parser.parse_args()
+    startup = time.process_time()
+    imports = preload(PIPELINE)
+    logger.info('App started')
+
+    # Introduction
+    welcome_message()
+
+    # Asking if the user wants to know how to create an API key for Visual
+    # Crossing.
+    api_key_instructions()
 
-# Asking if the user wants to know how to create an API key for Visual Crossing.
-api_key_instructions()
+    # Collecting user input
+    vc_api_key = collect_api_key()
+    forecast_length = collect_length()
+    user_lat = collect_lat()
+    user_lng = collect_lng()
+    collected = time.perf_counter()
 
-# Collecting user input
-vc_api_key = collect_api_key()
-forecast_length = collect_length()
-user_lat = collect_lat()
-user_lng = collect_lng()
+    # The pipeline has usually been imported by now
+    import_seconds = imports.result()
+    import_wait = time.perf_counter() - collected
 
-# Producing date list based on forecast length
-dates = get_forecast_dates(forecast_length)
+    # Producing date list based on forecast length
+    dates = get_forecast_dates(forecast_length)
 
-# Build forecasts
-sun_forecast = sun_forecast_build(dates, user_lat, user_lng)
-vc_forecasts = vc_forecast_build(vc_api_key, dates, user_lat, user_lng)
-aurora_forecast = aurora_forecast_build(dates, user_lat, user_lng)
+    # Build forecasts. The sun, Visual Crossing and aurora builders run at the
+    # same time, and only for the stale parts of the last forecast unless
+    # --full is given or incremental builds are turned off.
+    if INCREMENTAL_ENABLED:
+        forecast = incremental.build_incremental(vc_api_key, dates, user_lat,
+                                                 user_lng, full=args.full)
+    else:
+        forecast = forecast_builder.build_forecasts(vc_api_key, dates,
+                                                    user_lat, user_lng)
 
-# Write forecast file
-OUTPUT_SUCCESS = forecast_output(dates,
-                                 sun_forecast,
-                                 vc_forecasts,
-                                 aurora_forecast)
+    # Write forecast file
+    output_success = output_writer.forecast_output(forecast)
 
-if OUTPUT_SUCCESS == 0:
-    print(
-        f'[SUCCESS!] file "Stargazing_Forecast.txt" has been saved '
-        f'to the folder "{FOLDER_NAME}".')
+    response_cache.log_cache_stats()
+    metrics.report_run()
+
+    if output_success == 0:
+        print(
+            f'[SUCCESS!] file "Stargazing_Forecast.txt" has been saved '
+            f'to the folder "{FOLDER_NAME}".')
+
+    if args.timing:
+        print_timing(startup, (import_seconds, import_wait), collected,
+                     time.perf_counter())
 
 
 if __name__ == '__main__':
-    logger.info('App started')
+    main()
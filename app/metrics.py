@@ -0,0 +1,330 @@
+"""
+Metrics for the API calls and the forecast builder stages.
+
+Every upstream request is counted per provider with its latency, the bytes
+it returned and, if it failed, the class of error. The response cache's hits
+and misses, any retries and the time spent in each builder stage are
+recorded too, as are the hedged requests and which backend answered each
+kind of data. The metrics can be rendered in the Prometheus text format, for
+the forecast server's /metrics endpoint or a node exporter textfile, and
+summarised at the end of a run.
+
+The provider of a request is set by the api_call decorator on each
+*_api_call function, so the shared HTTP client and the response cache don't
+need to be told which provider they are working for.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import os
+import time
+
+# Tools for the thread safe registry and the current provider
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+
+# Logging modules
+from logger import logging_setup
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import METRICS_TEXTFILE
+
+# Upper bounds of the latency histogram buckets in seconds, the same as the
+# Prometheus client's defaults.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of each metric
+METRICS = {
+    'stargazer_api_requests_total':
+        ('counter', 'Upstream API requests by provider and outcome.'),
+    'stargazer_api_request_seconds':
+        ('histogram', 'Upstream API request latency by provider.'),
+    'stargazer_api_response_bytes_total':
+        ('counter', 'Bytes returned by the upstream APIs by provider.'),
+    'stargazer_api_errors_total':
+        ('counter', 'Failed upstream API requests by provider and error.'),
+    'stargazer_api_retries_total':
+        ('counter', 'Retried upstream API requests by provider.'),
+    'stargazer_api_records_total':
+        ('counter', 'Quota records spent on the upstream APIs by provider.'),
+    'stargazer_cache_requests_total':
+        ('counter', 'Response cache lookups by provider and result.'),
+    'stargazer_stage_seconds':
+        ('histogram', 'Time spent in each forecast builder stage.'),
+    'stargazer_hedged_requests_total':
+        ('counter', 'Hedged requests sent by kind of data.'),
+    'stargazer_backend_answers_total':
+        ('counter', 'Answers by kind of data and the backend that won.'),
+}
+
+# The provider of the API call running in this thread or task
+_PROVIDER = ContextVar('provider', default='unknown')
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Registry:
+    """
+    A thread safe store of counters and histograms, keyed by metric name and
+    a sorted tuple of label pairs.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = defaultdict(float)
+        # Each histogram is a count per bucket, then the sum and the count
+        self.histograms = {}
+
+    def inc(self, name: str, labels: dict, amount: float = 1) -> None:
+        """Adds amount to a counter."""
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        """Records one value in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                key, [0] * len(BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def reset(self) -> None:
+        """Clears every metric."""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(value)
+                          for key, value in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value:g}')
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric == name:
+                    lines += histogram_lines(name, labels, histogram)
+        return '\n'.join(lines) + '\n'
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def format_labels(labels: tuple) -> str:
+    """Returns label pairs as {name="value",...}, escaped for Prometheus."""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value
+                          in zip(labels, escaped)) + '}'
+
+
+def histogram_lines(name: str, labels: tuple, histogram: list) -> list:
+    """Returns the cumulative _bucket, _sum and _count lines of a histogram."""
+    lines = [f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))}'
+             f' {count}' for bound, count in zip(BUCKETS, histogram)]
+    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))}'
+                 f' {histogram[-1]}')
+    lines.append(f'{name}_sum{format_labels(labels)} {histogram[-2]:g}')
+    lines.append(f'{name}_count{format_labels(labels)} {histogram[-1]}')
+    return lines
+
+
+def api_call(provider: str):
+    """
+    Decorator for the *_api_call functions that labels the requests and
+    cache lookups made inside them with provider.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            token = _PROVIDER.set(provider)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _PROVIDER.reset(token)
+        return wrapper
+    return decorator
+
+
+def stage(function):
+    """Decorator that records the time spent in a builder stage."""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            registry.observe('stargazer_stage_seconds',
+                             {'stage': function.__name__},
+                             time.perf_counter() - start)
+    return wrapper
+
+
+def current_provider() -> str:
+    """Returns the provider of the API call running in this context."""
+    return _PROVIDER.get()
+
+
+def record_request(seconds: float, size: int, error: str | None = None):
+    """
+    Records one upstream request of the current provider: its latency, the
+    bytes it returned and the class of error if it failed.
+    """
+    provider = _PROVIDER.get()
+    registry.inc('stargazer_api_requests_total',
+                 {'provider': provider,
+                  'outcome': 'ok' if error is None else 'error'})
+    registry.observe('stargazer_api_request_seconds', {'provider': provider},
+                     seconds)
+    registry.inc('stargazer_api_response_bytes_total',
+                 {'provider': provider}, size)
+    if error is not None:
+        registry.inc('stargazer_api_errors_total',
+                     {'provider': provider, 'error': error})
+
+
+def record_cache(hit: bool) -> None:
+    """Records a response cache lookup for the current provider."""
+    registry.inc('stargazer_cache_requests_total',
+                 {'provider': _PROVIDER.get(),
+                  'result': 'hit' if hit else 'miss'})
+
+
+def record_retry() -> None:
+    """Records a retried request for the current provider."""
+    registry.inc('stargazer_api_retries_total', {'provider': _PROVIDER.get()})
+
+
+def record_records(records: int) -> None:
+    """Records the quota records spent by the current provider."""
+    registry.inc('stargazer_api_records_total', {'provider': _PROVIDER.get()},
+                 records)
+
+
+def record_skipped(error: str) -> None:
+    """
+    Records a request of the current provider that wasn't made, e.g.
+    because its circuit was open, as an error without a latency.
+    """
+    registry.inc('stargazer_api_errors_total',
+                 {'provider': _PROVIDER.get(), 'error': error})
+
+
+def record_hedge(kind: str) -> None:
+    """Records a hedged request for kind of data."""
+    registry.inc('stargazer_hedged_requests_total', {'kind': kind})
+
+
+def record_winner(kind: str, backend: str) -> None:
+    """Records the backend that answered for kind, 'none' if none did."""
+    registry.inc('stargazer_backend_answers_total',
+                 {'kind': kind, 'backend': backend})
+
+
+def write_textfile(path: str = METRICS_TEXTFILE) -> None:
+    """
+    Writes the metrics to path for a node exporter's textfile collector, if
+    a path is set. The file is replaced in one step so it is never read
+    half written.
+    """
+    if not path:
+        return
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(registry.render())
+    os.replace(path + '.tmp', path)
+
+
+def run_summary() -> dict:
+    """
+    Summarises the run so far: for each provider the requests, errors,
+    total and mean latency, share of all the request time, bytes, quota
+    records spent and cache hits and misses, the total seconds in each
+    stage, and for each kind of data the hedged requests and the answers
+    from each backend.
+    """
+    with registry.lock:
+        counters = dict(registry.counters)
+        histograms = dict(registry.histograms)
+    providers = defaultdict(lambda: dict.fromkeys(
+        ('requests', 'errors', 'seconds', 'bytes', 'retries', 'records',
+         'cache_hits', 'cache_misses'), 0))
+    fields = {'stargazer_api_errors_total': 'errors',
+              'stargazer_api_response_bytes_total': 'bytes',
+              'stargazer_api_retries_total': 'retries',
+              'stargazer_api_records_total': 'records'}
+    hedging = defaultdict(dict)
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name == 'stargazer_hedged_requests_total':
+            hedging[labels['kind']]['hedged'] = value
+        elif name == 'stargazer_backend_answers_total':
+            hedging[labels['kind']][labels['backend']] = value
+        elif name in fields:
+            providers[labels['provider']][fields[name]] += value
+        elif name == 'stargazer_cache_requests_total':
+            providers[labels['provider']][
+                {'hit': 'cache_hits', 'miss': 'cache_misses'}[
+                    labels['result']]] += value
+    stages = {}
+    for (name, labels), histogram in histograms.items():
+        if name == 'stargazer_api_request_seconds':
+            summary = providers[dict(labels)['provider']]
+            summary['requests'] = histogram[-1]
+            summary['seconds'] = round(histogram[-2], 3)
+            summary['mean_ms'] = round(1000 * histogram[-2] / histogram[-1],
+                                       1)
+        else:
+            stages[dict(labels)['stage']] = round(histogram[-2], 3)
+    total = sum(summary['seconds'] for summary in providers.values())
+    for summary in providers.values():
+        summary['share'] = round(summary['seconds'] / total, 3) \
+            if total else 0.0
+    return {'providers': dict(providers), 'stages': stages,
+            'hedging': dict(hedging)}
+
+
+def report_run() -> dict:
+    """
+    Logs the run_summary and writes the metrics textfile, for the end of a
+    run.
+
+    Returns:
+        dict: The run_summary.
+    """
+    summary = run_summary()
+    for provider, stats in sorted(summary['providers'].items()):
+        logger.info('API metrics for %s: %s', provider, stats)
+    logger.info('Stage seconds: %s', summary['stages'])
+    for kind, answers in sorted(summary['hedging'].items()):
+        logger.info('Answers for %s: %s', kind, answers)
+    write_textfile()
+    return summary
+
+
+# The registry shared by the whole process
+registry = Registry()
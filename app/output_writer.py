@@ -1,22 +1,75 @@
 """
-This file contains the function to write the final forecast to a file.
+This file contains the functions and writers used to write the final
+forecast to a file.
+
+Besides the text forecast, sites can be streamed to NDJSON, CSV and, if
+pyarrow is installed, Parquet files. Each writer takes one SiteForecast at a
+time and flushes it, so memory use stays flat however many sites
+are written, and write_forecasts feeds every writer from a single pass over
+the forecasts.
 """
 ###############################################################################
 # IMPORTS
 ###############################################################################
+import csv
+import json
+import os
+
 # Importing from datetime
-from datetime import datetime as dt
 from datetime import date
 
+# Typing for the forecast generators
+from typing import Iterable, Iterator
+
+# Parquet output is optional. It may be necessary to pip install pyarrow
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Logging modules
 from logger import logging_setup
 
+# Decorator that records the time spent in each stage
+from metrics import stage
+
+# Names of the solar and twilight events, in the order they are written
+from ephemeris.solar import EVENT_NAMES
+
+# Functions to format the times and describe the moon phase and cloud cover
+from utils.datetime_utils import format_epoch_time
+from utils.data_utils import find_how_cloudy, find_moon_phase
+
+# The typed forecast model the writers read
+from forecast_model import SunDay, LunarDay, CloudDay, AuroraPeriod, \
+    NightScore, DayForecast, SiteForecast
+
 
 ###############################################################################
 # VARIABLES
 ###############################################################################
-# Define today
-today = date.today()
+from config import TIMEZONE, CLOUD_PERCENTILE, GOOD_SCORE
+
+# Columns of the one row per site and day written by the CSV and Parquet
+# writers.
+ROW_FIELDS = ['site_id', 'lat', 'lng', 'date', *EVENT_NAMES,
+              'moonrise', 'moonset', 'moonphase',
+              'cloudcover', 'cloudforecast', 'hourly_cloudcover',
+              'night_cloud_mean', 'night_cloud_min', 'night_cloud_percentile',
+              'clear_hours', 'aurora_probability', 'aurora_colour', 'aurora_kp',
+              'best_window_start', 'best_window_end', 'window_score',
+              'peak_score', 'failed']
+
+# Format of the start and end times of the aurora forecast periods and the
+# best observing windows
+AURORA_TIME_FORMAT = '%Y-%m-%d - %H:%M'
+
+# Number of rows the Parquet writer buffers before writing a row group
+PARQUET_ROW_GROUP_SIZE = 8192
+
+# Line written between each day of the text forecast
+TEXT_DIVIDER = '\n' + '~' * 75 + '\n\n'
 
 
 ###############################################################################
@@ -28,69 +81,451 @@ logger = logging_setup(__name__)
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
-def forecast_output(dates: list,
-                    sun_forecast: dict,
-                    vc_forecasts: list | None,
-                    aurora_forecast: list) -> int:
+@stage
+def forecast_output(forecast: SiteForecast) -> int:
     """
     Function to write the forecasts to a file, 'Stargazing_Forecast.txt'.
 
     Parameters:
-        dates (list): List of the dates for the forecast.
-        sun_forecast (dict): Dictionary of the solar and twilight times.
-        vc_forecasts (list): List of two dictionaries. One for the moon
-            forecast and one for the cloud forecast. Is None if no API key is
-            given.
-        aurora_forecast (list): List of two dictionaries. One with tonight's
-            aurora probability and one with a three-day forecast.
+        forecast (SiteForecast): The forecast from build_forecasts. The moon
+            and cloud forecasts are None if no API key is given, unless the
+            moon forecast was computed offline, in which case only the cloud
+            forecast is None.
 
     """
     logger.info('Running forecast_output.')
-    if vc_forecasts is not None:
-        lunar_forecast = vc_forecasts[0]
-        cloud_forecast = vc_forecasts[1]
-
-    aurora_prob = aurora_forecast[0]
-    aurora_3day = aurora_forecast[1]
-    with open('Stargazing_Forecast.txt', 'w', encoding="utf-8") as textfile:
-        # Loop through each day in dates.
-        for days in dates:
-            # Formatting the day as a string, to be used as a dict key
-            day_str = dt.strftime(days, '%Y-%m-%d')
-            textfile.write('FORECAST FOR ' + day_str + '\n\n')
-            textfile.write('SUN AND TWILIGHT\n')
-            for key, value in sun_forecast[day_str].items():
-                textfile.write(f'{key}: {value}\n')
-            # Check if and API key was given and write to file if it was
-            if vc_forecasts is not None:
-                textfile.write('\n\nLUNAR\n')
-                for key, value in lunar_forecast[day_str].items():
-                    textfile.write(f'{key}: {value}\n')
-                textfile.write('\n\nCLOUDS\n')
-                # Selecting the cloud_forecast entries needed
-                textfile.write(cloud_forecast[day_str]['cloudforecast'] + '\n')
-                textfile.writelines(
-                    str(cloud_forecast[day_str]['hours']) + '\n')
-            else:
-                textfile.write(
-                    '\n\nNo API key provided for lunar and cloud cover '
-                    'forecasts\n')
-            textfile.write('\n\nAURORA\n')
-            # If the current day in the for loop is today, give the aurora
-            # probability forecast, else give the three-day.
-            if days == today:
-                textfile.write('The probability of seeing the aurora is ' +
-                               str(aurora_prob['Probability']) +
-                               '.\nThe colour status is ' +
-                               str(aurora_prob['Colour']) + '.\n')
-            else:
-                # Writing only the last two entries of the current day's
-                # aurora forecast to limit it to nighttime.
-                for key, value in aurora_3day[days][-2].items():
-                    textfile.write(f'{key}: {value}\n')
-                for key, value in aurora_3day[days][-1].items():
-                    textfile.write(f'{key}: {value}\n')
-            textfile.write(
-                '\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~'
-                '~~~~~~~~~~~~~~~~\n\n')
+    with TextWriter('Stargazing_Forecast.txt') as writer:
+        writer.write(forecast)
     return 0
+
+
+def sun_times(sun: SunDay) -> dict:
+    """Returns the sun event times on the 24-hour clock in TIMEZONE."""
+    return {name: format_epoch_time(epoch, TIMEZONE)
+            for name, epoch in sun.items()}
+
+
+def lunar_times(lunar: LunarDay) -> dict:
+    """
+    Returns the descriptive moon phase and the moon rise and set times in
+    TIMEZONE, or None if the moon doesn't rise or set.
+    """
+    return {'moonphase': find_moon_phase(lunar.phase),
+            **{name: None if epoch is None else
+               format_epoch_time(epoch, TIMEZONE, '%H:%M:%S')
+               for name, epoch in (('moonrise', lunar.moonrise),
+                                   ('moonset', lunar.moonset))}}
+
+
+def cloud_verdict(cloud: CloudDay) -> str:
+    """
+    Returns the descriptive forecast from find_how_cloudy for the night's
+    mean cloud cover while it is dark, or the whole day's if the night
+    wasn't analysed.
+    """
+    return find_how_cloudy(cloud.cloudcover if cloud.night_mean is None
+                           else cloud.night_mean)
+
+
+def cloud_summary(cloud: CloudDay) -> dict:
+    """
+    Returns the cloud cover, the descriptive forecast from cloud_verdict,
+    the hourly cloud cover from midnight and the summary of the night.
+    """
+    return {'cloudcover': cloud.cloudcover,
+            'cloudforecast': cloud_verdict(cloud),
+            # The array holds 32-bit floats, so they are rounded back to the
+            # API's one decimal place
+            'hourly_cloudcover': [round(cover, 1) for cover in cloud.hourly],
+            'night_cloud_mean': cloud.night_mean,
+            'night_cloud_min': cloud.night_min,
+            'night_cloud_percentile': cloud.night_percentile,
+            'clear_hours': cloud.clear_hours}
+
+
+def score_summary(score: NightScore) -> dict:
+    """
+    Returns the night's peak score, its best observing window in TIMEZONE,
+    or None if no hour scored GOOD_SCORE, and the hourly score from noon.
+    """
+    return {'best_window_start': None if score.window_start is None else
+            format_epoch_time(score.window_start, TIMEZONE,
+                              AURORA_TIME_FORMAT),
+            'best_window_end': None if score.window_end is None else
+            format_epoch_time(score.window_end, TIMEZONE, AURORA_TIME_FORMAT),
+            'window_score': score.window_score,
+            'peak_score': score.peak,
+            'hourly_score': [round(value, 1) for value in score.hourly]}
+
+
+def aurora_period_times(period: AuroraPeriod) -> dict:
+    """Returns a period of the three-day aurora forecast in TIMEZONE."""
+    return {'Start Time': format_epoch_time(period.start, TIMEZONE,
+                                            AURORA_TIME_FORMAT),
+            'End Time': format_epoch_time(period.end, TIMEZONE,
+                                          AURORA_TIME_FORMAT),
+            'Colour Status': period.colour,
+            'Kp Value': f'{period.kp:g}'}
+
+
+def by_day(forecast: SiteForecast, part: str, formatter) -> dict | None:
+    """
+    Returns formatter's output for one part of every DayForecast, keyed by
+    the date as a string, or None if that part wasn't built.
+    """
+    if not forecast.days or getattr(forecast.days[0], part) is None:
+        return None
+    return {str(day.date): formatter(getattr(day, part))
+            for day in forecast.days}
+
+
+def aurora_3day(forecast: SiteForecast) -> dict | None:
+    """
+    Returns the periods of the three-day aurora forecast keyed by the date as
+    a string, with None for the days it has no periods for, or None if it
+    has none at all. Tonight's probability is fetched separately, so the
+    periods are kept even when it is missing.
+    """
+    if not any(day.aurora for day in forecast.days):
+        return None
+    return {str(day.date): [aurora_period_times(period)
+                            for period in day.aurora] if day.aurora else None
+            for day in forecast.days}
+
+
+def forecast_record(forecast: SiteForecast) -> dict:
+    """
+    Converts one site's forecast into a single dictionary that can be
+    written as JSON, with the times formatted in TIMEZONE.
+
+    Parameters:
+        forecast (SiteForecast): The site's forecast.
+
+    Returns:
+        dict: The site details with 'sun', 'lunar', 'cloud', 'aurora',
+        'aurora_3day', 'score' and 'failed' entries. Missing forecasts are
+        None.
+    """
+    record = {} if forecast.site_id is None else {'site_id': forecast.site_id}
+    record.update({
+        'lat': forecast.lat,
+        'lng': forecast.lng,
+        'days': len(forecast.days),
+        'sun': by_day(forecast, 'sun', sun_times),
+        'lunar': by_day(forecast, 'lunar', lunar_times),
+        'cloud': by_day(forecast, 'cloud', cloud_summary),
+        'aurora': None if forecast.aurora is None else {
+            'Probability': forecast.aurora.probability,
+            'Colour': forecast.aurora.colour},
+        'aurora_3day': aurora_3day(forecast),
+        'score': by_day(forecast, 'score', score_summary),
+        'failed': forecast.failed})
+    return record
+
+
+def forecast_rows(forecast: SiteForecast) -> Iterator[dict]:
+    """
+    Flattens a site's forecast into one row per day with the ROW_FIELDS
+    columns. Forecasts that are missing are left as None.
+
+    The aurora probability is only given for today. The aurora colour and
+    Kp value of the other days come from the last two periods of the
+    three-day forecast, which cover the night.
+    """
+    # Read on each call, as the server and prefetcher run past midnight
+    today = date.today()
+    for day in forecast.days:
+        row = dict.fromkeys(ROW_FIELDS)
+        row.update({'site_id': forecast.site_id,
+                    'lat': forecast.lat,
+                    'lng': forecast.lng,
+                    'date': str(day.date),
+                    'failed': ';'.join(forecast.failed)})
+        if day.sun is not None:
+            row.update(sun_times(day.sun))
+        if day.lunar is not None:
+            row.update(lunar_times(day.lunar))
+        if day.cloud is not None:
+            row.update(cloud_summary(day.cloud))
+        if day.score is not None:
+            summary = score_summary(day.score)
+            # The hourly score is left to the NDJSON record
+            del summary['hourly_score']
+            row.update(summary)
+        night = day.aurora[-2:]
+        if night:
+            row['aurora_colour'] = night[-1].colour
+            row['aurora_kp'] = max(period.kp for period in night)
+        if day.date == today and forecast.aurora is not None:
+            row['aurora_probability'] = forecast.aurora.probability
+            row['aurora_colour'] = forecast.aurora.colour
+        yield row
+
+
+@stage
+def write_forecasts(forecasts: Iterable[SiteForecast], writers: list) -> int:
+    """
+    Writes every forecast to every writer in a single pass, so the forecasts
+    can come from a generator and each site is only held in memory once.
+
+    Parameters:
+        forecasts (Iterable): SiteForecast objects.
+        writers (list): Open ForecastWriter objects.
+
+    Returns:
+        int: The number of forecasts written.
+    """
+    written = 0
+    for forecast in forecasts:
+        for writer in writers:
+            writer.write(forecast)
+        written += 1
+    return written
+
+
+def open_writers(formats: list, output_path: str) -> list:
+    """
+    Opens a writer for each format. With one format the output path is used
+    as it is, otherwise its extension is replaced by each format's own.
+
+    Raises:
+        ValueError: If a format isn't one of WRITERS.
+    """
+    unknown = [fmt for fmt in formats if fmt not in WRITERS]
+    if unknown:
+        raise ValueError(f'Unknown output format: {", ".join(unknown)}')
+    if len(formats) == 1:
+        return [WRITERS[formats[0]](output_path)]
+    stem = os.path.splitext(output_path)[0]
+    return [WRITERS[fmt](f'{stem}.{WRITERS[fmt].extension}')
+            for fmt in formats]
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ForecastWriter:
+    """
+    Base class for the writers. A writer is opened on a path, given one
+    SiteForecast at a time and closed, and can be used as a context manager.
+    """
+    extension = ''
+
+    def __init__(self, path: str):
+        self.path = path
+        # pylint: disable-next=consider-using-with
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+
+    def write(self, forecast: SiteForecast) -> None:
+        """Writes one site's forecast and flushes it to the file."""
+        self.write_forecast(forecast)
+        self.flush()
+
+    def flush(self) -> None:
+        """Flushes what has been written so far to the file."""
+        self.file.flush()
+
+    def write_forecast(self, forecast: SiteForecast) -> None:
+        """Writes one site's forecast. Defined by each writer."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Closes the output file."""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TextWriter(ForecastWriter):
+    """Writes the human readable forecast, one block per day."""
+    extension = 'txt'
+
+    def write_forecast(self, forecast: SiteForecast) -> None:
+        if forecast.site_id is not None:
+            self.file.write(f'SITE {forecast.site_id} '
+                            f'({forecast.lat}, {forecast.lng})\n\n')
+        if forecast.failed:
+            self.file.write('UNAVAILABLE: ' + ', '.join(forecast.failed) +
+                            ' (the API calls failed or ran out of time)\n\n')
+        for day in forecast.days:
+            self.file.write('FORECAST FOR ' + str(day.date) + '\n\n')
+            self.write_lines('SUN AND TWILIGHT\n',
+                             None if day.sun is None else sun_times(day.sun),
+                             'The sun and twilight forecast is unavailable\n')
+            self.write_lunar_cloud(forecast, day)
+            self.write_aurora(forecast, day)
+            self.write_score(day)
+            self.file.write(TEXT_DIVIDER)
+
+    def write_lines(self, heading: str, values: dict | None,
+                    missing: str) -> None:
+        """Writes a heading then a 'key: value' line per item, or missing."""
+        self.file.write(heading)
+        if values is None:
+            self.file.write(missing)
+            return
+        for key, value in values.items():
+            self.file.write(f'{key}: {value}\n')
+
+    def write_lunar_cloud(self, forecast: SiteForecast,
+                          day: DayForecast) -> None:
+        """Writes the moon and cloud forecasts."""
+        if 'visualcrossing' in forecast.failed:
+            self.file.write('\n\nLUNAR AND CLOUDS\nThe lunar and cloud cover '
+                            'forecasts are unavailable\n')
+            return
+        # Check if and API key was given and write to file if it was
+        if day.lunar is None:
+            self.file.write('\n\nNo API key provided for lunar and cloud '
+                            'cover forecasts\n')
+            return
+        self.write_lines('\n\nLUNAR\n', lunar_times(day.lunar), '')
+        self.file.write('\n\nCLOUDS\n')
+        # The cloud forecast is None if the lunar forecast was computed
+        # offline without an API key, or the cloud API call failed
+        if day.cloud is None:
+            self.file.write('The cloud cover forecast is unavailable\n'
+                            if 'cloud' in forecast.failed else
+                            'No API key provided for a cloud cover forecast\n')
+            return
+        self.file.write(cloud_verdict(day.cloud) + '\n')
+        if day.cloud.night_mean is not None:
+            self.file.write(
+                f'While dark: mean {day.cloud.night_mean}%, '
+                f'min {day.cloud.night_min}%, '
+                f'{CLOUD_PERCENTILE:g}th percentile '
+                f'{day.cloud.night_percentile}% cloud cover\n'
+                f'Longest clear spell: {day.cloud.clear_hours} hours\n')
+        # One line per hour rather than the raw list of hours
+        for hour, cover in enumerate(day.cloud.hourly):
+            self.file.write(f'{hour:02d}:00 {cover:.1f}% cloud cover\n')
+
+    def write_aurora(self, forecast: SiteForecast, day: DayForecast) -> None:
+        """
+        Writes tonight's aurora probability for today, else the night's part
+        of the three-day forecast.
+        """
+        self.file.write('\n\nAURORA\n')
+        if day.date == date.today() and forecast.aurora is not None:
+            self.file.write('The probability of seeing the aurora is ' +
+                            str(forecast.aurora.probability) +
+                            '.\nThe colour status is ' +
+                            forecast.aurora.colour + '.\n')
+        elif not day.aurora:
+            self.file.write('The aurora forecast is unavailable\n')
+        else:
+            # Writing only the last two entries of the current day's
+            # aurora forecast to limit it to nighttime.
+            for period in day.aurora[-2:]:
+                self.write_lines('', aurora_period_times(period), '')
+
+    def write_score(self, day: DayForecast) -> None:
+        """
+        Writes the night's stargazing score, its best observing window and
+        the score for each hour from noon.
+        """
+        self.file.write('\n\nSTARGAZING SCORE\n')
+        if day.score is None:
+            self.file.write('The stargazing score is unavailable\n')
+            return
+        summary = score_summary(day.score)
+        self.file.write(f'Peak score: {day.score.peak}/100\n')
+        if day.score.window_start is None:
+            self.file.write(f'No hour scores {GOOD_SCORE:g} or more\n')
+        else:
+            self.file.write(f'Best window: {summary["best_window_start"]} to '
+                            f'{summary["best_window_end"]}, mean score '
+                            f'{day.score.window_score}/100\n')
+        for hour, value in enumerate(summary['hourly_score'], start=12):
+            self.file.write(f'{hour % 24:02d}:00 {value}/100\n')
+
+
+class NdjsonWriter(ForecastWriter):
+    """Writes one JSON line per site with the record from forecast_record."""
+    extension = 'jsonl'
+
+    def write_forecast(self, forecast: SiteForecast) -> None:
+        self.file.write(json.dumps(forecast_record(forecast)) + '\n')
+
+
+class CsvWriter(ForecastWriter):
+    """
+    Writes one CSV row per site and day with the ROW_FIELDS columns. The
+    hourly cloud cover is written as a JSON list.
+    """
+    extension = 'csv'
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.csv_writer = csv.DictWriter(self.file, fieldnames=ROW_FIELDS)
+        self.csv_writer.writeheader()
+
+    def write_forecast(self, forecast: SiteForecast) -> None:
+        for row in forecast_rows(forecast):
+            if row['hourly_cloudcover'] is not None:
+                row['hourly_cloudcover'] = json.dumps(row['hourly_cloudcover'])
+            self.csv_writer.writerow(row)
+
+
+class ParquetWriter(ForecastWriter):
+    """
+    Writes the ROW_FIELDS rows to a Parquet file, buffering up to
+    PARQUET_ROW_GROUP_SIZE rows before writing each row group. Needs pyarrow.
+    """
+    extension = 'parquet'
+
+    def __init__(self, path: str):  # pylint: disable=super-init-not-called
+        if pyarrow is None:
+            raise ValueError('Parquet output needs pyarrow: '
+                             'pip install pyarrow')
+        self.path = path
+        self.rows = []
+        self.file = pyarrow.parquet.ParquetWriter(path, self.schema())
+
+    def write_forecast(self, forecast: SiteForecast) -> None:
+        self.rows.extend(forecast_rows(forecast))
+
+    def flush(self) -> None:
+        """Writes the buffered rows once there are a row group's worth."""
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.write_rows()
+
+    def write_rows(self) -> None:
+        """Writes the buffered rows as one row group."""
+        if self.rows:
+            self.file.write_table(pyarrow.Table.from_pylist(
+                self.rows, schema=self.file.schema))
+            self.rows = []
+
+    def close(self) -> None:
+        self.write_rows()
+        self.file.close()
+
+    @staticmethod
+    def schema():
+        """Returns the pyarrow schema of the ROW_FIELDS columns."""
+        types = dict.fromkeys(ROW_FIELDS, pyarrow.string())
+        types.update({'lat': pyarrow.float64(),
+                      'lng': pyarrow.float64(),
+                      'cloudcover': pyarrow.float64(),
+                      'night_cloud_mean': pyarrow.float64(),
+                      'night_cloud_min': pyarrow.float64(),
+                      'night_cloud_percentile': pyarrow.float64(),
+                      'clear_hours': pyarrow.int64(),
+                      'hourly_cloudcover': pyarrow.list_(pyarrow.float64()),
+                      'aurora_probability': pyarrow.int64(),
+                      'aurora_kp': pyarrow.float64(),
+                      'window_score': pyarrow.float64(),
+                      'peak_score': pyarrow.float64()})
+        return pyarrow.schema(list(types.items()))
+
+
+# Writers by the name used for them in --format
+WRITERS = {'text': TextWriter,
+           'ndjson': NdjsonWriter,
+           'csv': CsvWriter,
+           'parquet': ParquetWriter}
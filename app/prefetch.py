@@ -0,0 +1,130 @@
+"""
+STARGAZING FORECAST PREFETCHER
+Keeps the response cache warm for a fixed list of sites, so the forecasts a
+dashboard asks for are built from the cache instead of waiting on the APIs.
+Sites are read from the same CSV or JSON Lines file as batch.py.
+
+Each site is built once, which fills the cache and remembers the call behind
+every cached response. Then every PREFETCH_INTERVAL seconds the responses of
+PREFETCH_PROVIDERS that expire within PREFETCH_LEAD seconds are refreshed in
+the background. Run it next to the forecast server, which reads the same
+cache file.
+
+Usage:
+    python3 prefetch.py sites.csv
+    python3 prefetch.py sites.csv --once
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import os
+import time
+
+# Counter of the rows that failed validation
+from collections import Counter
+
+# Logging modules
+from logger import logging_setup
+
+# Function to validate the API key
+from utils.validation_utils import validate_key
+
+# Functions to read the sites and build every forecast for one of them
+from batch import read_sites, forecast_site
+
+# Functions to refresh the responses about to expire and report the cache
+from apis.response_cache import refresh_expiring, log_cache_stats
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import PREFETCH_INTERVAL, PREFETCH_LEAD, PREFETCH_PROVIDERS, \
+    VC_API_KEYS
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def warm(sites_path: str, vc_api_key: str) -> int:
+    """
+    Builds the forecast of every site once, so its responses are cached and
+    the calls behind them are remembered for refreshing. Sites with the same
+    location and forecast length are built once.
+
+    Returns:
+        int: The number of forecasts built.
+    """
+    built = set()
+    for site in read_sites(sites_path, Counter()):
+        request = (site['lat'], site['lng'], site['days'])
+        if request not in built:
+            forecast_site(vc_api_key, *request)
+            built.add(request)
+    logger.info('Prefetched %s forecasts from %s.', len(built), sites_path)
+    return len(built)
+
+
+def prefetch(cycles: int | None = None,
+             interval: float = PREFETCH_INTERVAL,
+             lead: float = PREFETCH_LEAD) -> int:
+    """
+    Every interval seconds, refreshes the responses of PREFETCH_PROVIDERS
+    that expire within lead seconds.
+
+    Parameters:
+        cycles (int): Number of times to look, or None to keep looking.
+        interval (float): Seconds between looks.
+        lead (float): Seconds before expiry a response is refreshed.
+
+    Returns:
+        int: The number of refreshes started.
+    """
+    started = 0
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        if cycle:
+            time.sleep(interval)
+        refreshes = refresh_expiring(PREFETCH_PROVIDERS, lead)
+        if refreshes:
+            logger.info('Refreshing %s cached responses.', refreshes)
+        started += refreshes
+        cycle += 1
+    return started
+
+
+def main() -> None:
+    """Parses the command line arguments and prefetches until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Keep the response cache warm for a file of sites.')
+    parser.add_argument('sites',
+                        help='CSV or .jsonl file with site_id, lat, lng and '
+                             'days fields')
+    # The first of the extra keys in config.ini is used if none is given
+    default_key = os.environ.get('VC_API_KEY',
+                                 VC_API_KEYS[0] if VC_API_KEYS else 'xxx')
+    parser.add_argument('--vc-key', default=default_key,
+                        help='Visual Crossing API key, "xxx" for none')
+    parser.add_argument('--once', action='store_true',
+                        help='build the sites and refresh once, then exit')
+    args = parser.parse_args()
+
+    built = warm(args.sites, validate_key(args.vc_key))
+    print(f'Prefetched {built} forecasts from "{args.sites}".')
+    try:
+        prefetch(1 if args.once else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_cache_stats()
+
+
+if __name__ == '__main__':
+    main()
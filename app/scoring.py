@@ -0,0 +1,159 @@
+"""
+Composite stargazing score. Combines how dark the sky is, the moonlight, the
+cloud cover and the chance of an aurora into one score from 0 to 100 for
+every hour of every night, and finds each night's best observing window.
+
+Everything is computed as NumPy array operations over (nights x hours), so
+thousands of sites are scored in one call.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# Dataclass for the hourly arrays of a set of nights
+from dataclasses import dataclass
+
+# NumPy does the maths for every night and hour in one pass.
+# It may be necessary to pip install numpy
+import numpy as np
+
+# Moon and aurora models
+from ephemeris.solar import UNIX_EPOCH_JD
+from ephemeris.lunar import moon_altitude, moon_phase, illumination
+from ephemeris.geomagnetic import geomagnetic_latitude, aurora_probability
+
+# The twilight columns, from the darkest to the lightest
+from utils.data_utils import DARKNESS_COLUMNS
+from utils.datetime_utils import NO_EVENT_EPOCH
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import GOOD_SCORE, MOON_WEIGHT, AURORA_WEIGHT
+
+# How dark the sky is, from 0 to 1, during each twilight in DARKNESS_COLUMNS:
+# astronomical darkness, astronomical, nautical and civil twilight.
+DARKNESS_WEIGHTS = (1.0, 0.8, 0.5, 0.2)
+
+# Hours of the timeline that are scored: noon to noon the next day
+NIGHT_HOURS = slice(12, 36)
+
+# Sine of the moon altitude at which its light counts in full
+FULL_MOONLIGHT_SIN = np.sin(np.radians(30.0))
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+@dataclass(slots=True)
+class Timeline:
+    """
+    The hourly inputs of a set of nights, one row per night. The hour
+    columns run from midnight at the start of the night's date, and unknown
+    cloud cover or Kp values are NaN.
+    """
+    hour_starts: np.ndarray
+    sun_times: np.ndarray
+    cloud: np.ndarray
+    kp: np.ndarray
+    lats: np.ndarray
+    lngs: np.ndarray
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def darkness(middles: np.ndarray, sun_times: np.ndarray) -> np.ndarray:
+    """
+    Returns how dark it is, from 0 to 1, at the middle of each hour. The
+    night runs from the day's evening twilight to the next morning's,
+    estimated as the day's morning time plus a day.
+    """
+    dark = np.zeros_like(middles)
+    for (begin, end), weight in zip(DARKNESS_COLUMNS, DARKNESS_WEIGHTS):
+        starts, ends = sun_times[:, end, None], sun_times[:, begin, None]
+        inside = (middles >= starts) & (middles < ends + 86400) & \
+            (starts != NO_EVENT_EPOCH) & (ends != NO_EVENT_EPOCH)
+        dark = np.maximum(dark, np.where(inside, weight, 0.0))
+    return dark
+
+
+def moonlight(middles: np.ndarray,
+              lats: np.ndarray,
+              lngs: np.ndarray) -> np.ndarray:
+    """
+    Returns how much the moon brightens the sky, from 0 to 1, at the middle
+    of each hour: its illuminated fraction, scaled down while it is below
+    30 degrees and zero once it has set.
+    """
+    jd = middles / 86400.0 + UNIX_EPOCH_JD
+    altitude, _ = moon_altitude(jd, lats[:, None], lngs[:, None])
+    height = np.clip(np.sin(np.radians(altitude)) / FULL_MOONLIGHT_SIN,
+                     0.0, 1.0)
+    return illumination(moon_phase(jd)) * height
+
+
+def best_windows(scores: np.ndarray, hour_starts: np.ndarray) -> dict:
+    """
+    Finds the run of consecutive hours scoring at least GOOD_SCORE with the
+    highest total score in each row.
+
+    Returns:
+        dict: Arrays of the 'start' and 'end' epoch seconds of each window,
+        NaN if no hour is good enough, and the window's mean 'score'.
+    """
+    good = scores >= GOOD_SCORE
+    # Running totals that restart after every hour that isn't good, so the
+    # value at each hour is the total of the run it ends.
+    totals = np.cumsum(np.where(good, scores, 0.0), axis=1)
+    totals -= np.maximum.accumulate(np.where(good, 0.0, totals), axis=1)
+    lengths = np.cumsum(good, axis=1)
+    lengths -= np.maximum.accumulate(np.where(good, 0, lengths), axis=1)
+
+    rows = np.arange(scores.shape[0])
+    last = np.argmax(totals, axis=1)
+    length = lengths[rows, last]
+    found = length > 0
+    first = last - np.maximum(length, 1) + 1
+    return {'start': np.where(found, hour_starts[rows, first], np.nan),
+            'end': np.where(found, hour_starts[rows, last] + 3600, np.nan),
+            'score': np.where(found, totals[rows, last]
+                              / np.maximum(length, 1), np.nan)}
+
+
+def score_timeline(timeline: Timeline) -> dict:
+    """
+    Scores every hour from noon to noon of every night in the timeline.
+
+    The score is 100 when it is astronomically dark, clear and the moon is
+    down. Twilight, cloud and moonlight reduce it, in proportion to
+    MOON_WEIGHT for the moon, and the chance of an aurora adds up to
+    AURORA_WEIGHT x 100. Nights without a cloud forecast are scored on the
+    sky alone, but an hour without one on a night that has one scores 0 so
+    it is never recommended.
+
+    Parameters:
+        timeline (Timeline): The hourly inputs, at least 36 hours per row.
+
+    Returns:
+        dict: The hourly 'scores' array, the 'peak' score of each night and
+        the 'start', 'end' and mean 'score' of each night's best window as
+        returned by best_windows.
+    """
+    hour_starts = timeline.hour_starts[:, NIGHT_HOURS]
+    middles = hour_starts + 1800.0
+    cloud = timeline.cloud[:, NIGHT_HOURS]
+    known = ~np.isnan(cloud)
+    clear = np.where(known, 1.0 - cloud / 100.0,
+                     np.where(known.any(axis=1, keepdims=True), 0.0, 1.0))
+    sky = darkness(middles, timeline.sun_times) * clear
+    aurora = np.nan_to_num(aurora_probability(
+        geomagnetic_latitude(timeline.lats, timeline.lngs)[:, None],
+        timeline.kp[:, NIGHT_HOURS]), nan=0.0) / 100.0
+    moon = 1.0 - MOON_WEIGHT * moonlight(middles, timeline.lats,
+                                         timeline.lngs)
+    scores = np.clip(100.0 * sky * (moon + AURORA_WEIGHT * aurora),
+                     0.0, 100.0).astype(np.float32)
+    windows = best_windows(scores, hour_starts)
+    windows.update({'scores': scores, 'peak': scores.max(axis=1)})
+    return windows
@@ -0,0 +1,269 @@
+"""
+STARGAZING FORECAST SERVER
+Serves forecasts over a local HTTP/JSON API so a dashboard can poll many
+sites without paying Python startup, config parsing and logging setup on
+every forecast. The shared HTTP client keeps its connection pools warm
+between requests.
+
+Built forecasts are kept in a bounded in-memory LRU, and concurrent requests
+for the same location and forecast length share a single build.
+
+Usage:
+    python3 server.py --port 8080
+    curl "http://127.0.0.1:8080/forecast?lat=51.5&lng=-0.1&days=2"
+    curl "http://127.0.0.1:8080/metrics"
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import json
+import os
+import time
+
+# Tools for the forecast cache and the single-flight builds
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+# HTTP server modules
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Logging modules
+from logger import logging_setup
+
+# The API and stage metrics, served at /metrics
+from metrics import registry
+
+# Functions to validate the query parameters
+from utils.validation_utils import validate_lat, validate_lng, \
+    validate_length, validate_key
+
+# Functions to build every forecast for one location and analyse its nights
+from batch import forecast_site
+from forecast_builder import analyse_nights
+
+# Function to turn a site's forecasts into a JSON ready record
+from output_writer import forecast_record
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import SERVER_HOST, SERVER_PORT, SERVER_CACHE_SIZE, \
+    SERVER_CACHE_TTL, CACHE_COORD_PRECISION
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ForecastCache:
+    """
+    A bounded, thread safe LRU of encoded forecast responses that expire
+    after ttl seconds.
+
+    Concurrent requests for a key that isn't cached share one build: the
+    first request builds it and the others wait for its result.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Cached responses, keyed by request, with the time they expire
+        self.entries = OrderedDict()
+        # Builds still running, keyed by request
+        self.in_flight = {}
+        self.lock = Lock()
+        self.stats = Counter()
+
+    def get(self, key: tuple, build) -> bytes:
+        """
+        Returns the cached response for key, or waits for build to make one.
+
+        Parameters:
+            key (tuple): The request, e.g. (lat, lng, days).
+            build (callable): Returns (body, cacheable). Bodies that aren't
+                cacheable are passed to the waiting requests but not kept.
+
+        Returns:
+            bytes: The response body.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                self.stats['misses'] += 1
+                future = self.in_flight[key] = Future()
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+        return self._build(key, future, build)
+
+    def snapshot(self) -> dict:
+        """Returns the number of cached forecasts and the hit counts."""
+        with self.lock:
+            return {'entries': len(self.entries), **self.stats}
+
+    def _build(self, key: tuple, future: Future, build) -> bytes:
+        """Runs build, caches its body and hands it to the waiting requests."""
+        try:
+            body, cacheable = build()
+        except Exception as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.in_flight[key]
+            if cacheable:
+                self.entries[key] = (time.monotonic() + self.ttl, body)
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        future.set_result(body)
+        return body
+
+
+class ForecastServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server holding the forecast cache and the Visual
+    Crossing API key shared by every request.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple, vc_api_key: str = 'xxx',
+                 cache: ForecastCache | None = None):
+        super().__init__(address, ForecastHandler)
+        self.vc_api_key = vc_api_key
+        self.forecast_cache = cache or ForecastCache(SERVER_CACHE_SIZE,
+                                                     SERVER_CACHE_TTL)
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """
+    Handles GET /forecast?lat=&lng=&days= with the same JSON record that
+    batch.py writes for each site, GET /health with the cache stats and GET
+    /metrics with the API and stage metrics for Prometheus.
+    """
+    server: ForecastServer
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Routes the request to the forecast or health response."""
+        url = urlsplit(self.path)
+        if url.path == '/forecast':
+            self.forecast(parse_qs(url.query))
+        elif url.path == '/health':
+            self.send_json(200, json.dumps(
+                self.server.forecast_cache.snapshot()).encode())
+        elif url.path == '/metrics':
+            self.send_body(200, PROMETHEUS_CONTENT_TYPE,
+                           registry.render().encode())
+        else:
+            self.send_json(404, b'{"error": "Not found"}')
+
+    def forecast(self, query: dict) -> None:
+        """Validates the query and sends the cached or newly built forecast."""
+        try:
+            lat = validate_lat(query['lat'][0])
+            lng = validate_lng(query['lng'][0])
+            days = validate_length(query.get('days', ['1'])[0])
+        except (KeyError, ValueError) as e:
+            self.send_json(400, json.dumps(
+                {'error': f'Invalid or missing parameter: {e}'}).encode())
+            return
+
+        # Rounding the location the same way as the response cache lets
+        # nearby sites share a forecast.
+        lat = round(lat, CACHE_COORD_PRECISION)
+        lng = round(lng, CACHE_COORD_PRECISION)
+        vc_api_key = self.server.vc_api_key
+        try:
+            body = self.server.forecast_cache.get(
+                (lat, lng, days),
+                lambda: build_response(vc_api_key, lat, lng, days))
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception('Could not build the forecast for %s, %s.',
+                             lat, lng)
+            self.send_json(500, b'{"error": "Could not build the forecast"}')
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status: int, body: bytes) -> None:
+        """Sends a JSON response body."""
+        self.send_body(status, 'application/json', body)
+
+    def send_body(self, status: int, content_type: str, body: bytes) -> None:
+        """Sends a response body."""
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Sends the access log to the app's logger instead of stderr."""
+        logger.debug(format, *args)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def build_response(vc_api_key: str, lat: float, lng: float,
+                   days: int) -> tuple:
+    """
+    Builds the forecast for one location as an encoded JSON record.
+
+    Returns:
+        tuple: (body, cacheable) where cacheable is False if any provider
+        failed, so the next request tries again.
+    """
+    forecast = forecast_site(vc_api_key, lat, lng, days)
+    analyse_nights([forecast])
+    return (json.dumps(forecast_record(forecast)).encode(),
+            not forecast.failed)
+
+
+def main() -> None:
+    """Parses the command line arguments and serves until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Serve stargazing forecasts over HTTP.')
+    parser.add_argument('--host', default=SERVER_HOST,
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help='port to listen on')
+    parser.add_argument('--vc-key', default=os.environ.get('VC_API_KEY',
+                                                           'xxx'),
+                        help='Visual Crossing API key, "xxx" for none')
+    args = parser.parse_args()
+
+    server = ForecastServer((args.host, args.port), validate_key(args.vc_key))
+    logger.info('Serving forecasts on %s:%s', args.host, args.port)
+    print(f'Serving forecasts on http://{args.host}:{args.port}/forecast')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info('Server stopped. Cache stats: %s',
+                    server.forecast_cache.snapshot())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+STUB API SERVER
+Serves the responses recorded by the 'record' transport mode over HTTP, so
+the app, the batch mode and the benchmarks can run against all three APIs
+offline. Each response can be delayed and a fraction of them made to fail,
+to see how the app copes with slow or unreliable APIs.
+
+Point the URLs in the [API] section of config.ini at the stub, e.g.
+SUN_API_URL = http://127.0.0.1:8081/json
+
+Usage:
+    python3 stub_server.py --port 8081 --latency-ms 200 --error-rate 0.05
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+import argparse
+import random
+import time
+from contextlib import suppress
+
+# HTTP server modules
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+# Logging modules
+from logger import logging_setup
+
+# Functions to find the recorded responses
+from apis.transport import load_fixture, request_key
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import TRANSPORT_FIXTURES_PATH, STUB_HOST, STUB_PORT, \
+    STUB_LATENCY_MS, STUB_ERROR_RATE
+
+# Status code of the injected errors
+ERROR_STATUS = 503
+
+
+###############################################################################
+# SETUP LOGGING
+###############################################################################
+logger = logging_setup(__name__)
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class StubServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server answering every GET from the fixtures in folder,
+    after latency_ms (plus up to jitter_ms) and failing error_rate of them.
+    The errors are drawn from a seeded generator so a run can be repeated.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple, folder: str = TRANSPORT_FIXTURES_PATH,
+                 latency: tuple = (STUB_LATENCY_MS, 0.0),
+                 error_rate: float = STUB_ERROR_RATE, seed: int = 0):
+        super().__init__(address, StubHandler)
+        self.folder = folder
+        self.latency_ms, self.jitter_ms = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = Lock()
+
+    def draw(self) -> tuple:
+        """Returns the delay in seconds and whether to fail a response."""
+        with self.random_lock:
+            jitter = self.random.uniform(0.0, self.jitter_ms)
+            fail = self.random.random() < self.error_rate
+        return (self.latency_ms + jitter) / 1000, fail
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers GET requests with the recorded response for the path."""
+    server: StubServer
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Sends the recorded response, an injected error or a 404."""
+        delay, fail = self.server.draw()
+        time.sleep(delay)
+        if fail:
+            self.send_body(ERROR_STATUS, 'application/json',
+                           '{"error": "Injected error"}')
+            return
+        fixture = load_fixture(self.server.folder, self.path)
+        if fixture is None:
+            logger.warning('No recording for %s', request_key(self.path))
+            self.send_body(404, 'application/json',
+                           '{"error": "No recording"}')
+            return
+        self.send_body(fixture['status'], fixture['content_type'],
+                       fixture['body'])
+
+    def send_body(self, status: int, content_type: str, body: str) -> None:
+        """Sends a response with a text body."""
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Sends the access log to the app's logger instead of stderr."""
+        logger.debug(format, *args)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def main() -> None:
+    """Parses the command line arguments and serves until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Serve recorded API responses over HTTP.')
+    parser.add_argument('--host', default=STUB_HOST,
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=STUB_PORT,
+                        help='port to listen on')
+    parser.add_argument('--fixtures', default=TRANSPORT_FIXTURES_PATH,
+                        help='folder of recorded responses')
+    parser.add_argument('--latency-ms', type=float, default=STUB_LATENCY_MS,
+                        help='milliseconds added to each response')
+    parser.add_argument('--jitter-ms', type=float, default=0.0,
+                        help='up to this many more milliseconds at random')
+    parser.add_argument('--error-rate', type=float, default=STUB_ERROR_RATE,
+                        help=f'fraction of responses that fail with '
+                             f'{ERROR_STATUS}')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the latency jitter and the errors')
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.fixtures,
+                        (args.latency_ms, args.jitter_ms), args.error_rate,
+                        args.seed)
+    logger.info('Serving %s on %s:%s', args.fixtures, args.host, args.port)
+    print(f'Serving recorded responses on http://{args.host}:{args.port}')
+    # The server is closed when it is interrupted
+    with server, suppress(KeyboardInterrupt):
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
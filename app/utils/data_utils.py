@@ -1,6 +1,38 @@
 """
 Functions relating to transforming data returned by the APIs
 """
+###############################################################################
+# IMPORTS
+###############################################################################
+# Warnings are silenced for nights without any dark hours
+import warnings
+
+# NumPy analyses the cloud cover of every night at once.
+# It may be necessary to pip install numpy
+import numpy as np
+
+# The epoch sunrise-sunset.org gives for events that don't happen
+from utils.datetime_utils import NO_EVENT_EPOCH
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+from config import CLOUD_PERCENTILE, CLEAR_THRESHOLD
+
+# Upper bound (%) of each cloud cover verdict and the verdict. Anything
+# cloudier is TOO_CLOUDY.
+CLOUD_VERDICTS = (
+    (10.0, 'There are very few clouds. Perfect for for stargazing!'),
+    (30.0, 'There are some clouds, so only moderately good stargazing.'),
+)
+TOO_CLOUDY = 'It is too cloudy for good stargazing.'
+
+# Column indices of each (begin, end) twilight pair in EVENT_NAMES order,
+# from the darkest to the lightest, with sunrise and sunset last.
+DARKNESS_COLUMNS = ((6, 7), (4, 5), (2, 3), (0, 1))
+
+
 ###############################################################################
 # FUNCTIONS
 ###############################################################################
@@ -33,8 +65,88 @@ def find_how_cloudy(cloud_cover: float) -> str:
     Takes the percentage cloud cover and returns an assessment of stargazing
     feasibility using boolean values.
     """
-    if 0.0 <= cloud_cover < 10.0:
-        return 'There are very few clouds. Perfect for for stargazing!'
-    if 10.0 <= cloud_cover < 30.0:
-        return 'There are some clouds, so only moderately good stargazing.'
-    return 'It is too cloudy for good stargazing.'
+    return str(how_cloudy(cloud_cover))
+
+
+def how_cloudy(cloud_cover: np.ndarray | float) -> np.ndarray:
+    """
+    Returns the CLOUD_VERDICTS assessment of stargazing feasibility for each
+    percentage cloud cover in one pass. NaN is TOO_CLOUDY.
+    """
+    cloud_cover = np.asarray(cloud_cover, dtype=np.float64)
+    return np.select(
+        [(cloud_cover >= 0.0) & (cloud_cover < upper)
+         for upper, _ in CLOUD_VERDICTS],
+        [verdict for _, verdict in CLOUD_VERDICTS],
+        default=TOO_CLOUDY)
+
+
+def dark_windows(sun_times: np.ndarray) -> tuple:
+    """
+    Finds when it is dark each night from the sun event times.
+
+    Darkness runs from the evening end of the darkest twilight that happens
+    that day to its beginning the next morning, estimated as that morning's
+    time plus a day. Nights where the sun doesn't set are NaN.
+
+    Parameters:
+        sun_times (np.ndarray): (nights, 8) array of epoch seconds in
+            EVENT_NAMES order, with NO_EVENT_EPOCH for missing events.
+
+    Returns:
+        tuple: (dusk, dawn) arrays of epoch seconds.
+    """
+    sun_times = np.asarray(sun_times, dtype=np.float64)
+    happens = [(sun_times[:, begin] != NO_EVENT_EPOCH)
+               & (sun_times[:, end] != NO_EVENT_EPOCH)
+               for begin, end in DARKNESS_COLUMNS]
+    dusk = np.select(happens, [sun_times[:, end]
+                               for _, end in DARKNESS_COLUMNS],
+                     default=np.nan)
+    dawn = np.select(happens, [sun_times[:, begin] + 86400
+                               for begin, _ in DARKNESS_COLUMNS],
+                     default=np.nan)
+    return dusk, dawn
+
+
+def night_cloud_stats(hourly: np.ndarray,
+                      hour_starts: np.ndarray,
+                      dusk: np.ndarray,
+                      dawn: np.ndarray) -> dict:
+    """
+    Analyses the cloud cover between dusk and dawn for every night at once.
+
+    An hour counts towards a night if its middle is dark. Hours without a
+    forecast should be NaN and are left out.
+
+    Parameters:
+        hourly (np.ndarray): (nights, hours) cloud cover (%).
+        hour_starts (np.ndarray): Epoch seconds each hour starts, the same
+            shape as hourly.
+        dusk (np.ndarray): Epoch seconds darkness starts each night.
+        dawn (np.ndarray): Epoch seconds darkness ends each night.
+
+    Returns:
+        dict: Arrays of the 'mean', 'min' and CLOUD_PERCENTILE 'percentile'
+        cloud cover of each night, NaN if it has no dark hours, and the
+        'clear_hours', the longest run of dark hours with less than
+        CLEAR_THRESHOLD cloud cover.
+    """
+    middles = hour_starts + 1800
+    dark = (middles >= dusk[:, None]) & (middles < dawn[:, None]) & \
+        ~np.isnan(hourly)
+    night = np.where(dark, hourly, np.nan)
+    # Nights with no dark hours give NaN, which is expected
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = {'mean': np.nanmean(night, axis=1),
+                 'min': np.nanmin(night, axis=1),
+                 'percentile': np.nanpercentile(night, CLOUD_PERCENTILE,
+                                                axis=1)}
+    # The length of the clear run each hour ends, restarting from the
+    # running total at every hour that isn't clear.
+    clear = (dark & (hourly < CLEAR_THRESHOLD)).astype(np.int64)
+    runs = np.cumsum(clear, axis=1)
+    runs -= np.maximum.accumulate(np.where(clear == 0, runs, 0), axis=1)
+    stats['clear_hours'] = runs.max(axis=1, initial=0)
+    return stats
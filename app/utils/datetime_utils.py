@@ -9,6 +9,20 @@ from datetime import date
 from datetime import datetime as dt
 from datetime import timedelta
 
+# Math is used to check for missing event times
+import math
+
+# ZoneInfo converts UTC times to the forecast's timezone
+from zoneinfo import ZoneInfo
+
+
+###############################################################################
+# VARIABLES
+###############################################################################
+# sunrise-sunset.org gives 1970-01-01 00:00:01 UTC for events that don't
+# happen on a date, e.g. astronomical twilight in a British summer.
+NO_EVENT_EPOCH = 1
+
 
 ###############################################################################
 # DEFINING FUNCTIONS
@@ -19,17 +33,52 @@ def get_forecast_dates(length):
     return [today + timedelta(days=i) for i in range(length)]
 
 
-def convert_to_24hr(timestr: str) -> str:
+def local_time_to_epoch(day: date,
+                        timestr: str,
+                        tz_name: str,
+                        time_format: str = '%H:%M:%S') -> int:
+    """
+    Converts a clock time on the given date in the given timezone to seconds
+    since the Unix epoch. The time is read with time_format, e.g.
+    '%I:%M:%S %p' for the 12-hour clock.
+    """
+    time_obj = dt.strptime(timestr, time_format)
+    return int(dt.combine(day, time_obj.time(),
+                          tzinfo=ZoneInfo(tz_name)).timestamp())
+
+
+def sun_api_time_to_epoch(day: date, timestr: str, tz_name: str) -> int:
+    """
+    Converts a 12-hour clock time from sunrise-sunset.org, in tz_name, on the
+    given date to seconds since the Unix epoch. The API's time for an event
+    that doesn't happen is converted back to NO_EVENT_EPOCH.
+    """
+    time_obj = dt.strptime(timestr, '%I:%M:%S %p').time()
+    if time_obj == dt.fromtimestamp(NO_EVENT_EPOCH,
+                                    tz=ZoneInfo(tz_name)).time():
+        return NO_EVENT_EPOCH
+    return int(dt.combine(day, time_obj,
+                          tzinfo=ZoneInfo(tz_name)).timestamp())
+
+
+def format_epoch_time(epoch: float,
+                      tz_name: str,
+                      time_format: str = '%H:%M') -> str:
     """
-    Converts the 12-hour clock to the 24-hour clock in hours and minutes.
+    Converts seconds since the Unix epoch to a 24-hour clock time in the given
+    timezone, in hours and minutes unless another time_format is given. A NaN
+    time, for an event that doesn't happen, is given the same time as
+    sunrise-sunset.org gives.
     """
-    time_obj = dt.strptime(timestr, '%I:%M:%S %p')
-    return time_obj.strftime('%H:%M')
+    if math.isnan(epoch):
+        epoch = NO_EVENT_EPOCH
+    time_obj = dt.fromtimestamp(round(epoch), tz=ZoneInfo(tz_name))
+    return time_obj.strftime(time_format)
 
 
-def reformat_iso8601(dt_str: str) -> str:
+def iso8601_to_epoch(dt_str: str) -> int:
     """
-    Uses string slicing to convert an ISO 8601 datetime string to a readable
-    format.
+    Converts an ISO 8601 datetime string with a UTC offset to seconds since
+    the Unix epoch.
     """
-    return dt_str[:10] + ' - ' + dt_str[11:16]
+    return int(dt.fromisoformat(dt_str).timestamp())
@@ -0,0 +1,68 @@
+"""
+Functions to import modules lazily, so a run only pays for the heavy
+dependencies it actually uses, and to load them in the background.
+"""
+###############################################################################
+# IMPORTS
+###############################################################################
+# Importlib's LazyLoader runs a module the first time it is used
+import importlib
+import importlib.util
+import sys
+import time
+
+# A background thread loads the modules while the app does something else
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+###############################################################################
+# DEFINING FUNCTIONS
+###############################################################################
+def lazy_import(name: str):
+    """
+    Returns the module called name, which is only run the first time one of
+    its attributes is used. A module that has already been imported is
+    returned as it is.
+
+    Raises:
+        ModuleNotFoundError: If the module can't be found.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    # A submodule is also an attribute of its package, as after an import
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def load_modules(names: tuple) -> float:
+    """
+    Imports each of the named modules, running any that were imported
+    lazily, and returns the seconds it took.
+    """
+    start = time.perf_counter()
+    for name in names:
+        # Any attribute makes a lazy module run
+        getattr(importlib.import_module(name), '__dict__')
+    return time.perf_counter() - start
+
+
+def preload(names: tuple) -> Future:
+    """
+    Starts importing the named modules on a background thread.
+
+    Returns:
+        Future: The seconds the imports took, from load_modules.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preload')
+    future = executor.submit(load_modules, names)
+    executor.shutdown(wait=False)
+    return future
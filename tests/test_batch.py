@@ -0,0 +1,133 @@
+"""Tests for the batch entry point."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import sqlite3
+from array import array
+
+import pytest
+from apis import quota
+from app import batch
+from app.forecast_model import SunDay, AuroraTonight
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(name='builds')
+def fixture_builds(tmp_path, monkeypatch):
+    """
+    Replaces the forecast builders with fakes and returns the list of
+    locations the sun builder was called for. The aurora builder fails for
+    southern latitudes. The quota is kept in a temporary ledger.
+    """
+    calls = []
+    quota.set_quota(quota.Quota(
+        quota.Ledger(str(tmp_path / 'ledger.sqlite3')),
+        quota.TokenBucket(0, 1)))
+
+    def fake_sun(dates, lat, lng):
+        calls.append((lat, lng, len(dates)))
+        return [SunDay(array('q', [18000] * 8)) for _ in dates]
+
+    def fake_aurora(dates, lat, _lng):
+        if lat < 0:
+            raise KeyError('value')
+        return AuroraTonight(probability=1, colour='green'), \
+            {day: () for day in dates}
+
+    monkeypatch.setattr(batch, 'sun_forecast_build', fake_sun)
+    monkeypatch.setattr(batch, 'vc_forecast_build', lambda *args: None)
+    monkeypatch.setattr(batch, 'aurora_forecast_build', fake_aurora)
+    yield calls
+    quota.set_quota(None)
+
+
+def write_sites(path, text: str) -> str:
+    """Writes a sites file and returns its path as a string."""
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing run_batch() =====
+def test_one_record_per_site_with_duplicates_built_once(builds, tmp_path):
+    """Test every site is written but identical requests are built once."""
+    sites = write_sites(tmp_path / 'sites.csv',
+                        'site_id,lat,lng,days\n'
+                        'a,51.5,-0.1,2\n'
+                        'b,51.5,-0.1,2\n'
+                        'c,55.9,-3.2,1\n'
+                        'd,51.5,-0.1,2\n')
+    output = tmp_path / 'out.jsonl'
+    summary = batch.run_batch(sites, str(output), workers=2)
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record['site_id'] for record in records) == \
+        ['a', 'b', 'c', 'd']
+    assert sorted(builds) == [(51.5, -0.1, 2), (55.9, -3.2, 1)]
+    assert summary['sites'] == 4
+    assert not summary['failures']
+
+
+def test_failures_are_counted_per_provider(builds, tmp_path):
+    """Test invalid rows and failed builders are reported, not raised."""
+    sites = write_sites(tmp_path / 'sites.jsonl',
+                        '{"site_id": "a", "lat": -40, "lng": 170, "days": 1}\n'
+                        '{"site_id": "b", "lat": 95, "lng": 0, "days": 1}\n'
+                        '{"site_id": "c", "lat": 10, "lng": 0}\n')
+    output = tmp_path / 'out.jsonl'
+    summary = batch.run_batch(sites, str(output))
+    record = json.loads(output.read_text())
+    assert record['failed'] == ['aurora']
+    assert record['aurora'] is None
+    assert summary['failures'] == {'input': 2, 'aurora': 1}
+    assert len(builds) == 1
+
+
+def test_unexpected_errors_fail_one_provider(builds, tmp_path, monkeypatch):
+    """Test any builder error fails the provider, not the whole batch."""
+    def broken_vc(*_args):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(batch, 'vc_forecast_build', broken_vc)
+    sites = write_sites(tmp_path / 'sites.csv',
+                        'site_id,lat,lng,days\n'
+                        'a,51.5,-0.1,1\n')
+    output = tmp_path / 'out.jsonl'
+    summary = batch.run_batch(sites, str(output))
+    assert json.loads(output.read_text())['failed'] == ['visualcrossing']
+    assert summary['failures'] == {'visualcrossing': 1}
+    assert len(builds) == 1
+
+
+def test_csv_format(builds, tmp_path):
+    """Test the csv format writes one row per site and day."""
+    sites = write_sites(tmp_path / 'sites.csv',
+                        'site_id,lat,lng,days\n'
+                        'a,51.5,-0.1,2\n')
+    output = tmp_path / 'out.csv'
+    batch.run_batch(sites, str(output), formats=('csv',))
+    lines = output.read_text().splitlines()
+    assert lines[0].startswith('site_id,lat,lng,date,sunrise')
+    assert len(lines) == 3
+    assert len(builds) == 1
+
+
+# ===== Testing plan_sites() =====
+def test_sites_are_planned_to_fit_the_records_left():
+    """
+    Test the cheapest sites are planned first, a repeated site costs once
+    and the sites that don't fit are built without Visual Crossing.
+    """
+    failures = batch.Counter()
+    sites = [{'site_id': 'a', 'lat': 1.0, 'lng': 1.0, 'days': 3},
+             {'site_id': 'b', 'lat': 2.0, 'lng': 2.0, 'days': 1},
+             {'site_id': 'c', 'lat': 2.0, 'lng': 2.0, 'days': 1},
+             {'site_id': 'd', 'lat': 3.0, 'lng': 3.0, 'days': 2}]
+    planned = list(batch.plan_sites(sites, 100, failures))
+    assert [(site['site_id'], site['vc']) for site in planned] == \
+        [('b', True), ('c', True), ('d', True), ('a', False)]
+    assert failures == {'quota': 1}
@@ -0,0 +1,70 @@
+"""Tests for the pipeline benchmark."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import pytest
+from apis import http_client, quota, response_cache
+from app import benchmark
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(name='fresh_session')
+def fixture_fresh_session(tmp_path, monkeypatch):
+    """
+    Gives the scenario its own shared session, cache setting and quota, so
+    the synthetic adapter, the cache and the ledger it sets up don't outlive
+    the test or touch the app's ledger.
+    """
+    monkeypatch.setattr(http_client, '_SESSION', None)
+    monkeypatch.setattr(response_cache, '_CACHE', None)
+    monkeypatch.setattr(response_cache, 'CACHE_ENABLED',
+                        response_cache.CACHE_ENABLED)
+    quota.set_quota(quota.Quota(
+        quota.Ledger(str(tmp_path / 'ledger.sqlite3')),
+        quota.TokenBucket(0, 1)))
+    yield
+    quota.set_quota(None)
+
+
+def scenario(**overrides) -> dict:
+    """Returns a small synthetic scenario."""
+    return {'sites': 4, 'days': 2, 'workers': 2, 'latency_ms': 0.0,
+            'cache': False, 'unique': 1.0, 'transport': 'synthetic',
+            'trace': False, 'vc_api_key': benchmark.SYNTHETIC_VC_KEY,
+            **overrides}
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing run_scenario() =====
+@pytest.mark.usefixtures('fresh_session')
+def test_every_stage_is_timed_for_every_site():
+    """Test the synthetic responses run the whole pipeline offline."""
+    result = benchmark.run_scenario(scenario(trace=True))
+    assert set(result['stages']) == set(benchmark.STAGES)
+    assert all(stats['count'] == 4 for stats in result['stages'].values())
+    assert result['sites_per_second'] > 0
+    assert result['allocations']['traced_peak_bytes'] > 0
+    assert 'vc_api_key' not in result
+
+
+# ===== Testing site_locations() =====
+def test_sites_repeat_when_not_unique():
+    """Test a unique fraction of 0.5 visits each location twice."""
+    locations = benchmark.site_locations(10, 0.5)
+    assert len(locations) == 10 and len(set(locations)) == 5
+
+
+# ===== Testing compare_results() =====
+def test_compare_results_gives_ratios():
+    """Test matching scenarios are compared and the rest skipped."""
+    def run(sites: int, p50: float, throughput: float) -> dict:
+        return {**scenario(sites=sites), 'sites_per_second': throughput,
+                'stages': {'sun_forecast_build': {'p50_ms': p50}}}
+    old = {'scenarios': [run(1, 10.0, 100.0)]}
+    new = {'scenarios': [run(1, 5.0, 200.0), run(2, 5.0, 200.0)]}
+    assert benchmark.compare_results(old, new) == [
+        '1 sites, 2 days: throughput x2.00; p50 sun_forecast_build x0.50']
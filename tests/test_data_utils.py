@@ -0,0 +1,96 @@
+"""Tests for the cloud analysis in data_utils."""
+###############################################################################
+# IMPORTS
+###############################################################################
+from array import array
+from datetime import date
+
+import numpy as np
+from app import forecast_builder
+from app.forecast_model import SunDay, CloudDay, DayForecast, SiteForecast
+from app.utils.data_utils import how_cloudy, dark_windows, night_cloud_stats
+from app.utils.datetime_utils import NO_EVENT_EPOCH, sun_api_time_to_epoch
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+HOUR = 3600
+# Two days of hours starting at epoch 0
+HOUR_STARTS = np.arange(48)[None, :] * float(HOUR)
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing how_cloudy() =====
+def test_how_cloudy_is_vectorised():
+    """Test each cloud cover gets the verdict for its band."""
+    verdicts = how_cloudy([0.0, 9.9, 10.0, 29.9, 30.0, np.nan])
+    assert [verdict.split()[2] for verdict in verdicts] == \
+        ['very', 'very', 'some', 'some', 'too', 'too']
+
+
+# ===== Testing dark_windows() =====
+def test_dark_windows_use_darkest_twilight():
+    """Test nautical twilight is used when astronomical twilight is missing."""
+    sun_times = np.array([
+        # A night with astronomical twilight
+        [6, 18, 5, 19, 4, 20, 3, 21],
+        # A summer night without it
+        [4, 21, 3, 22, 2, 23, 0, 0],
+        # A day the sun doesn't set
+        [0] * 8]) * HOUR
+    sun_times[sun_times == 0] = NO_EVENT_EPOCH
+    dusk, dawn = dark_windows(sun_times)
+    assert list(dusk[:2] / HOUR) == [21, 23]
+    assert list(dawn[:2] / HOUR) == [27, 26]
+    assert np.isnan(dusk[2]) and np.isnan(dawn[2])
+
+
+# ===== Testing night_cloud_stats() =====
+def test_night_stats_only_count_dark_hours():
+    """Test the daytime cloud is ignored and the clear spell is found."""
+    hourly = np.full((1, 48), 100.0)
+    hourly[0, 22:26] = 0.0
+    stats = night_cloud_stats(hourly, HOUR_STARTS, np.array([20.0 * HOUR]),
+                              np.array([28.0 * HOUR]))
+    assert stats['mean'][0] == 50.0
+    assert stats['min'][0] == 0.0
+    assert stats['clear_hours'][0] == 4
+
+
+def test_night_stats_without_dark_hours():
+    """Test a night that isn't dark gives NaN rather than warnings."""
+    stats = night_cloud_stats(np.zeros((1, 48)), HOUR_STARTS,
+                              np.array([np.nan]), np.array([np.nan]))
+    assert np.isnan(stats['mean'][0])
+    assert stats['clear_hours'][0] == 0
+
+
+# ===== Testing analyse_nights() =====
+def test_verdict_uses_the_night(monkeypatch):
+    """Test a cloudy day with a clear night is rated on the night."""
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'UTC')
+    day = date(2025, 1, 10)
+    midnight = int(np.datetime64(day, 's').astype(np.int64))
+    sun = SunDay(array('q', [midnight + hour * HOUR
+                             for hour in (8, 16, 7, 17, 6, 18, 5, 19)]))
+    hourly = [100.0] * 19 + [0.0] * 5
+    forecast = SiteForecast(lat=0.0, lng=0.0, days=[DayForecast(
+        date=day, sun=sun,
+        cloud=CloudDay(cloudcover=79.0, hourly=array('f', hourly)))])
+    forecast_builder.analyse_nights([forecast])
+    cloud = forecast.days[0].cloud
+    # Only 19:00 to midnight has a forecast, and it is clear
+    assert (cloud.night_mean, cloud.night_min, cloud.clear_hours) == \
+        (0.0, 0.0, 5)
+
+
+# ===== Testing sun_api_time_to_epoch() =====
+def test_sun_api_missing_event():
+    """Test the API's time for a missing event becomes NO_EVENT_EPOCH."""
+    assert sun_api_time_to_epoch(date(2025, 6, 21), '1:00:01 AM',
+                                 'Europe/London') == NO_EVENT_EPOCH
+    assert sun_api_time_to_epoch(date(2025, 6, 21), '1:00:00 AM',
+                                 'Europe/London') != NO_EVENT_EPOCH
@@ -0,0 +1,161 @@
+"""Tests for the forecast builders and their concurrent orchestration."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+from datetime import date, datetime, timezone
+
+import pytest
+from app import forecast_builder
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+DATES = [date(2025, 5, 18), date(2025, 5, 19)]
+DELAY = 0.2
+
+# 04:58 BST on the first date, as epoch seconds
+SUNRISE_EPOCH = int(datetime(2025, 5, 18, 3, 58,
+                             tzinfo=timezone.utc).timestamp())
+
+
+def fake_sun_api_call(**_kwargs):
+    """Stands in for sun_api_call with a fixed, slow response."""
+    time.sleep(DELAY)
+    return {'results': {'sunrise': '4:58:00 AM',
+                        'sunset': '9:02:00 PM',
+                        'solar_noon': '1:00:00 PM',
+                        'day_length': '16:04:00',
+                        'civil_twilight_begin': '4:15:00 AM',
+                        'civil_twilight_end': '9:45:00 PM',
+                        'nautical_twilight_begin': '3:11:00 AM',
+                        'nautical_twilight_end': '10:49:00 PM',
+                        'astronomical_twilight_begin': '1:00:01 AM',
+                        'astronomical_twilight_end': '1:00:01 AM'}}
+
+
+def fake_sun_range_api_call(**_kwargs):
+    """Stands in for sun_range_api_call when the range isn't supported."""
+    time.sleep(DELAY)
+
+
+def fake_lunar_cloud_api_call(**_kwargs):
+    """Stands in for lunar_cloud_api_call."""
+    time.sleep(DELAY)
+    lunar = {'days': [{'datetime': str(day),
+                       'moonphase': 0.5,
+                       'moonrise': '01:55:16',
+                       'moonset': '09:13:18'} for day in DATES]}
+    cloud = {'days': [{'datetime': str(day),
+                       'cloudcover': 5.0,
+                       'hours': [{'datetime': '00:00:00', 'cloudcover': 2.5},
+                                 {'datetime': '01:00:00', 'cloudcover': 7.5}]}
+                      for day in DATES]}
+    return lunar, cloud
+
+
+def fake_aurora_api_call(data, **_kwargs):
+    """Stands in for aurora_api_call for both data types."""
+    time.sleep(DELAY)
+    if data == 'probability':
+        return {'value': 3, 'colour': 'green'}
+    period = {'start': '2025-05-18T21:00:00+01:00',
+              'end': '2025-05-19T00:00:00+01:00',
+              'colour': 'green',
+              'value': '2'}
+    return {'values': [[period, period] for _ in DATES]}
+
+
+@pytest.fixture(name='fake_apis')
+def fixture_fake_apis(monkeypatch):
+    """Replaces every API call used by forecast_builder with a fake."""
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'Europe/London')
+    monkeypatch.setattr(forecast_builder, 'sun_api_call', fake_sun_api_call)
+    monkeypatch.setattr(forecast_builder, 'sun_range_api_call',
+                        fake_sun_range_api_call)
+    monkeypatch.setattr(forecast_builder, 'lunar_cloud_api_call',
+                        fake_lunar_cloud_api_call)
+    monkeypatch.setattr(forecast_builder, 'aurora_api_call',
+                        fake_aurora_api_call)
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing sun_forecast_build() =====
+@pytest.mark.usefixtures('fake_apis')
+def test_sun_range_request(monkeypatch):
+    """Test the range results are used and sun_api_call isn't called."""
+    def fake_range(**_kwargs):
+        return [{**fake_sun_api_call()['results'], 'date': str(day)}
+                for day in DATES]
+
+    monkeypatch.setattr(forecast_builder, 'sun_range_api_call', fake_range)
+    monkeypatch.setattr(forecast_builder, 'sun_api_call', None)
+    sun_forecast = forecast_builder.sun_forecast_build(DATES, 51.5, -0.1)
+    assert sun_forecast[0]['sunrise'] == SUNRISE_EPOCH
+    assert sun_forecast[1]['sunrise'] == SUNRISE_EPOCH + 86400
+
+
+@pytest.mark.usefixtures('fake_apis')
+def test_sun_falls_back_to_one_request_per_date():
+    """Test each date is requested when the range request fails."""
+    sun_forecast = forecast_builder.sun_forecast_build(DATES, 51.5, -0.1)
+    assert len(sun_forecast) == 2
+    assert sun_forecast[0].times.typecode == 'q'
+
+
+# ===== Testing build_forecasts() =====
+@pytest.mark.usefixtures('fake_apis')
+def test_build_forecasts_structures():
+    """Test the builders' results are combined into one SiteForecast."""
+    forecast = forecast_builder.build_forecasts('A' * 25, DATES, 51.5, -0.1)
+    assert [day.date for day in forecast.days] == DATES
+    first, second = forecast.days
+    assert first.sun['sunrise'] == SUNRISE_EPOCH
+    assert second.lunar.phase == 0.5
+    # 01:55:16 BST
+    assert second.lunar.moonrise == datetime(
+        2025, 5, 19, 0, 55, 16, tzinfo=timezone.utc).timestamp()
+    assert list(second.cloud.hourly) == [2.5, 7.5]
+    assert (forecast.aurora.probability, forecast.aurora.colour) == \
+        (3, 'green')
+    assert second.aurora[-1].kp == 2.0
+
+
+@pytest.mark.usefixtures('fake_apis')
+def test_build_forecasts_runs_concurrently():
+    """Test the total wait is close to one call rather than all six."""
+    start = time.perf_counter()
+    forecast_builder.build_forecasts('A' * 25, DATES, 51.5, -0.1)
+    assert time.perf_counter() - start < DELAY * 3.5
+
+
+@pytest.mark.usefixtures('fake_apis')
+def test_build_forecasts_without_key():
+    """Test that no Visual Crossing forecast is built for the 'xxx' key."""
+    forecast = forecast_builder.build_forecasts('xxx', DATES, 51.5, -0.1)
+    assert forecast.days[0].lunar is None
+    assert forecast.days[0].cloud is None
+
+
+@pytest.mark.usefixtures('fake_apis')
+def test_build_forecasts_with_failed_apis(monkeypatch):
+    """
+    Test a partial forecast is built when some API calls fail, with the
+    failed providers listed.
+    """
+    def fake_aurora(data, **kwargs):
+        return None if data == 'probability' else \
+            fake_aurora_api_call(data, **kwargs)
+
+    monkeypatch.setattr(forecast_builder, 'sun_api_call',
+                        lambda **_kwargs: None)
+    monkeypatch.setattr(forecast_builder, 'aurora_api_call', fake_aurora)
+    forecast = forecast_builder.build_forecasts('A' * 25, DATES, 51.5, -0.1)
+    assert forecast.failed == ['sun']
+    assert forecast.days[0].sun is None
+    assert forecast.days[0].lunar.phase == 0.5
+    assert forecast.aurora is None
+    assert forecast.days[1].aurora[-1].kp == 2.0
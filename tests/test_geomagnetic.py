@@ -0,0 +1,96 @@
+"""Tests for the offline aurora visibility model and the local aurora mode."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import numpy as np
+import pytest
+from app import forecast_builder
+from app.apis import auroraslive_api
+from app.ephemeris.geomagnetic import geomagnetic_latitude, \
+    aurora_probability, aurora_colour
+from tests.test_forecast_builder import DATES, fake_aurora_api_call
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing geomagnetic_latitude() =====
+@pytest.mark.parametrize('lat, lng, expected', [
+    (80.65, -72.68, 90.0),      # The geomagnetic pole
+    (51.5, -0.1, 53.4),         # London
+    (64.8, -147.7, 65.6),       # Fairbanks
+    ])
+def test_geomagnetic_latitude(lat, lng, expected):
+    """Test known locations to within a tenth of a degree."""
+    assert geomagnetic_latitude(lat, lng) == pytest.approx(expected, abs=0.1)
+
+
+def test_geomagnetic_latitude_is_vectorised():
+    """Test arrays of locations give an array of latitudes."""
+    lats = geomagnetic_latitude(np.array([51.5, 64.8]),
+                                np.array([-0.1, -147.7]))
+    assert lats.shape == (2,)
+
+
+# ===== Testing aurora_probability() =====
+def test_probability_rises_with_kp():
+    """Test a mid-latitude site becomes more likely to see the aurora."""
+    probability = aurora_probability(53.4, np.arange(10))
+    assert np.all(np.diff(probability) > 0)
+    assert probability[0] < 1 and probability[-1] > 90
+
+
+def test_probability_is_the_same_in_both_hemispheres():
+    """Test the southern hemisphere mirrors the northern one."""
+    assert aurora_probability(-60.0, 4) == aurora_probability(60.0, 4)
+
+
+# ===== Testing aurora_colour() =====
+def test_colour_thresholds():
+    """Test each probability maps to the auroras.live colour."""
+    assert list(aurora_colour([5, 15, 35, 70])) == \
+        ['green', 'yellow', 'amber', 'red']
+
+
+# ===== Testing aurora_threeday_call() =====
+def test_threeday_fetched_once(monkeypatch):
+    """Test repeated calls share a single three-day request."""
+    calls = []
+
+    def fake_call(**kwargs):
+        calls.append(kwargs)
+        return fake_aurora_api_call(**kwargs)
+
+    monkeypatch.setattr(auroraslive_api, 'aurora_api_call', fake_call)
+    monkeypatch.setattr(auroraslive_api, '_THREEDAY',
+                        {'response': None, 'expires_at': 0.0})
+    for _ in range(3):
+        assert auroraslive_api.aurora_threeday_call()['values']
+    assert len(calls) == 1
+
+
+# ===== Testing aurora_geomagnetic_estimate() =====
+def test_geomagnetic_backend_only_estimates_probability(monkeypatch):
+    """Test the offline backend answers for the probability only."""
+    monkeypatch.setattr(auroraslive_api, 'aurora_threeday_call',
+                        lambda: fake_aurora_api_call('threeday'))
+    estimate = auroraslive_api.aurora_geomagnetic_estimate(
+        lat=64.8, lng=-147.7, data='probability')
+    assert estimate['colour'] == 'red'
+    assert auroraslive_api.aurora_geomagnetic_estimate(
+        lat=64.8, lng=-147.7, data='threeday') is None
+
+
+# ===== Testing aurora_forecast_build() =====
+def test_local_mode_makes_no_site_requests(monkeypatch):
+    """Test the local mode estimates probability without per-site calls."""
+    monkeypatch.setattr(forecast_builder, 'AURORA_MODE', 'local')
+    monkeypatch.setattr(forecast_builder, 'aurora_api_call', None)
+    monkeypatch.setattr(forecast_builder, 'aurora_threeday_call',
+                        lambda: fake_aurora_api_call('threeday'))
+    aurora_prob, aurora_3day = forecast_builder.aurora_forecast_build(
+        DATES, 64.8, -147.7)
+    # Kp 2 at Fairbanks puts it inside the edge of the visible aurora
+    assert aurora_prob.colour == 'red'
+    assert 50 < aurora_prob.probability < 100
+    assert list(aurora_3day) == DATES
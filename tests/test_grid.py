@@ -0,0 +1,117 @@
+"""Tests for the grid search."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import csv
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from app import grid
+from app.forecast_model import SunDay, CloudDay
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+HOUR = 3600
+
+
+@pytest.fixture(name='fetches')
+def fixture_fetches(monkeypatch):
+    """
+    Replaces the process pool with threads and the builders with fakes, and
+    returns the list of cells the cloud builder was called for. The cloud
+    cover is 0% at 50N and rises by 10% per degree north, and the aurora
+    builder fails.
+    """
+    calls = []
+
+    def fake_sun(dates):
+        midnights = [int(np.datetime64(day, 's').astype(np.int64))
+                     for day in dates]
+        return [SunDay(array('q', [midnight + hour * HOUR for hour in
+                                   (8, 16, 7, 17, 6, 18, 5, 19)]))
+                for midnight in midnights]
+
+    def fake_vc(dates, lat):
+        cover = (lat - 50.0) * 10.0
+        return None, [CloudDay(cloudcover=cover,
+                               hourly=array('f', [cover] * 24))
+                      for _ in dates]
+
+    def fake_build_provider(provider, _key, dates, lat, lng):
+        if provider == 'sun':
+            return fake_sun(dates), []
+        if provider == 'visualcrossing':
+            calls.append((lat, lng))
+            return fake_vc(dates, lat), []
+        return None, ['aurora']
+
+    monkeypatch.setattr(grid, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(grid, 'build_provider', fake_build_provider)
+    return calls
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing grid_axes() and parse_bbox() =====
+def test_grid_axes_include_the_edges():
+    """Test the lattice covers the whole box at the resolution."""
+    lats, lngs = grid.grid_axes(grid.parse_bbox('50,-1,51,0.5'), 0.25)
+    assert lats.tolist() == [50.0, 50.25, 50.5, 50.75, 51.0]
+    assert lngs.tolist() == [-1.0, -0.75, -0.5, -0.25, 0.0, 0.25, 0.5]
+
+
+def test_invalid_bbox():
+    """Test boxes out of range or inside out are rejected."""
+    for value in ('50,-1,95,0', '51,-1,50,0', '50,-1,51'):
+        with pytest.raises(ValueError):
+            grid.parse_bbox(value)
+
+
+def test_bbox_around_is_wider_than_tall_away_from_equator():
+    """Test a 200 km circle spans more degrees of longitude at 60N."""
+    south, west, north, east = grid.bbox_around(60.0, 10.0, 200.0)
+    assert np.isclose(north - south, 2 * 200 / 111.32)
+    assert np.isclose(east - west, 2 * (north - south), rtol=1e-3)
+
+
+# ===== Testing provider_cells() =====
+def test_nearby_points_share_cells(monkeypatch):
+    """Test points are snapped to each provider's own resolution."""
+    monkeypatch.setitem(grid.GRID_RESOLUTIONS, 'sun', 0.5)
+    monkeypatch.setitem(grid.GRID_RESOLUTIONS, 'aurora', 1.0)
+    lats = np.array([50.0, 50.1, 50.4, 51.0])
+    lngs = np.zeros(4)
+    cells = grid.provider_cells(lats, lngs)
+    assert cells['sun'][0].tolist() == [[50.0, 0.0], [50.5, 0.0],
+                                        [51.0, 0.0]]
+    assert cells['sun'][1].tolist() == [0, 0, 1, 2]
+    assert len(cells['aurora'][0]) == 2
+
+
+# ===== Testing run_grid() =====
+def test_run_grid_ranks_the_clearest_point_first(fetches, tmp_path):
+    """Test the ranking, the raster and the shared cloud fetches."""
+    summary = grid.run_grid((50.0, 0.0, 51.0, 0.1), 0.05,
+                            str(tmp_path / 'out.csv'))
+    assert summary['points'] == 21 * 3
+    # The cloud cover is fetched once per 0.1 degree cell
+    assert len(fetches) == 11 * 2
+    assert summary['best']['lat'] == 50.0
+
+    with open(tmp_path / 'out_ranking.csv', encoding='utf-8') as file:
+        ranking = list(csv.DictReader(file))
+    assert len(ranking) == 63
+    assert float(ranking[0]['lat']) == 50.0
+    assert ranking[0]['failed'] == 'aurora'
+    assert float(ranking[-1]['window_score'] or 0) <= \
+        float(ranking[0]['window_score'])
+
+    raster = np.load(tmp_path / 'out.npz')
+    assert raster['peak_score'].shape == (21, 3)
+    assert raster['peak_score'][0, 0] > raster['peak_score'][-1, 0]
+    assert (tmp_path / 'out_raster.csv').exists()
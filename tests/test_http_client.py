@@ -0,0 +1,187 @@
+"""Tests for the shared HTTP client."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import time
+from threading import Event
+
+import pytest
+import requests
+from apis import resilience
+from app.apis import http_client
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+class FakeResponse:
+    """Minimal stand-in for requests.Response."""
+    def __init__(self, status_code: int, body: dict | None = None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+        self.content = json.dumps(body).encode()
+
+    def raise_for_status(self):
+        """Raises HTTPError for 4xx and 5xx status codes."""
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+    def json(self):
+        """Returns the stored body."""
+        return self.body
+
+
+class FakeSession:  # pylint: disable=too-few-public-methods
+    """
+    Session whose get either returns a response or raises an error. A list
+    of outcomes is used one per call.
+    """
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = []
+
+    def get(self, url, params, timeout):
+        """Records the call and returns or raises the outcome."""
+        self.calls.append((url, params, timeout))
+        outcome = self.outcome.pop(0) if isinstance(self.outcome, list) \
+            else self.outcome
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture(autouse=True, name='no_waiting')
+def fixture_no_waiting(monkeypatch):
+    """
+    Closes every circuit and makes retries wait no time, returning the list
+    of attempts retried after.
+    """
+    resilience.reset_breakers()
+    retried = []
+    monkeypatch.setattr(http_client, 'backoff_delay',
+                        lambda attempt: retried.append(attempt) or 0.0)
+    yield retried
+    resilience.reset_breakers()
+
+
+@pytest.fixture(name='use_session')
+def fixture_use_session(monkeypatch):
+    """Returns a function that installs a FakeSession for get_json."""
+    def install(outcome):
+        session = FakeSession(outcome)
+        monkeypatch.setattr(http_client, 'get_session', lambda: session)
+        return session
+    return install
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing get_session() =====
+def test_session_is_shared():
+    """Test the same pooled session is returned on every call."""
+    session = http_client.get_session()
+    assert session is http_client.get_session()
+    adapter = session.get_adapter('https://api.auroras.live/v1/')
+    assert adapter._pool_maxsize == http_client.POOL_MAXSIZE  # pylint: disable=protected-access
+    assert 'gzip' in session.headers['Accept-Encoding']
+
+
+# ===== Testing get_json() =====
+def test_get_json_success(use_session):
+    """Test a 200 response returns the JSON body and uses the timeouts."""
+    session = use_session(FakeResponse(200, {'value': 3}))
+    assert http_client.get_json('https://x', {'a': 1}, 'x') == {'value': 3}
+    assert session.calls[0][2] == (http_client.CONNECT_TIMEOUT,
+                                   http_client.READ_TIMEOUT)
+
+
+@pytest.mark.parametrize('error', [
+    requests.exceptions.Timeout(),
+    requests.exceptions.ConnectionError(),
+    requests.exceptions.RequestException(),
+    ])
+def test_get_json_request_errors(use_session, error, capsys):
+    """Test request errors return None and print an error message."""
+    use_session(error)
+    assert http_client.get_json('https://x', {}, 'x.org') is None
+    assert 'An error occurred trying to call x.org' in capsys.readouterr().out
+
+
+def test_get_json_status_message(use_session, capsys):
+    """Test a status code message is printed for a matching error code."""
+    use_session(FakeResponse(401))
+    assert http_client.get_json('https://x', {}, 'x.org',
+                                {401: 'Bad key'}) is None
+    assert 'Bad key' in capsys.readouterr().out
+
+
+def test_get_json_retries_then_succeeds(use_session, no_waiting,
+                                        monkeypatch):
+    """Test timeouts and 5xx responses are retried after a backoff."""
+    monkeypatch.setattr(http_client, 'RETRY_ATTEMPTS', 3)
+    session = use_session([requests.exceptions.Timeout(), FakeResponse(503),
+                           FakeResponse(200, {'value': 3})])
+    assert http_client.get_json('https://x', {}, 'x.org') == {'value': 3}
+    assert len(session.calls) == 3
+    assert no_waiting == [0, 1]
+
+
+def test_get_json_does_not_retry_client_errors(use_session, monkeypatch):
+    """Test a 4xx response, e.g. a bad API key, is not retried."""
+    monkeypatch.setattr(http_client, 'RETRY_ATTEMPTS', 3)
+    session = use_session(FakeResponse(401))
+    assert http_client.get_json('https://x', {}, 'x.org') is None
+    assert len(session.calls) == 1
+
+
+def test_get_json_invalid_json_fails_the_trial(use_session, monkeypatch):
+    """Test a body that isn't JSON opens a half open circuit again."""
+    breaker = resilience.CircuitBreaker('x', threshold=1, cooldown=0)
+    breaker.failure()
+    monkeypatch.setattr(http_client, 'breaker_for', lambda provider: breaker)
+    response = FakeResponse(200)
+    monkeypatch.setattr(response, 'json', lambda: json.loads('<html>'))
+    use_session(response)
+    assert http_client.get_json('https://x', {}, 'x.org') is None
+    assert breaker.opened_at is not None and not breaker.trial
+
+
+def test_get_json_skips_open_circuit(use_session, monkeypatch):
+    """Test no request is made once the provider's circuit is open."""
+    breaker = resilience.CircuitBreaker('x', threshold=2, cooldown=60)
+    monkeypatch.setattr(http_client, 'breaker_for', lambda provider: breaker)
+    monkeypatch.setattr(http_client, 'RETRY_ATTEMPTS', 1)
+    session = use_session(requests.exceptions.ConnectionError())
+    for _ in range(3):
+        assert http_client.get_json('https://x', {}, 'x.org') is None
+    assert len(session.calls) == 2
+
+
+def test_get_json_keeps_to_the_deadline(use_session):
+    """
+    Test the timeouts are cut to the deadline, and no request is made once
+    it has passed.
+    """
+    session = use_session(FakeResponse(200, {'value': 3}))
+    with resilience.deadline(1):
+        http_client.get_json('https://x', {}, 'x.org')
+    assert max(session.calls[0][2]) <= 1
+    with resilience.deadline(0.001):
+        time.sleep(0.002)
+        assert http_client.get_json('https://x', {}, 'x.org') is None
+    assert len(session.calls) == 1
+
+
+def test_get_json_stops_when_cancelled(use_session):
+    """Test no request is made once the call has been cancelled."""
+    session = use_session(FakeResponse(200, {'value': 3}))
+    cancel = Event()
+    call = resilience.cancellable(
+        lambda: http_client.get_json('https://x', {}, 'x.org'), cancel)
+    assert call() == {'value': 3}
+    cancel.set()
+    assert call() is None
+    assert len(session.calls) == 1
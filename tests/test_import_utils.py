@@ -0,0 +1,62 @@
+"""Tests for the lazy and background imports."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import sys
+
+import pytest
+from app.utils import import_utils
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(name='module_name')
+def fixture_module_name(tmp_path, monkeypatch):
+    """
+    Writes a module that leaves a marker file when it is run and returns its
+    name.
+    """
+    (tmp_path / 'lazy_example.py').write_text(
+        'open(__file__ + ".ran", "w", encoding="utf-8").close()\n'
+        'VALUE = 42\n', encoding='utf-8')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazy_example', raising=False)
+    yield 'lazy_example'
+    sys.modules.pop('lazy_example', None)
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing lazy_import() =====
+def test_module_runs_on_first_use(module_name, tmp_path):
+    """Test a lazy module is only run when an attribute is first used."""
+    marker = tmp_path / 'lazy_example.py.ran'
+    module = import_utils.lazy_import(module_name)
+    assert not marker.exists()
+    assert module.VALUE == 42
+    assert marker.exists()
+    assert sys.modules[module_name].VALUE == 42
+
+
+def test_imported_module_is_returned():
+    """Test a module that has already been imported is returned as it is."""
+    assert import_utils.lazy_import('json') is json
+
+
+def test_missing_module_raises():
+    """Test a module that can't be found raises ModuleNotFoundError."""
+    with pytest.raises(ModuleNotFoundError):
+        import_utils.lazy_import('no_such_module_here')
+
+
+# ===== Testing preload() =====
+def test_preload_runs_lazy_modules(module_name, tmp_path):
+    """Test preload runs the lazy modules on a background thread."""
+    module = import_utils.lazy_import(module_name)
+    seconds = import_utils.preload((module_name,)).result(timeout=5)
+    assert seconds >= 0
+    assert (tmp_path / 'lazy_example.py.ran').exists()
+    assert module.VALUE == 42
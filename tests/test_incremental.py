@@ -0,0 +1,185 @@
+"""Tests for the incremental builds that only refetch stale forecast parts."""
+###############################################################################
+# IMPORTS
+###############################################################################
+from array import array
+from datetime import date
+
+import pytest
+from forecast_model import SunDay, LunarDay, CloudDay, AuroraPeriod, \
+    AuroraTonight
+from app import incremental
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+DATES = [date(2025, 5, 18), date(2025, 5, 19), date(2025, 5, 20)]
+
+
+@pytest.fixture(name='calls')
+def fixture_calls(tmp_path, monkeypatch):
+    """
+    Replaces the builders with fakes that record the dates they were asked
+    for, and keeps the state in a temporary file.
+    """
+    calls = []
+
+    def fake_sun(dates, *_args):
+        calls.append(('sun', dates))
+        return [SunDay(array('q', [day.toordinal()] * 8)) for day in dates]
+
+    def fake_vc(_key, dates, *_args):
+        calls.append(('visualcrossing', dates))
+        return ([LunarDay(0.5, None, None) for _ in dates],
+                [CloudDay(10.0, array('f', [10.0] * 24)) for _ in dates])
+
+    def fake_aurora(dates, *_args):
+        calls.append(('aurora', dates))
+        return AuroraTonight(5, 'green'), {
+            day: (AuroraPeriod(0, 3600, 'green', 2.0),) for day in dates}
+
+    monkeypatch.setattr(incremental, 'INCREMENTAL_STATE_PATH',
+                        str(tmp_path / 'state.json'))
+    monkeypatch.setattr(incremental, 'sun_forecast_build', fake_sun)
+    monkeypatch.setattr(incremental, 'vc_forecast_build', fake_vc)
+    monkeypatch.setattr(incremental, 'aurora_forecast_build', fake_aurora)
+    monkeypatch.setattr(incremental, 'analyse_nights', lambda forecasts: None)
+    return calls
+
+
+def build(monkeypatch, dates, now, **kwargs):
+    """Runs build_incremental for London as if the epoch time were now."""
+    monkeypatch.setattr(incremental.time, 'time', lambda: now)
+    return incremental.build_incremental('key', dates, 51.5, -0.1, **kwargs)
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing build_incremental() =====
+def test_first_build_fetches_everything(calls, monkeypatch):
+    """Test every part is built when nothing is saved."""
+    forecast = build(monkeypatch, DATES, 1000.0)
+    assert calls == [('sun', DATES), ('visualcrossing', DATES),
+                     ('aurora', DATES)]
+    assert [day.sun.times[0] for day in forecast.days] == \
+        [day.toordinal() for day in DATES]
+    assert forecast.aurora == AuroraTonight(5, 'green')
+    assert forecast.days[2].cloud.hourly == array('f', [10.0] * 24)
+    assert not forecast.failed
+
+
+def test_fresh_parts_are_reused(calls, monkeypatch):
+    """Test a second run within the max ages makes no calls."""
+    first = build(monkeypatch, DATES, 1000.0)
+    calls.clear()
+    second = build(monkeypatch, DATES, 1000.0 + 900)
+    assert not calls
+    assert [day.sun.times for day in second.days] == \
+        [day.sun.times for day in first.days]
+    assert second.days[0].aurora == (AuroraPeriod(0, 3600, 'green', 2.0),)
+
+
+def test_stale_aurora_and_cloud_are_refetched(calls, monkeypatch):
+    """Test only the parts older than their max age are fetched again."""
+    monkeypatch.setattr(incremental, 'AURORA_MAX_AGE', 1800)
+    monkeypatch.setattr(incremental, 'CLOUD_MAX_AGE', 3600)
+    build(monkeypatch, DATES, 1000.0)
+    calls.clear()
+    build(monkeypatch, DATES, 1000.0 + 2000)
+    assert calls == [('aurora', DATES)]
+    calls.clear()
+    build(monkeypatch, DATES, 1000.0 + 3700)
+    assert calls == [('visualcrossing', DATES)]
+
+
+def test_rolling_horizon_only_fetches_new_dates(calls, monkeypatch):
+    """Test the sun is only fetched for the date added to the horizon."""
+    build(monkeypatch, DATES, 1000.0)
+    calls.clear()
+    later = DATES[1:] + [date(2025, 5, 21)]
+    forecast = build(monkeypatch, later, 1100.0)
+    assert ('sun', [date(2025, 5, 21)]) in calls
+    assert ('visualcrossing', [date(2025, 5, 21)]) in calls
+    # The aurora forecast starts from today, so a new day fetches it again
+    assert ('aurora', later) in calls
+    assert [day.date for day in forecast.days] == later
+
+
+def test_failed_refetch_keeps_the_older_part(calls, monkeypatch):
+    """Test a stale part is kept, and not failed, if its refetch fails."""
+    build(monkeypatch, DATES, 1000.0)
+    monkeypatch.setattr(incremental, 'aurora_forecast_build',
+                        lambda *args: calls.append('failed'))
+    forecast = build(monkeypatch, DATES, 1000.0 + 10000)
+    assert 'failed' in calls
+    assert forecast.aurora == AuroraTonight(5, 'green')
+    assert not forecast.failed
+
+
+def test_half_failed_aurora_keeps_the_older_part(calls, monkeypatch):
+    """Test periods are kept, and fetched again, if only they failed."""
+    monkeypatch.setattr(incremental, 'AURORA_MAX_AGE', 1800)
+    build(monkeypatch, DATES, 1000.0)
+    monkeypatch.setattr(incremental, 'aurora_forecast_build',
+                        lambda dates, *args: calls.append(('aurora', dates))
+                        or (AuroraTonight(40, 'red'), {}))
+    calls.clear()
+    forecast = build(monkeypatch, DATES, 1000.0 + 2000)
+    assert calls == [('aurora', DATES)]
+    assert forecast.aurora == AuroraTonight(40, 'red')
+    assert forecast.days[0].aurora == (AuroraPeriod(0, 3600, 'green', 2.0),)
+    # Tonight's probability is fresh, but the kept periods are stale
+    calls.clear()
+    build(monkeypatch, DATES, 1000.0 + 2100)
+    assert calls == [('aurora', DATES)]
+
+
+def test_longer_forecast_fetches_the_missing_aurora_dates(calls, monkeypatch):
+    """Test a fresh aurora forecast for fewer dates is fetched again."""
+    build(monkeypatch, DATES[:1], 1000.0)
+    calls.clear()
+    forecast = build(monkeypatch, DATES, 1000.0 + 60)
+    assert ('aurora', DATES) in calls
+    assert all(day.aurora for day in forecast.days)
+
+
+def test_failed_first_build_is_listed(calls, monkeypatch):
+    """Test a provider with nothing saved is failed if its build fails."""
+    monkeypatch.setattr(incremental, 'sun_forecast_build',
+                        lambda *args: None)
+    forecast = build(monkeypatch, DATES, 1000.0)
+    assert forecast.failed == ['sun']
+    assert calls == [('visualcrossing', DATES), ('aurora', DATES)]
+
+
+def test_other_location_and_full_start_again(calls, monkeypatch):
+    """Test the state is ignored for another location or a full build."""
+    build(monkeypatch, DATES, 1000.0)
+    calls.clear()
+    build(monkeypatch, DATES, 1100.0, full=True)
+    assert len(calls) == 3
+    calls.clear()
+    incremental.build_incremental('key', DATES, 55.9, -3.2)
+    assert ('sun', DATES) in calls
+
+
+def test_other_backend_or_key_start_again(calls, monkeypatch):
+    """Test the state is ignored once a backend or the API key changes."""
+    build(monkeypatch, DATES, 1000.0)
+    calls.clear()
+    incremental.build_incremental('other key', DATES, 51.5, -0.1)
+    assert len(calls) == 3
+    calls.clear()
+    monkeypatch.setattr(incremental, 'LUNAR_BACKEND', 'local')
+    build(monkeypatch, DATES, 1100.0)
+    assert len(calls) == 3
+
+
+def test_unreadable_state_is_ignored(tmp_path):
+    """Test a corrupt state file gives an empty state."""
+    path = tmp_path / 'state.json'
+    path.write_text('{not json', encoding='utf-8')
+    assert incremental.load_state(51.5, -0.1, 'key', str(path)) == \
+        incremental.empty_state(51.5, -0.1, 'key')
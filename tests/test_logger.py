@@ -0,0 +1,94 @@
+"""Tests for the shared queue logging."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import logging
+import os
+import sys
+
+import logger
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+def make_record(level: int, msg: str, *args, exc_info=None):
+    """Returns a LogRecord from the test logger."""
+    return logging.LogRecord('test', level, __file__, 1, msg, args, exc_info)
+
+
+def error_info() -> tuple:
+    """Returns the exc_info of a raised ValueError."""
+    try:
+        raise ValueError('bad')
+    except ValueError:
+        return sys.exc_info()
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing logging_setup() =====
+def test_loggers_share_one_handler():
+    """Test every logger uses the one queue handler and listener."""
+    first = logger.logging_setup('test_first')
+    second = logger.logging_setup('test_second')
+    assert first.handlers == second.handlers == [logger.shared_handler]
+    assert logger.listener.queue is logger.shared_handler.queue
+    assert not first.propagate
+
+
+# ===== Testing SharedQueueHandler =====
+def test_prepare_merges_args_before_they_change():
+    """Test the message is fixed when it is queued, not when written."""
+    payload = {'cloud': 10}
+    record = logger.shared_handler.prepare(
+        make_record(logging.DEBUG, 'payload is %s', payload))
+    payload['cloud'] = 90
+    assert record.msg == "payload is {'cloud': 10}"
+    assert record.args is None
+
+
+def test_prepare_formats_the_traceback():
+    """Test a traceback is kept as text so the record can be queued."""
+    record = logger.shared_handler.prepare(
+        make_record(logging.ERROR, 'failed', exc_info=error_info()))
+    assert record.exc_info is None
+    assert 'ValueError: bad' in record.exc_text
+
+
+def test_forked_child_writes_its_own_file(tmp_path, monkeypatch):
+    """Test a child process never writes or rotates the parent's log."""
+    monkeypatch.setattr(logger, 'log_path', str(tmp_path / 'app.log'))
+    monkeypatch.setattr(logger.shared_handler, 'direct', None)
+    logger.write_directly()
+    logger.shared_handler.emit(make_record(logging.ERROR, 'from child'))
+    logger.shared_handler.direct.close()
+    child_log = tmp_path / f'app.log.{os.getpid()}'
+    assert child_log.stat().st_size > 0
+    assert not (tmp_path / 'app.log').exists()
+
+
+# ===== Testing SampleFilter =====
+def test_debug_records_are_sampled_per_message():
+    """Test the first and every Nth DEBUG record of a message are kept."""
+    sample = logger.SampleFilter(every=3)
+    kept = [sample.filter(make_record(logging.DEBUG, 'payload %s', n))
+            for n in range(7)]
+    assert kept == [True, False, False, True, False, False, True]
+    assert sample.filter(make_record(logging.DEBUG, 'other'))
+    assert all(sample.filter(make_record(logging.INFO, 'payload %s', n))
+               for n in range(3))
+
+
+# ===== Testing JsonFormatter =====
+def test_json_formatter():
+    """Test a record is written as one JSON line with its traceback."""
+    record = make_record(logging.ERROR, 'failed %s', 'call',
+                         exc_info=error_info())
+    entry = json.loads(logger.JsonFormatter().format(record))
+    assert entry['level'] == 'ERROR'
+    assert entry['logger'] == 'test'
+    assert entry['message'] == 'failed call'
+    assert 'ValueError: bad' in entry['exception']
@@ -0,0 +1,80 @@
+"""Tests for the offline lunar ephemeris engine."""
+###############################################################################
+# IMPORTS
+###############################################################################
+from datetime import date
+
+import numpy as np
+import pytest
+from app import forecast_builder
+from app.ephemeris.lunar import lunar_events, moon_altitude
+from app.ephemeris.solar import UNIX_EPOCH_JD
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing lunar_events() =====
+@pytest.mark.parametrize('day, expected_phase', [
+    ('2025-05-04', 0.25),   # First quarter, 13:52 UTC
+    ('2025-05-12', 0.5),    # Full moon, 16:56 UTC
+    ('2025-05-20', 0.75),   # Last quarter, 11:59 UTC
+    ('2025-05-27', 0.0),    # New moon, 03:02 UTC
+    ])
+def test_principal_phases(day, expected_phase):
+    """Test the day of each principal phase is given exactly that phase."""
+    events = lunar_events(np.datetime64(day), 51.5, -0.1, 'Europe/London')
+    assert events['moonphase'] == expected_phase
+
+
+def test_illumination_follows_phase():
+    """Test the moon is fully lit when full and dark when new."""
+    events = lunar_events(np.array(['2025-05-12', '2025-05-27'],
+                                   dtype='datetime64[D]'),
+                          51.5, -0.1, 'Europe/London')
+    assert events['illumination'][0] > 0.98
+    assert events['illumination'][1] < 0.02
+
+
+def test_rise_and_set_are_at_the_horizon():
+    """Test the moon's altitude at rise and set is the standard altitude."""
+    dates = np.arange('2025-05-01', '2025-05-08',
+                      dtype='datetime64[D]')[:, None]
+    lats, lngs = np.array([51.5, -33.9]), np.array([-0.1, 151.2])
+    events = lunar_events(dates, lats, lngs, 'UTC')
+    assert events['moonrise'].shape == (7, 2)
+    for name in ('moonrise', 'moonset'):
+        found = ~np.isnan(events[name])
+        altitude, parallax = moon_altitude(
+            events[name] / 86400.0 + UNIX_EPOCH_JD, lats, lngs)
+        height = altitude - (0.7275 * parallax - 0.5667)
+        assert np.all(np.abs(height[found]) < 0.1)
+
+
+# ===== Testing vc_forecast_build() with the local backend =====
+def test_local_lunar_without_api_key(monkeypatch):
+    """Test a lunar forecast is given without a key and cloud is None."""
+    monkeypatch.setattr(forecast_builder, 'LUNAR_BACKEND', 'local')
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'Europe/London')
+    lunar_forecast, cloud_forecast = forecast_builder.vc_forecast_build(
+        'xxx', [date(2025, 5, 12), date(2025, 5, 15)], 51.5, -0.1)
+    assert cloud_forecast is None
+    assert lunar_forecast[0].phase == 0.5
+    assert isinstance(lunar_forecast[0].moonset, int)
+    # The moon doesn't rise in London on 2025-05-15
+    assert lunar_forecast[1].moonrise is None
+
+
+def test_local_lunar_is_kept_when_the_cloud_call_fails(monkeypatch):
+    """Test a failed cloud call keeps the offline lunar forecast."""
+    monkeypatch.setattr(forecast_builder, 'LUNAR_BACKEND', 'local')
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'Europe/London')
+    monkeypatch.setattr(forecast_builder, 'cloud_api_call',
+                        lambda **kwargs: None)
+    result = forecast_builder.vc_forecast_build(
+        'key', [date(2025, 5, 12)], 51.5, -0.1)
+    assert result[0][0].phase == 0.5
+    assert result[1] is None
+    assert forecast_builder.failed_parts('visualcrossing', result,
+                                         'key') == ['cloud']
+    assert not forecast_builder.failed_parts('visualcrossing', result, 'xxx')
@@ -0,0 +1,128 @@
+"""Tests for the API and stage metrics."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import pytest
+import requests
+import metrics
+from apis import resilience
+from app.apis import http_client
+from tests.test_http_client import FakeResponse, FakeSession
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(autouse=True, name='registry')
+def fixture_registry():
+    """Returns the shared registry, cleared before and after each test."""
+    metrics.registry.reset()
+    yield metrics.registry
+    metrics.registry.reset()
+
+
+@pytest.fixture(autouse=True)
+def fixture_no_waiting(monkeypatch):
+    """Closes every circuit and makes three tries that wait no time."""
+    resilience.reset_breakers()
+    monkeypatch.setattr(http_client, 'backoff_delay', lambda attempt: 0.0)
+    monkeypatch.setattr(http_client, 'RETRY_ATTEMPTS', 3)
+    yield
+    resilience.reset_breakers()
+
+
+@pytest.fixture(name='call_api')
+def fixture_call_api(monkeypatch):
+    """
+    Returns a function that calls get_json as provider with a FakeSession
+    giving outcome.
+    """
+    def call(provider, outcome):
+        session = FakeSession(outcome)
+        monkeypatch.setattr(http_client, 'get_session', lambda: session)
+        return metrics.api_call(provider)(http_client.get_json)(
+            'https://x', {}, 'x.org')
+    return call
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing Registry =====
+def test_render_counters_and_histograms(registry):
+    """Test the Prometheus text format of a counter and a histogram."""
+    registry.inc('stargazer_api_retries_total', {'provider': 'sun'}, 2)
+    registry.observe('stargazer_stage_seconds', {'stage': 'build'}, 0.2)
+    lines = registry.render().splitlines()
+    assert '# TYPE stargazer_api_retries_total counter' in lines
+    assert 'stargazer_api_retries_total{provider="sun"} 2' in lines
+    assert 'stargazer_stage_seconds_bucket{stage="build",le="0.1"} 0' in lines
+    assert 'stargazer_stage_seconds_bucket{stage="build",le="0.25"} 1' \
+        in lines
+    assert 'stargazer_stage_seconds_bucket{stage="build",le="+Inf"} 1' \
+        in lines
+    assert 'stargazer_stage_seconds_count{stage="build"} 1' in lines
+
+
+def test_format_labels_escapes_values():
+    """Test quotes and backslashes in label values are escaped."""
+    assert metrics.format_labels((('error', 'a"b\\c'),)) == \
+        '{error="a\\"b\\\\c"}'
+
+
+# ===== Testing api_call() and get_json() =====
+def test_requests_are_labelled_by_provider(call_api, registry):
+    """Test a successful request is counted for the decorated provider."""
+    assert call_api('sun', FakeResponse(200, {'value': 3})) == {'value': 3}
+    counters = registry.counters
+    assert counters['stargazer_api_requests_total',
+                    (('outcome', 'ok'), ('provider', 'sun'))] == 1
+    assert counters['stargazer_api_response_bytes_total',
+                    (('provider', 'sun'),)] == len(b'{"value": 3}')
+
+
+@pytest.mark.parametrize('outcome, error, attempts', [
+    (requests.exceptions.Timeout(), 'Timeout', 3),
+    (requests.exceptions.ConnectionError(), 'ConnectionError', 3),
+    (FakeResponse(503), 'HTTP 503', 3),
+    (FakeResponse(204), 'HTTP 204', 1),
+    ])
+def test_errors_are_classified(call_api, registry, outcome, error, attempts):
+    """
+    Test each failed request is counted with its class of error, and each
+    retry is counted.
+    """
+    assert call_api('aurora', outcome) is None
+    assert registry.counters['stargazer_api_errors_total',
+                             (('error', error), ('provider', 'aurora'))] == \
+        attempts
+    assert registry.counters['stargazer_api_retries_total',
+                             (('provider', 'aurora'),)] == attempts - 1
+
+
+# ===== Testing run_summary() =====
+def test_run_summary_shares_the_request_time(registry):
+    """Test each provider's share of the request time and cache hits."""
+    for provider, seconds in (('sun', 0.1), ('visualcrossing', 0.3),
+                              ('visualcrossing', 0.6)):
+        metrics.api_call(provider)(metrics.record_request)(seconds, 10)
+    metrics.api_call('sun')(metrics.record_cache)(True)
+    metrics.api_call('sun')(metrics.record_cache)(False)
+    registry.observe('stargazer_stage_seconds', {'stage': 'build'}, 1.5)
+    summary = metrics.run_summary()
+    assert summary['providers']['sun']['share'] == 0.1
+    assert summary['providers']['sun']['cache_hits'] == 1
+    assert summary['providers']['sun']['cache_misses'] == 1
+    assert summary['providers']['visualcrossing']['requests'] == 2
+    assert summary['providers']['visualcrossing']['mean_ms'] == 450.0
+    assert summary['stages'] == {'build': 1.5}
+
+
+# ===== Testing write_textfile() =====
+def test_write_textfile(tmp_path, registry):
+    """Test the rendered metrics are written without the temporary file."""
+    registry.inc('stargazer_api_retries_total', {'provider': 'sun'})
+    path = tmp_path / 'textfile' / 'stargazer.prom'
+    metrics.write_textfile(str(path))
+    assert path.read_text(encoding='utf-8') == registry.render()
+    assert [item.name for item in path.parent.iterdir()] == ['stargazer.prom']
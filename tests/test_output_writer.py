@@ -0,0 +1,184 @@
+"""Tests for the forecast writers."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import csv
+import json
+from array import array
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+from app import output_writer
+from app.ephemeris.solar import EVENT_NAMES
+from app.forecast_model import SunDay, LunarDay, CloudDay, AuroraPeriod, \
+    AuroraTonight, DayForecast, SiteForecast
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+TODAY = date(2025, 5, 18)
+DATES = [TODAY, date(2025, 5, 19)]
+
+
+class FixedDate(date):
+    """A date whose today is TODAY."""
+
+    @classmethod
+    def today(cls):
+        return TODAY
+
+
+def london(day: date, hour: int, minute: int) -> int:
+    """Returns a Europe/London clock time on day as epoch seconds."""
+    return int(datetime(day.year, day.month, day.day, hour, minute,
+                        tzinfo=ZoneInfo('Europe/London')).timestamp())
+
+
+def day_forecast(day: date) -> DayForecast:
+    """Returns a fully built DayForecast for day."""
+    period = AuroraPeriod(start=london(day, 21, 0), end=london(day, 23, 59),
+                          colour='yellow', kp=3.0)
+    return DayForecast(
+        date=day,
+        sun=SunDay(array('q', [london(day, 4, 58)] * len(EVENT_NAMES))),
+        lunar=LunarDay(phase=0.5, moonrise=london(day, 1, 55), moonset=None),
+        cloud=CloudDay(cloudcover=5.0, hourly=array('f', [2.0, 8.2])),
+        aurora=(period, period))
+
+
+@pytest.fixture(name='forecast')
+def fixture_forecast(monkeypatch):
+    """Returns one site's forecast, with TODAY as today."""
+    monkeypatch.setattr(output_writer, 'date', FixedDate)
+    monkeypatch.setattr(output_writer, 'TIMEZONE', 'Europe/London')
+    return SiteForecast(lat=51.5, lng=-0.1,
+                        days=[day_forecast(day) for day in DATES],
+                        aurora=AuroraTonight(probability=3, colour='green'))
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing forecast_output() =====
+def test_text_forecast(forecast, tmp_path, monkeypatch):
+    """Test the text file has each day and an hourly cloud line per hour."""
+    monkeypatch.chdir(tmp_path)
+    assert output_writer.forecast_output(forecast) == 0
+    text = (tmp_path / 'Stargazing_Forecast.txt').read_text()
+    assert text.count('FORECAST FOR') == 2
+    assert 'sunrise: 04:58' in text
+    assert 'moonphase: Full moon\nmoonrise: 01:55:00\nmoonset: None' in text
+    assert '01:00 8.2% cloud cover' in text
+    assert 'The probability of seeing the aurora is 3.' in text
+    assert 'Start Time: 2025-05-19 - 21:00' in text
+    assert 'Kp Value: 3\n' in text
+
+
+def test_text_forecast_without_vc_key(forecast, tmp_path, monkeypatch):
+    """Test the missing lunar and cloud forecasts are explained."""
+    monkeypatch.chdir(tmp_path)
+    for day in forecast.days:
+        day.lunar = day.cloud = None
+    output_writer.forecast_output(forecast)
+    assert 'No API key provided for lunar and cloud cover forecasts' in \
+        (tmp_path / 'Stargazing_Forecast.txt').read_text()
+
+
+def test_text_forecast_with_failed_apis(forecast, tmp_path, monkeypatch):
+    """Test the forecasts of providers that failed are marked unavailable."""
+    monkeypatch.chdir(tmp_path)
+    forecast.failed = ['sun', 'visualcrossing']
+    forecast.aurora = None
+    for day in forecast.days:
+        day.sun = day.lunar = day.cloud = None
+    forecast.days[0].aurora = ()
+    output_writer.forecast_output(forecast)
+    text = (tmp_path / 'Stargazing_Forecast.txt').read_text()
+    assert text.startswith('UNAVAILABLE: sun, visualcrossing')
+    assert text.count('The sun and twilight forecast is unavailable') == 2
+    assert text.count('The lunar and cloud cover forecasts are '
+                      'unavailable') == 2
+    # Tomorrow still has its part of the three-day forecast
+    assert text.count('The aurora forecast is unavailable') == 1
+    assert 'Start Time: 2025-05-19 - 21:00' in text
+
+
+# ===== Testing forecast_record() =====
+def test_record_is_json_ready(forecast):
+    """Test the record formats the times and can be dumped as JSON."""
+    record = json.loads(json.dumps(output_writer.forecast_record(forecast)))
+    assert record['sun']['2025-05-18']['sunrise'] == '04:58'
+    assert record['cloud']['2025-05-19']['hourly_cloudcover'] == [2.0, 8.2]
+    assert record['aurora'] == {'Probability': 3, 'Colour': 'green'}
+    assert record['aurora_3day']['2025-05-18'][0]['End Time'] == \
+        '2025-05-18 - 23:59'
+
+
+def test_record_keeps_periods_without_tonight(forecast):
+    """Test the three-day periods are kept when tonight's call failed."""
+    forecast.aurora = None
+    forecast.days[1].aurora = ()
+    record = output_writer.forecast_record(forecast)
+    assert record['aurora'] is None
+    assert len(record['aurora_3day']['2025-05-18']) == 2
+    assert record['aurora_3day']['2025-05-19'] is None
+
+
+# ===== Testing forecast_rows() =====
+def test_rows_are_one_per_day(forecast):
+    """Test each day is flattened with today's aurora probability."""
+    today, tomorrow = output_writer.forecast_rows(forecast)
+    assert list(today) == output_writer.ROW_FIELDS
+    assert today['hourly_cloudcover'] == [2.0, 8.2]
+    assert (today['aurora_probability'], today['aurora_colour']) == \
+        (3, 'green')
+    assert (tomorrow['aurora_probability'], tomorrow['aurora_colour'],
+            tomorrow['aurora_kp']) == (None, 'yellow', 3.0)
+
+
+def test_rows_with_failed_forecasts(forecast):
+    """Test missing forecasts are left empty rather than raising."""
+    forecast.days = forecast.days[:1]
+    forecast.days[0].lunar = forecast.days[0].cloud = None
+    forecast.aurora = None
+    forecast.failed = ['visualcrossing', 'aurora']
+    (row,) = output_writer.forecast_rows(forecast)
+    assert row['sunrise'] == '04:58' and row['moonphase'] is None
+    assert row['failed'] == 'visualcrossing;aurora'
+
+
+# ===== Testing write_forecasts() =====
+def test_every_format_in_one_pass(forecast, tmp_path):
+    """Test a generator of forecasts is written to every format."""
+    writers = output_writer.open_writers(['ndjson', 'csv', 'text'],
+                                         str(tmp_path / 'out.jsonl'))
+    forecasts = (SiteForecast(lat=1.0, lng=2.0, days=forecast.days,
+                              aurora=forecast.aurora, site_id=site_id)
+                 for site_id in ('a', 'b'))
+    assert output_writer.write_forecasts(forecasts, writers) == 2
+    for writer in writers:
+        writer.close()
+    lines = (tmp_path / 'out.jsonl').read_text().splitlines()
+    assert [json.loads(line)['site_id'] for line in lines] == ['a', 'b']
+    with open(tmp_path / 'out.csv', encoding='utf-8') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 4
+    assert json.loads(rows[0]['hourly_cloudcover']) == [2.0, 8.2]
+    assert (tmp_path / 'out.txt').read_text().startswith('SITE a (1.0, 2.0)')
+
+
+def test_parquet(forecast, tmp_path):
+    """Test the Parquet file has one row per site and day."""
+    parquet = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'out.parquet')
+    with output_writer.ParquetWriter(path) as writer:
+        writer.write(forecast)
+    assert parquet.read_table(path).num_rows == 2
+
+
+def test_unknown_format():
+    """Test an unknown format is rejected before any file is opened."""
+    with pytest.raises(ValueError):
+        output_writer.open_writers(['xml'], 'out.xml')
@@ -0,0 +1,35 @@
+"""Tests for the prefetcher that keeps the response cache warm."""
+###############################################################################
+# IMPORTS
+###############################################################################
+from app import prefetch
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing warm() =====
+def test_each_forecast_is_built_once(tmp_path, monkeypatch):
+    """Test sites sharing a location and length are built once."""
+    sites = tmp_path / 'sites.csv'
+    sites.write_text('site_id,lat,lng,days\n'
+                     'a,51.5,-0.1,2\n'
+                     'b,51.5,-0.1,2\n'
+                     'c,55.9,-3.2,1\n', encoding='utf-8')
+    built = []
+    monkeypatch.setattr(prefetch, 'forecast_site',
+                        lambda *args: built.append(args))
+    assert prefetch.warm(str(sites), 'xxx') == 2
+    assert built == [('xxx', 51.5, -0.1, 2), ('xxx', 55.9, -3.2, 1)]
+
+
+# ===== Testing prefetch() =====
+def test_expiring_responses_are_refreshed_each_cycle(monkeypatch):
+    """Test each cycle refreshes the configured providers' responses."""
+    looks = []
+    monkeypatch.setattr(prefetch, 'PREFETCH_PROVIDERS', ('cloud', 'aurora'))
+    monkeypatch.setattr(prefetch, 'refresh_expiring',
+                        lambda providers, lead: looks.append(
+                            (providers, lead)) or 2)
+    assert prefetch.prefetch(cycles=3, interval=0, lead=300) == 6
+    assert looks == [(('cloud', 'aurora'), 300)] * 3
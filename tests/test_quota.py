@@ -0,0 +1,112 @@
+"""Tests for the Visual Crossing quota, its ledger and rate limit."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+
+import pytest
+from apis import quota, resilience
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(name='ledger')
+def fixture_ledger(tmp_path):
+    """Returns an empty Ledger in a temporary file."""
+    return quota.Ledger(str(tmp_path / 'ledger.sqlite3'))
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing request_cost() =====
+@pytest.mark.parametrize('include, expected', [
+    ('days', 3),
+    ('days,hours', 72),
+])
+def test_hours_cost_a_record_each(include, expected):
+    """Test a request costs a record per day, or per hour with the hours."""
+    assert quota.request_cost({'include': include}, 3) == expected
+
+
+# ===== Testing TokenBucket =====
+def test_bucket_waits_to_refill():
+    """Test records beyond the burst wait for the bucket to refill."""
+    bucket = quota.TokenBucket(rate=100, capacity=10)
+    start = time.perf_counter()
+    assert bucket.take(10)
+    assert time.perf_counter() - start < 0.02
+    assert bucket.take(5)
+    assert time.perf_counter() - start >= 0.04
+
+
+def test_bucket_keeps_to_the_deadline():
+    """Test a wait that would pass the deadline is refused."""
+    bucket = quota.TokenBucket(rate=1, capacity=1)
+    assert bucket.take(1)
+    with resilience.deadline(0.1):
+        assert not bucket.take(1)
+    assert quota.TokenBucket(rate=0, capacity=0).take(1000)
+
+
+# ===== Testing Ledger =====
+def test_ledger_is_kept_for_the_day(ledger):
+    """Test the records are saved for later runs on the same day."""
+    ledger.add('secret-key', 30)
+    ledger.add('secret-key', -10)
+    assert quota.Ledger(ledger.path).used('secret-key') == 20
+    with open(ledger.path, 'rb') as ledger_file:
+        assert b'secret-key' not in ledger_file.read()
+
+
+def test_ledger_starts_again_each_day(ledger, monkeypatch):
+    """Test the records of an earlier day are not used."""
+    monkeypatch.setattr(quota, 'today', lambda: '2000-01-01')
+    ledger.add('a', 500)
+    monkeypatch.undo()
+    assert ledger.used('a') == 0
+    assert quota.Ledger(ledger.path).used('a') == 0
+
+
+def test_ledgers_sharing_a_file_keep_to_the_limit(ledger):
+    """Test two ledgers on one file, as in two processes, share a limit."""
+    other = quota.Ledger(ledger.path)
+    pools = [quota.Quota(shared, quota.TokenBucket(0, 0), daily_records=100,
+                         keys=()) for shared in (ledger, other)]
+    granted = [pools[turn % 2].acquire('a', 20)[0] for turn in range(8)]
+    assert granted.count('a') == 5
+    assert ledger.used('a') == other.used('a') == 100
+
+
+# ===== Testing Quota =====
+def test_keys_are_used_in_turn(ledger):
+    """Test each request takes its records from the next key of the pool."""
+    pool = quota.Quota(ledger, quota.TokenBucket(0, 0), daily_records=100,
+                       keys=('b', 'c', 'a'))
+    assert pool.pool('a') == ('a', 'b', 'c')
+    assert [pool.acquire('a', 10)[0] for _ in range(4)] == \
+        ['a', 'b', 'c', 'a']
+    assert ledger.used('a') == 20
+    assert pool.remaining('a') == 260
+
+
+def test_exhausted_keys_are_skipped(ledger):
+    """Test keys without enough records left are passed over."""
+    pool = quota.Quota(ledger, quota.TokenBucket(0, 0), daily_records=30,
+                       keys=('b',))
+    ledger.add('a', 20)
+    assert pool.acquire('a', 20) == ('b', None)
+    assert pool.acquire('a', 20) == (None, 'QuotaExhausted')
+    pool.settle('b', 20, 5)
+    assert pool.remaining('a') == 35
+
+
+def test_rate_limited_records_are_given_back(ledger):
+    """Test records taken for a request the rate limit refused are refunded."""
+    bucket = quota.TokenBucket(rate=1, capacity=10)
+    bucket.take(10)
+    pool = quota.Quota(ledger, bucket, daily_records=100, keys=())
+    with resilience.deadline(0.1):
+        assert pool.acquire('a', 10) == (None, 'RateLimited')
+    assert ledger.used('a') == 0
@@ -0,0 +1,137 @@
+"""Tests for the registry of backends and the hedged requests."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+
+import pytest
+import metrics
+from apis import registry, resilience
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(autouse=True, name='hedging')
+def fixture_hedging(monkeypatch):
+    """
+    Hedges the 'test' kind after 0.05 seconds, with no backends registered
+    and no latencies or metrics recorded.
+    """
+    monkeypatch.setattr(registry, '_BACKENDS', {})
+    monkeypatch.setattr(registry, 'HEDGE_KINDS', ('test',))
+    monkeypatch.setattr(registry, 'HEDGE_INITIAL_DELAY', 0.05)
+    monkeypatch.setattr(registry, 'HEDGE_MIN_DELAY', 0.01)
+    registry.reset_latencies()
+    metrics.registry.reset()
+    yield
+    registry.reset_latencies()
+    metrics.registry.reset()
+
+
+def answers(kind):
+    """Returns the hedges and answers recorded for kind."""
+    return metrics.run_summary()['hedging'].get(kind, {})
+
+
+def slow(value, seconds=0.5):
+    """Returns a call that answers value after seconds."""
+    def call(**_kwargs):
+        time.sleep(seconds)
+        return value
+    return call
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing register() =====
+def test_register_keeps_order_and_replaces_names():
+    """Test backends are tried in order, and a name is only kept once."""
+    registry.register('test', 'first')(slow(1))
+    registry.register('test', 'second', source='cache')(slow(2))
+    registry.register('test', 'first')(slow(3))
+    assert [(backend.name, backend.source)
+            for backend in registry.backends('test')] == \
+        [('second', 'cache'), ('first', 'offline')]
+    assert not registry.backends('other')
+
+
+# ===== Testing Latencies =====
+def test_hedge_delay_uses_the_percentile(monkeypatch):
+    """Test the delay is the percentile once there are enough latencies."""
+    monkeypatch.setattr(registry, 'HEDGE_MIN_SAMPLES', 10)
+    monkeypatch.setattr(registry, 'HEDGE_PERCENTILE', 90)
+    latencies = registry.Latencies()
+    for seconds in range(1, 10):
+        latencies.record(seconds / 100)
+    assert latencies.hedge_delay() == 0.05
+    latencies.record(0.10)
+    assert latencies.hedge_delay() == pytest.approx(0.10)
+    monkeypatch.setattr(registry, 'HEDGE_MIN_DELAY', 0.5)
+    assert latencies.hedge_delay() == 0.5
+
+
+# ===== Testing fetch() =====
+def test_slow_remote_is_not_replaced_by_a_backend():
+    """Test a slow remote call is hedged by itself, not the backends."""
+    calls = []
+    registry.register('test', 'offline')(
+        lambda **kwargs: calls.append(kwargs) or 'estimate')
+    assert registry.fetch('test', slow('remote', 0.2), lat=1.0) == 'remote'
+    assert not calls
+    assert answers('test') == {'hedged': 1, 'remote': 1}
+
+
+def test_fast_remote_is_not_hedged():
+    """Test nothing else is started when the remote call answers in time."""
+    calls = []
+    registry.register('test', 'offline')(
+        lambda **kwargs: calls.append(kwargs))
+    assert registry.fetch('test', slow('remote', 0.0), lat=1.0) == 'remote'
+    assert not calls
+    assert answers('test') == {'remote': 1}
+    assert len(registry.latencies('test').samples) == 1
+
+
+def test_remote_is_hedged_by_itself_and_the_loser_cancelled():
+    """
+    Test the same request is sent again when there's no other backend, and
+    the one that loses the race is cancelled.
+    """
+    calls = []
+
+    def remote(**_kwargs):
+        calls.append(time.perf_counter())
+        time.sleep(0.3 if len(calls) == 1 else 0.0)
+        return 'cancelled' if resilience.cancelled() else len(calls)
+
+    assert registry.fetch('test', remote) == 2
+    time.sleep(0.4)
+    assert len(calls) == 2
+    assert answers('test') == {'hedged': 1, 'remote_hedge': 1}
+
+
+def test_failed_remote_fails_over_at_once(monkeypatch):
+    """Test the next backend starts at once when the remote call fails."""
+    monkeypatch.setattr(registry, 'HEDGE_INITIAL_DELAY', 5)
+    registry.register('test', 'offline')(slow('estimate', 0.0))
+    start = time.perf_counter()
+    assert registry.fetch('test', slow(None, 0.0)) == 'estimate'
+    assert time.perf_counter() - start < 1
+    assert answers('test') == {'offline': 1}
+
+
+def test_unhedged_kind_only_fails_over():
+    """Test a kind that isn't hedged waits for its remote call."""
+    registry.register('quota', 'offline')(slow('estimate', 0.0))
+    assert registry.fetch('quota', slow('remote', 0.2)) == 'remote'
+    assert registry.fetch('quota', slow(None, 0.0)) == 'estimate'
+    assert answers('quota') == {'remote': 1, 'offline': 1}
+
+
+def test_nothing_answers():
+    """Test None is returned when every backend fails."""
+    registry.register('test', 'offline')(slow(None, 0.0))
+    assert registry.fetch('test', slow(None, 0.1)) is None
+    assert answers('test') == {'hedged': 1, 'none': 1}
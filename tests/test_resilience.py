@@ -0,0 +1,94 @@
+"""Tests for the retries, circuit breakers and deadlines."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.apis import resilience
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing CircuitBreaker =====
+def test_breaker_opens_after_threshold(monkeypatch):
+    """Test calls are refused after threshold failures in a row."""
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, 'monotonic', lambda: now[0])
+    breaker = resilience.CircuitBreaker('sun', threshold=2, cooldown=30)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    now[0] += 31
+    # One trial call is let through once it has cooled down
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again(monkeypatch):
+    """Test a failed trial call opens the circuit for another cooldown."""
+    now = [100.0]
+    monkeypatch.setattr(resilience.time, 'monotonic', lambda: now[0])
+    breaker = resilience.CircuitBreaker('sun', threshold=1, cooldown=30)
+    breaker.failure()
+    now[0] += 31
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    now[0] += 31
+    assert breaker.allow()
+
+
+def test_breakers_are_per_provider():
+    """Test each provider has its own breaker until they are reset."""
+    sun = resilience.breaker_for('sun')
+    assert resilience.breaker_for('sun') is sun
+    assert resilience.breaker_for('aurora') is not sun
+    resilience.reset_breakers()
+    assert resilience.breaker_for('sun') is not sun
+
+
+# ===== Testing backoff_delay() =====
+def test_backoff_is_jittered_and_capped(monkeypatch):
+    """Test the delay is random, doubles each attempt and is capped."""
+    monkeypatch.setattr(resilience, 'RETRY_BASE_DELAY', 0.5)
+    monkeypatch.setattr(resilience, 'RETRY_MAX_DELAY', 3.0)
+    monkeypatch.setattr(resilience.random, 'uniform', lambda low, high: high)
+    assert [resilience.backoff_delay(attempt) for attempt in range(4)] == \
+        [0.5, 1.0, 2.0, 3.0]
+
+
+# ===== Testing deadline() and in_context() =====
+def test_deadline_reaches_pool_threads():
+    """Test tasks run with in_context see the deadline they were given."""
+    assert resilience.time_left() is None
+    with resilience.deadline(10), ThreadPoolExecutor(2) as executor:
+        left = list(executor.map(
+            resilience.in_context(lambda _: resilience.time_left()),
+            range(4)))
+        plain = executor.submit(resilience.time_left).result()
+    assert all(9 < seconds <= 10 for seconds in left)
+    assert plain is None
+    assert resilience.time_left() is None
+
+
+def test_inner_deadline_cannot_extend_outer():
+    """Test a nested deadline keeps the earlier of the two."""
+    with resilience.deadline(1):
+        with resilience.deadline(60):
+            assert resilience.time_left() <= 1
+        with resilience.deadline(0):
+            assert resilience.time_left() <= 1
+    with resilience.deadline(0):
+        assert resilience.time_left() is None
+
+
+def test_deadline_runs_out():
+    """Test the time left goes below zero once the deadline has passed."""
+    with resilience.deadline(0.01):
+        time.sleep(0.02)
+        assert resilience.time_left() < 0
@@ -0,0 +1,178 @@
+"""Tests for the on-disk API response cache."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import time
+
+import pytest
+from app.apis import response_cache
+from app.apis.response_cache import ResponseCache
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+TTLS = {'sun': 60, 'aurora': -1}
+
+# Seconds an expired aurora response may still be served
+STALE = {'aurora': 60}
+
+
+@pytest.fixture(name='cache')
+def fixture_cache(tmp_path):
+    """Returns an empty cache in a temporary folder."""
+    return ResponseCache(str(tmp_path / 'cache' / 'responses.sqlite3'),
+                         max_entries=2, ttls=TTLS)
+
+
+@pytest.fixture(name='stale_cache')
+def fixture_stale_cache(tmp_path, monkeypatch):
+    """
+    Returns an empty shared cache in a temporary folder, where expired
+    aurora responses are served for STALE seconds.
+    """
+    cache = ResponseCache(str(tmp_path / 'cache' / 'responses.sqlite3'),
+                          max_entries=10, ttls=TTLS, stale=STALE)
+    monkeypatch.setattr(response_cache, 'get_cache', lambda: cache)
+    return cache
+
+
+def wait_for(condition) -> bool:
+    """Waits up to two seconds for condition() to be true."""
+    ends = time.monotonic() + 2
+    while not condition() and time.monotonic() < ends:
+        time.sleep(0.01)
+    return condition()
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing make_key() =====
+def test_key_quantises_coordinates(cache):
+    """Test nearby coordinates share a key and the API key is left out."""
+    first = cache.make_key('sun', 51.501, -0.121,
+                           {'lat': 51.501, 'key': 'a', 'date': '2025-05-18'})
+    second = cache.make_key('sun', 51.499, -0.119,
+                            {'lat': 51.499, 'key': 'b', 'date': '2025-05-18'})
+    assert first == second
+    assert 'key' not in first
+
+
+def test_key_depends_on_params(cache):
+    """Test different params give different keys."""
+    assert cache.make_key('aurora', 1, 1, {'data': 'probability'}) != \
+        cache.make_key('aurora', 1, 1, {'data': 'threeday'})
+
+
+# ===== Testing get() and set() =====
+def test_get_returns_stored_value(cache):
+    """Test a stored response is returned and counted as a hit."""
+    cache.set('a', 'sun', {'results': {'sunrise': '5:00:00 AM'}})
+    assert cache.get('a', 'sun') == {'results': {'sunrise': '5:00:00 AM'}}
+    assert cache.get('b', 'sun') is None
+    assert cache.stats['sun'] == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_expired_entries_are_misses(cache):
+    """Test an entry past its provider's TTL is not returned."""
+    cache.set('a', 'aurora', {'value': 3})
+    assert cache.get('a', 'aurora') is None
+
+
+def test_least_recently_used_is_evicted(cache):
+    """Test the least recently used entry is dropped over max_entries."""
+    cache.set('a', 'sun', {'n': 1})
+    cache.set('b', 'sun', {'n': 2})
+    cache.get('a', 'sun')
+    cache.set('c', 'sun', {'n': 3})
+    assert cache.get('b', 'sun') is None
+    assert cache.get('a', 'sun') == {'n': 1}
+    assert cache.stats['sun']['evictions'] == 1
+
+
+# ===== Testing cached_api_call() =====
+def test_cached_api_call_fetches_once(cache, monkeypatch):
+    """Test a second identical call is served without fetching."""
+    monkeypatch.setattr(response_cache, 'get_cache', lambda: cache)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'results': {}}
+
+    for _ in range(2):
+        response_cache.cached_api_call('sun', 1.0, 2.0,
+                                       {'date': '2025-05-18'}, fetch)
+    assert len(calls) == 1
+
+
+def test_failed_calls_are_not_cached(cache, monkeypatch):
+    """Test a None response is not stored."""
+    monkeypatch.setattr(response_cache, 'get_cache', lambda: cache)
+    for _ in range(2):
+        assert response_cache.cached_api_call('sun', 1.0, 2.0, {},
+                                              lambda: None) is None
+    assert cache.stats['sun']['misses'] == 2
+
+
+# ===== Testing stale-while-revalidate =====
+def test_stale_response_is_served_then_refreshed(stale_cache):
+    """
+    Test an expired response within the stale limit is returned at once and
+    replaced in the background.
+    """
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    params = {'data': 'probability'}
+    assert response_cache.cached_api_call('aurora', 1.0, 2.0, params,
+                                          fetch) == {'value': 1}
+    # Expired straight away, but served while it is refreshed
+    assert response_cache.cached_api_call('aurora', 1.0, 2.0, params,
+                                          fetch) == {'value': 1}
+    key = stale_cache.make_key('aurora', 1.0, 2.0, params)
+    assert wait_for(lambda: stale_cache.lookup(key, 'aurora')[0] ==
+                    {'value': 2})
+    assert stale_cache.stats['aurora']['stale'] >= 1
+
+
+def test_too_stale_response_is_fetched(stale_cache, monkeypatch):
+    """Test a response past the stale limit is fetched before returning."""
+    monkeypatch.setattr(stale_cache, 'stale', {})
+    values = iter([{'value': 1}, {'value': 2}])
+    for expected in ({'value': 1}, {'value': 2}):
+        assert response_cache.cached_api_call(
+            'aurora', 1.0, 2.0, {}, lambda: next(values)) == expected
+
+
+def test_fresh_only_fetches_a_stale_response(stale_cache):
+    """Test no expired response is served inside fresh_only."""
+    assert stale_cache.stale == STALE
+    values = iter([{'value': 1}, {'value': 2}])
+    with response_cache.fresh_only():
+        for expected in ({'value': 1}, {'value': 2}):
+            assert response_cache.cached_api_call(
+                'aurora', 1.0, 2.0, {}, lambda: next(values)) == expected
+
+
+def test_expiring_responses_are_prefetched(stale_cache):
+    """
+    Test the responses about to expire are refreshed with the calls that
+    fetched them, and only for the providers asked for.
+    """
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    response_cache.cached_api_call('aurora', 1.0, 2.0, {}, fetch)
+    response_cache.cached_api_call('sun', 1.0, 2.0, {}, fetch)
+    assert len(stale_cache.expiring(('aurora', 'sun'), 120)) == 2
+    assert response_cache.refresh_expiring(('cloud',), 120) == 0
+    assert response_cache.refresh_expiring(('aurora',), 10) == 1
+    assert wait_for(lambda: len(calls) == 3)
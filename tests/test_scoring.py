@@ -0,0 +1,113 @@
+"""Tests for the stargazing score engine."""
+###############################################################################
+# IMPORTS
+###############################################################################
+from array import array
+from datetime import date
+
+import numpy as np
+from app import forecast_builder
+from app.forecast_model import SunDay, DayForecast, SiteForecast
+from app.scoring import Timeline, best_windows, score_timeline
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+HOUR = 3600
+# A new moon, so the moon barely lightens the sky
+NEW_MOON = date(2025, 1, 29)
+MIDNIGHT = int(np.datetime64(NEW_MOON, 's').astype(np.int64))
+# Sunrise 08:00, sunset 16:00, then 1 hour per twilight
+SUN_HOURS = (8, 16, 7, 17, 6, 18, 5, 19)
+
+
+def timeline(rows: int = 1, cloud: float = 0.0, kp: float = np.nan,
+             lat: float = 0.0) -> Timeline:
+    """Returns a timeline of identical nights starting at NEW_MOON."""
+    hour_starts = MIDNIGHT + np.arange(48) * float(HOUR)
+    return Timeline(
+        hour_starts=np.tile(hour_starts, (rows, 1)),
+        sun_times=np.tile([MIDNIGHT + hour * HOUR for hour in SUN_HOURS],
+                          (rows, 1)).astype(np.float64),
+        cloud=np.full((rows, 48), cloud),
+        kp=np.full((rows, 48), kp),
+        lats=np.full(rows, lat),
+        lngs=np.zeros(rows))
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing best_windows() =====
+def test_best_window_has_highest_total():
+    """Test the longer good run beats the single best hour."""
+    scores = np.array([[90, 0, 70, 70, 70, 0, 0, 0],
+                       [10, 20, 30, 40, 50, 40, 30, 20]], dtype=np.float32)
+    hour_starts = np.tile(np.arange(8) * float(HOUR), (2, 1))
+    windows = best_windows(scores, hour_starts)
+    assert windows['start'][0] == 2 * HOUR
+    assert windows['end'][0] == 5 * HOUR
+    assert windows['score'][0] == 70.0
+    # No hour scores GOOD_SCORE
+    assert np.isnan(windows['start'][1]) and np.isnan(windows['score'][1])
+
+
+# ===== Testing score_timeline() =====
+def test_clear_dark_night_scores_highest():
+    """Test a clear, moonless night peaks after dusk and is 0 by day."""
+    scores = score_timeline(timeline())
+    hourly = scores['scores'][0]
+    # The scored hours start at noon, so midnight is the 12th
+    assert hourly[0] == 0.0
+    assert hourly[12] > 95.0
+    # Astronomical twilight, which scores 80, runs from 18:00 to 06:00
+    assert scores['start'][0] == MIDNIGHT + 18 * HOUR
+    assert scores['end'][0] == MIDNIGHT + 30 * HOUR
+
+
+def test_cloud_lowers_the_score():
+    """Test half cloud cover halves the score."""
+    clear = score_timeline(timeline())['peak'][0]
+    cloudy = score_timeline(timeline(cloud=50.0))['peak'][0]
+    assert np.isclose(cloudy, clear / 2, atol=0.1)
+
+
+def test_unknown_cloud():
+    """Test a night without clouds is clear, but a missing hour isn't."""
+    clear = score_timeline(timeline())
+    unknown = score_timeline(timeline(cloud=np.nan))
+    assert unknown['peak'][0] == clear['peak'][0]
+    partial = timeline()
+    partial.cloud[0, 24:] = np.nan
+    scores = score_timeline(partial)['scores'][0]
+    assert scores[11] > 0.0 and not scores[12:].any()
+
+
+def test_aurora_raises_the_score():
+    """Test a strong storm lifts a partly cloudy night near the pole."""
+    quiet = score_timeline(timeline(cloud=50.0, lat=65.0))
+    storm = score_timeline(timeline(cloud=50.0, kp=7.0, lat=65.0))
+    assert storm['peak'][0] > quiet['peak'][0]
+
+
+def test_scores_every_row():
+    """Test many sites are scored together, one row each."""
+    scores = score_timeline(timeline(rows=1000))
+    assert scores['scores'].shape == (1000, 24)
+    assert np.all(scores['peak'] == scores['peak'][0])
+
+
+# ===== Testing analyse_nights() =====
+def test_analyse_nights_scores_without_clouds(monkeypatch):
+    """Test a night without a cloud forecast still gets a score."""
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'UTC')
+    sun = SunDay(array('q', [MIDNIGHT + hour * HOUR for hour in SUN_HOURS]))
+    forecast = SiteForecast(lat=0.0, lng=0.0, days=[
+        DayForecast(date=NEW_MOON, sun=sun)])
+    forecast_builder.analyse_nights([forecast])
+    score = forecast.days[0].score
+    assert len(score.hourly) == 24
+    assert score.window_start == MIDNIGHT + 18 * HOUR
+    assert score.window_end == MIDNIGHT + 30 * HOUR
+    assert score.peak > 95.0
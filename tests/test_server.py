@@ -0,0 +1,131 @@
+"""Tests for the local HTTP forecast service."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+from app import server
+from app.forecast_model import SiteForecast
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+@pytest.fixture(name='base_url')
+def fixture_base_url(monkeypatch):
+    """
+    Starts a server on a free port with forecast_site replaced by a fake and
+    returns its base url.
+    """
+    def fake_forecast_site(_vc_api_key, lat, lng, _days):
+        return SiteForecast(lat=lat, lng=lng, days=[],
+                            failed=[] if lat > 0 else ['aurora'])
+
+    monkeypatch.setattr(server, 'forecast_site', fake_forecast_site)
+    forecast_server = server.ForecastServer(
+        ('127.0.0.1', 0), cache=server.ForecastCache(8, 60))
+    thread = threading.Thread(target=forecast_server.serve_forever,
+                              daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{forecast_server.server_port}'
+    forecast_server.shutdown()
+    forecast_server.server_close()
+
+
+def get_json(url: str) -> dict:
+    """Requests url and decodes the JSON response."""
+    with urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing ForecastCache =====
+def test_cache_evicts_least_recently_used():
+    """Test the oldest unused entry is dropped when the cache is full."""
+    cache = server.ForecastCache(2, 60)
+    for key in ('a', 'b'):
+        cache.get(key, lambda key=key: (key.encode(), True))
+    cache.get('a', None)
+    cache.get('c', lambda: (b'c', True))
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.stats['evictions'] == 1
+
+
+def test_cache_coalesces_concurrent_builds():
+    """Test concurrent requests for one key wait for a single build."""
+    cache = server.ForecastCache(8, 60)
+    builds = []
+
+    def slow_build():
+        builds.append(1)
+        time.sleep(0.2)
+        return b'body', True
+
+    with ThreadPoolExecutor(5) as executor:
+        bodies = list(executor.map(lambda _: cache.get('key', slow_build),
+                                   range(5)))
+    assert bodies == [b'body'] * 5
+    assert len(builds) == 1
+
+
+def test_cache_skips_failed_builds():
+    """Test bodies that aren't cacheable are rebuilt next time."""
+    cache = server.ForecastCache(8, 60)
+    cache.get('key', lambda: (b'partial', False))
+    assert cache.get('key', lambda: (b'full', True)) == b'full'
+
+
+# ===== Testing the HTTP API =====
+def test_forecast_is_served_then_cached(base_url):
+    """Test a forecast is returned and a repeat request is a cache hit."""
+    url = f'{base_url}/forecast?lat=51.501&lng=-0.1&days=2'
+    record = get_json(url)
+    assert record['lat'] == 51.5 and record['failed'] == []
+    get_json(url)
+    assert get_json(f'{base_url}/health') == {'entries': 1,
+                                                'misses': 1, 'hits': 1}
+
+
+@pytest.mark.parametrize('query', ['lat=91&lng=0', 'lng=0', 'lat=1&lng=0&days=9'])
+def test_invalid_query_is_rejected(base_url, query):
+    """Test invalid or missing parameters give a 400 response."""
+    with pytest.raises(HTTPError) as error:
+        get_json(f'{base_url}/forecast?{query}')
+    assert error.value.code == 400
+
+
+def test_failed_build_is_a_server_error(base_url, monkeypatch):
+    """Test an error building the forecast gives a 500 JSON response."""
+    def broken_forecast_site(*_args):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(server, 'forecast_site', broken_forecast_site)
+    with pytest.raises(HTTPError) as error:
+        get_json(f'{base_url}/forecast?lat=1&lng=0')
+    assert error.value.code == 500
+    assert json.loads(error.value.read()) == {
+        'error': 'Could not build the forecast'}
+
+
+def test_metrics_are_served(base_url):
+    """Test /metrics gives the metrics in the Prometheus text format."""
+    with urlopen(f'{base_url}/metrics', timeout=5) as response:
+        assert response.headers['Content-Type'] == \
+            server.PROMETHEUS_CONTENT_TYPE
+        body = response.read().decode()
+    assert '# TYPE stargazer_api_requests_total counter' in body
+
+
+def test_unknown_path_is_not_found(base_url):
+    """Test paths other than /forecast and /health give a 404 response."""
+    with pytest.raises(HTTPError) as error:
+        get_json(f'{base_url}/sites')
+    assert error.value.code == 404
@@ -0,0 +1,129 @@
+"""Tests for the offline solar ephemeris engine."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+from datetime import date
+from datetime import datetime as dt
+from pathlib import Path
+
+import numpy as np
+import pytest
+from app import forecast_builder, output_writer
+from app.apis import sun_api
+from app.ephemeris.solar import solar_events, EVENT_NAMES
+from app.utils.datetime_utils import NO_EVENT_EPOCH
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+# Recorded sunrise-sunset.org responses, formatted in UTC
+FIXTURES = sorted(
+    (Path(__file__).parent / 'fixtures' / 'sunrise_sunset').glob('*.json'))
+
+# Largest allowed difference from the API, in seconds
+TOLERANCE = 60
+
+
+def seconds_after_midnight(timestr: str) -> int:
+    """Converts a 12-hour clock time from the API to seconds."""
+    time_obj = dt.strptime(timestr, '%I:%M:%S %p')
+    return time_obj.hour * 3600 + time_obj.minute * 60 + time_obj.second
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing solar_events() =====
+@pytest.mark.parametrize('fixture_path', FIXTURES, ids=lambda path: path.stem)
+def test_matches_recorded_responses(fixture_path):
+    """Test every event is within TOLERANCE of a recorded API response."""
+    recorded = json.loads(fixture_path.read_text(encoding='utf-8'))
+    request = recorded['request']
+    day = np.datetime64(request['date'])
+    events = solar_events(day, request['lat'], request['lng'])
+    for name in EVENT_NAMES:
+        computed = events[name] - day.astype('datetime64[s]').astype(float)
+        expected = seconds_after_midnight(recorded['response']['results'][name])
+        assert abs(computed - expected) <= TOLERANCE, name
+
+
+def test_events_are_vectorised():
+    """Test dates and locations broadcast to a (days, sites) result."""
+    dates = np.arange('2025-01-01', '2025-01-04',
+                      dtype='datetime64[D]')[:, None]
+    events = solar_events(dates, np.array([51.5, 0.0, -33.9]),
+                          np.array([-0.1, 0.0, 151.2]))
+    assert list(events) == EVENT_NAMES
+    assert events['sunrise'].shape == (3, 3)
+    assert np.all(events['sunrise'] < events['sunset'])
+
+
+def test_missing_events_are_nan():
+    """Test astronomical twilight never ends in a London summer."""
+    events = solar_events(np.datetime64('2025-06-21'), 51.5, -0.1)
+    assert np.isnan(events['astronomical_twilight_end'])
+    assert not np.isnan(events['nautical_twilight_end'])
+
+
+# ===== Testing sun_forecast_build() with the local backend =====
+def test_local_backend_matches_api_shape(monkeypatch):
+    """Test the local backend gives the same times as the API path."""
+    monkeypatch.setattr(forecast_builder, 'SUN_BACKEND', 'local')
+    monkeypatch.setattr(output_writer, 'TIMEZONE', 'Europe/London')
+    summer, winter = forecast_builder.sun_forecast_build(
+        [date(2025, 6, 21), date(2025, 12, 21)], 51.5074, -0.1278)
+    winter_times = output_writer.sun_times(winter)
+    assert winter_times['sunrise'] == '08:03'
+    assert winter_times['sunset'] == '15:53'
+    # sunrise-sunset.org gives 01:00 in Europe/London for missing events
+    assert summer['astronomical_twilight_end'] == NO_EVENT_EPOCH
+    assert list(winter_times) == EVENT_NAMES
+
+
+# ===== Testing solar_engine_range() =====
+def test_engine_backend_answers_like_the_api(monkeypatch):
+    """Test the registered engine backend gives the local backend's times."""
+    dates = [date(2025, 6, 21), date(2025, 6, 22)]
+    monkeypatch.setattr(forecast_builder, 'TIMEZONE', 'Europe/London')
+    monkeypatch.setattr(sun_api, 'TIMEZONE', 'Europe/London')
+    monkeypatch.setattr(forecast_builder, 'SUN_BACKEND', 'local')
+    local = forecast_builder.sun_forecast_build(dates, 51.5074, -0.1278)
+    monkeypatch.setattr(forecast_builder, 'SUN_BACKEND', 'api')
+    monkeypatch.setattr(forecast_builder, 'sun_range_api_call',
+                        sun_api.solar_engine_range)
+    assert forecast_builder.sun_forecast_build(dates, 51.5074,
+                                               -0.1278) == local
+
+
+# ===== Testing sun_range_request() =====
+def test_ignored_range_is_not_cached(monkeypatch):
+    """
+    Test a single-day answer to a range request is never cached, and the
+    range isn't asked for again.
+    """
+    cached = []
+
+    def fake_cached_api_call(*args):
+        response = args[-1]()
+        if response is not None:
+            cached.append(response)
+        return response
+
+    monkeypatch.setattr(sun_api, 'cached_api_call', fake_cached_api_call)
+    monkeypatch.setattr(sun_api, '_RANGE_UNSUPPORTED', set())
+    monkeypatch.setattr(sun_api, 'get_json',
+                        lambda *args: {'results': [{}, {}]})
+    assert sun_api.sun_range_request(51.5, -0.1, date(2025, 6, 21),
+                                     date(2025, 6, 22)) == [{}, {}]
+    assert len(cached) == 1
+    calls = []
+    monkeypatch.setattr(sun_api, 'get_json',
+                        lambda *args: calls.append(1) or
+                        {'results': {'sunrise': '4:58:00 AM'}})
+    for _ in range(2):
+        assert sun_api.sun_range_request(51.5, -0.1, date(2025, 6, 23),
+                                         date(2025, 6, 24)) is None
+    assert len(cached) == 1
+    assert len(calls) == 1
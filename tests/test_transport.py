@@ -0,0 +1,114 @@
+"""Tests for the record/replay transport and the stub API server."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import json
+import threading
+import time
+
+import pytest
+import requests
+from app import stub_server
+from app.apis import transport
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+SUN_BODY = {'results': {'sunrise': '7:27:02 AM'}, 'status': 'OK'}
+
+
+def recorded(folder, url: str, body: dict, status: int = 200) -> None:
+    """Saves a fixture for url as if it had been recorded."""
+    response = requests.Response()
+    response.status_code = status
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body).encode()  # pylint: disable=protected-access
+    transport.save_fixture(str(folder), url, response)
+
+
+@pytest.fixture(name='stub')
+def fixture_stub(tmp_path):
+    """
+    Returns a function that starts a stub server on a free port serving one
+    recorded sun response, and returns its base url.
+    """
+    servers = []
+    recorded(tmp_path / 'stub', 'https://api.sunrise-sunset.org/json'
+             '?lat=36.7&lng=-4.4', SUN_BODY)
+
+    def start(**kwargs) -> str:
+        server = stub_server.StubServer(('127.0.0.1', 0),
+                                        str(tmp_path / 'stub'), **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def session_with(adapter) -> requests.Session:
+    """Returns a session that sends every request through adapter."""
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing request_key() =====
+def test_request_key_ignores_host_order_and_api_key():
+    """Test the same request to another host with the key shares a key."""
+    assert transport.request_key(
+        'https://weather.example.com/timeline/1,2?key=secret&b=2&a=1') == \
+        transport.request_key('http://127.0.0.1:8081/timeline/1,2?a=1&b=2')
+
+
+# ===== Testing RecordingAdapter and ReplayAdapter =====
+def test_record_then_replay(stub, tmp_path):
+    """Test a recorded response is replayed without the API or its key."""
+    base_url = stub()
+    folder = str(tmp_path / 'recorded')
+    live = session_with(transport.RecordingAdapter(folder))
+    response = live.get(f'{base_url}/json',
+                        params={'lng': -4.4, 'lat': 36.7, 'key': 'secret'})
+    assert response.json() == SUN_BODY
+
+    replay = session_with(transport.ReplayAdapter(folder))
+    response = replay.get('https://api.sunrise-sunset.org/json',
+                          params={'lat': 36.7, 'lng': -4.4})
+    assert response.status_code == 200
+    assert response.json() == SUN_BODY
+    saved = (tmp_path / 'recorded').glob('*.json')
+    assert 'secret' not in next(saved).read_text()
+
+
+def test_replay_of_unrecorded_request(tmp_path):
+    """Test a request that wasn't recorded fails like an unreachable API."""
+    replay = session_with(transport.ReplayAdapter(str(tmp_path)))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        replay.get('https://api.sunrise-sunset.org/json', params={'lat': 1})
+
+
+# ===== Testing StubServer =====
+def test_stub_latency_and_missing_recordings(stub):
+    """Test responses are delayed and unknown requests get a 404."""
+    base_url = stub(latency=(50.0, 0.0))
+    start = time.perf_counter()
+    response = requests.get(f'{base_url}/json?lat=36.7&lng=-4.4', timeout=5)
+    assert time.perf_counter() - start >= 0.05
+    assert response.json() == SUN_BODY
+    assert requests.get(f'{base_url}/json?lat=0', timeout=5).status_code \
+        == 404
+
+
+def test_stub_error_injection(stub):
+    """Test every response fails with an error rate of 1."""
+    base_url = stub(error_rate=1.0)
+    response = requests.get(f'{base_url}/json?lat=36.7&lng=-4.4', timeout=5)
+    assert response.status_code == stub_server.ERROR_STATUS
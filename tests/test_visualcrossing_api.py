@@ -0,0 +1,131 @@
+"""Tests for merging Visual Crossing requests."""
+###############################################################################
+# IMPORTS
+###############################################################################
+import pytest
+from apis import quota
+from app.apis import visualcrossing_api
+from app.apis.visualcrossing_api import coalesce_queries, split_response, \
+    LUNAR_QUERY, CLOUD_QUERY
+
+
+###############################################################################
+# FIXTURES
+###############################################################################
+MERGED_RESPONSE = {
+    'latitude': 51.5,
+    'days': [{'datetime': '2025-05-18',
+              'moonphase': 0.68,
+              'moonrise': '01:41:59',
+              'moonset': '09:17:36',
+              'cloudcover': 60.2,
+              'hours': [{'datetime': '00:00:00', 'cloudcover': 85.0},
+                        {'datetime': '01:00:00', 'cloudcover': 90.2}]}]
+}
+
+
+@pytest.fixture(autouse=True, name='records')
+def fixture_records(tmp_path):
+    """
+    Gives the calls a quota of 100 records a day on a ledger in a temporary
+    file, with no rate limit, and returns the ledger.
+    """
+    ledger = quota.Ledger(str(tmp_path / 'ledger.sqlite3'))
+    quota.set_quota(quota.Quota(ledger, quota.TokenBucket(0, 0),
+                                daily_records=100, keys=()))
+    yield ledger
+    quota.set_quota(None)
+
+
+@pytest.fixture(name='get_json')
+def fixture_get_json(monkeypatch):
+    """
+    Calls the API without the cache, answering every request with
+    MERGED_RESPONSE, and returns the list of (url, params) requested.
+    """
+    calls = []
+
+    def fake_get_json(url, params, *_args):
+        calls.append((url, params))
+        return MERGED_RESPONSE
+
+    monkeypatch.setattr(visualcrossing_api, 'get_json', fake_get_json)
+    monkeypatch.setattr(visualcrossing_api, 'cached_api_call',
+                        lambda *args: args[-1]())
+    return calls
+
+
+###############################################################################
+# TESTS
+###############################################################################
+# ===== Testing coalesce_queries() =====
+def test_queries_are_merged():
+    """Test include and elements are the union of both queries."""
+    assert coalesce_queries([LUNAR_QUERY, CLOUD_QUERY]) == {
+        'include': 'days,hours',
+        'elements': 'datetime,moonphase,moonrise,moonset,cloudcover'}
+
+
+def test_incompatible_queries():
+    """Test queries with different params can't be merged."""
+    with pytest.raises(ValueError, match='Queries differ in unitGroup'):
+        coalesce_queries([{'unitGroup': 'metric'}, {'unitGroup': 'us'}])
+
+
+# ===== Testing split_response() =====
+def test_split_lunar_response():
+    """Test the lunar part has only lunar elements and no hours."""
+    lunar = split_response(MERGED_RESPONSE, LUNAR_QUERY)
+    assert lunar['days'] == [{'datetime': '2025-05-18',
+                              'moonphase': 0.68,
+                              'moonrise': '01:41:59',
+                              'moonset': '09:17:36'}]
+
+
+def test_split_cloud_response():
+    """Test the cloud part has the daily and hourly cloud cover."""
+    cloud = split_response(MERGED_RESPONSE, CLOUD_QUERY)
+    assert cloud['days'] == [{'datetime': '2025-05-18',
+                              'cloudcover': 60.2,
+                              'hours': MERGED_RESPONSE['days'][0]['hours']}]
+    assert cloud['latitude'] == 51.5
+
+
+# ===== Testing lunar_cloud_api_call() =====
+def test_one_request_for_lunar_and_cloud(get_json, records):
+    """Test a single request is made with the merged params."""
+    calls = get_json
+    lunar, cloud = visualcrossing_api.lunar_cloud_api_call(
+        51.5, -0.1, '2025-05-18', '2025-05-18', 'A' * 25)
+    assert len(calls) == 1
+    assert calls[0][1]['include'] == 'days,hours'
+    assert 'hours' not in lunar['days'][0]
+    assert cloud['days'][0]['cloudcover'] == 60.2
+    # A day of hours, as the response gives no queryCost
+    assert records.used('A' * 25) == 24
+
+
+# ===== Testing metered_get() =====
+def test_records_are_corrected_to_the_query_cost(records, monkeypatch):
+    """
+    Test the records taken are corrected to the response's queryCost, and
+    given back if the call failed.
+    """
+    monkeypatch.setattr(visualcrossing_api, 'get_json',
+                        lambda *args: {'queryCost': 30})
+    params = {'key': 'k', 'include': 'days,hours'}
+    assert visualcrossing_api.metered_get('x', params, 2, 'x') == \
+        {'queryCost': 30}
+    assert records.used('k') == 30
+    monkeypatch.setattr(visualcrossing_api, 'get_json', lambda *args: None)
+    assert visualcrossing_api.metered_get('x', params, 2, 'x') is None
+    assert records.used('k') == 30
+
+
+def test_no_request_without_records(get_json, records):
+    """Test nothing is requested once the key's records have run out."""
+    records.add('k', 90)
+    assert visualcrossing_api.cloud_api_call(
+        51.5, -0.1, '2025-05-18', '2025-05-18', 'k') is None
+    assert not get_json
+    assert records.used('k') == 90